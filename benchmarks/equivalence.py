@@ -0,0 +1,518 @@
+'''
+Statistical equivalence checks of sampling fast paths.
+
+Optimized samplers (alias tables, vectorized draws, cached CDFs) consume
+random numbers differently from the code they replace, so their output
+cannot be compared draw for draw. Instead, every check draws many samples
+from a reference implementation, kept here as the straightforward CDF and
+bisect code the modules started from, and from the implementation in the
+modules, and tests whether both come from the same distribution:
+
+    chi-square  Two sample test of homogeneity over the outcomes drawn,
+                with outcomes too rare to test merged together
+    ks          Two sample Kolmogorov-Smirnov test of continuous
+                statistics of the outcomes, e.g. the distance travelled
+
+A check fails when its test rejects equivalence at the significance level
+(--alpha) and the distributions differ by more than a tolerance
+(--tolerance): the total variation distance between the outcome
+frequencies for chi-square tests, or the KS statistic. The tolerance
+keeps very large runs from failing on differences too small to matter.
+
+Outcomes are stratified by the inputs that drive them (e.g. the worker
+profile, or the position in a J2W depletion cycle), so a fast path that
+gets one stratum wrong cannot hide behind the others. Checks:
+
+    get_work_industry           Industry of workers of several profiles,
+                                each on its own, including ones whose income
+                                equals a median income, which perturbs the
+                                income
+    get_work_industries         The same, drawn in batches of workers of
+                                every profile
+    J2WDist.select              Work county, by position in the cycle of
+                                draws that depletes the distribution, and
+                                the draws of every county in half a cycle
+                                (ks)
+    select_location             Patronage place of other trips, and the
+                                distance to it (ks), and the patronage place
+                                drawn for every industry on its own
+    AssignType.get_school_type  School division and type, by age
+    assign_activity_pattern     Activity pattern, by traveler type
+
+Exits with status 1 if any check fails.
+
+Usage:
+    python -m benchmarks.equivalence
+    python -m benchmarks.equivalence -n 200000 -a 0.0001 -k J2WDist
+'''
+
+import sys
+import copy
+import random
+import bisect
+import shutil
+import argparse
+import tempfile
+import collections
+import numpy as np
+from scipy import stats
+from model.utils import core, paths, pixel, distance
+from model.module2 import adjacency, industry
+from model.module3 import assign_county
+from model.module4 import module4
+from model.module5 import find_other_trips
+from benchmarks import synthetic_data
+
+# Buckets of the position of a draw in a J2W depletion cycle
+DEPLETION_BUCKETS = 4
+# Worker incomes of the work industry check, besides a median income
+WORKER_INCOMES = [15000.0, 42000.0, 90000.0, 180000.0]
+# Industries treated as having no employers, for workers of odd profiles
+NO_EMPLOYER_INDUSTRIES = (2, 7, 12)
+# Persons drawn for by the school type check, in a cycle
+SCHOOL_PERSONS = 200
+
+class Check:
+    """Compares a reference sampler with its implementation in the modules.
+
+    Attributes:
+        name (str): Check name, used in reports and to select checks.
+        reference (function): Draws n outcomes with the reference sampler.
+        candidate (function): Draws n outcomes with the implementation in
+            the modules.
+        statistics (function): Maps the outcomes drawn to floats compared
+            with a KS test, or None to only run the chi-square test.
+    """
+
+    def __init__(self, name, reference, candidate, statistics=None):
+        """See class docstring."""
+        self.name = name
+        self.reference = reference
+        self.candidate = candidate
+        self.statistics = statistics
+
+def seed_all(seed):
+    """Seeds the random module and NumPy, which samplers draw from."""
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+def chi_square(reference, candidate, min_expected=5):
+    """Tests whether two samples of outcomes come from the same distribution.
+
+    Inputs:
+        reference, candidate (list): Hashable outcomes.
+        min_expected (int): Outcomes expected fewer times than this in
+            either sample are merged into one, as the test needs.
+
+    Returns:
+        p_value (float): Chance of differences at least as large if both
+            come from the same distribution.
+        distance (float): Total variation distance between the frequencies.
+    """
+    ref_counts = collections.Counter(reference)
+    cand_counts = collections.Counter(candidate)
+    ref_total, cand_total = len(reference), len(candidate)
+    distance = 0.5 * sum(abs(ref_counts[outcome] / ref_total - cand_counts[outcome] / cand_total)
+                         for outcome in set(ref_counts) | set(cand_counts))
+    table = [[], []]
+    rare = [0, 0]
+    for outcome in set(ref_counts) | set(cand_counts):
+        pooled = ref_counts[outcome] + cand_counts[outcome]
+        share = min(ref_total, cand_total) / (ref_total + cand_total)
+        if pooled * share < min_expected:
+            rare[0] += ref_counts[outcome]
+            rare[1] += cand_counts[outcome]
+        else:
+            table[0].append(ref_counts[outcome])
+            table[1].append(cand_counts[outcome])
+    if sum(rare):
+        table[0].append(rare[0])
+        table[1].append(rare[1])
+    if len(table[0]) < 2:
+        # A single outcome is drawn by both
+        return 1.0, distance
+    return stats.chi2_contingency(table)[1], distance
+
+def kolmogorov_smirnov(reference, candidate):
+    """Tests whether two samples of floats come from the same distribution.
+
+    Returns:
+        p_value (float), distance (float): See chi_square(), with the KS
+            statistic as the distance.
+    """
+    result = stats.ks_2samp(reference, candidate)
+    return result.pvalue, result.statistic
+
+def run_check(check, draws, seed):
+    """Draws from both samplers of a check and tests them.
+
+    Returns:
+        results (list): Dictionaries with the check name, test, p-value
+            and distance of every test run.
+    """
+    seed_all(seed)
+    reference = check.reference(draws)
+    # Independent draws, as the tests assume
+    seed_all(seed + 1)
+    candidate = check.candidate(draws)
+    results = []
+    p_value, dist = chi_square(reference, candidate)
+    results.append({'check': check.name, 'test': 'chi-square', 'p_value': p_value,
+                    'distance': dist})
+    if check.statistics is not None:
+        p_value, dist = kolmogorov_smirnov(check.statistics(reference),
+                                           check.statistics(candidate))
+        results.append({'check': check.name, 'test': 'ks', 'p_value': p_value,
+                        'distance': dist})
+    return results
+
+def industry_vectors(inc_emp, work_county, gender):
+    """Returns copies of the employment and median income of every industry
+    of a county for a gender, as read by get_work_industry().
+    """
+    county_idx = inc_emp.get_county_index(work_county)
+    return (inc_emp.all_emp[gender, county_idx].tolist(),
+            inc_emp.all_inc[gender, county_idx].tolist())
+
+def reference_work_industry(empdata, incdata, income, markers):
+    """Draws the industry index of a worker, see industry.get_work_industry()."""
+    for idx, no_employers in enumerate(markers):
+        if no_employers:
+            empdata[idx] = 0.0
+            incdata[idx] = 200000
+    squared = [(x - income)**2 for x in incdata]
+    try:
+        draw_list = [x / y for x, y in zip(empdata, squared)]
+    except ZeroDivisionError:
+        # The perturbed income is taken from the squared differences, as
+        # get_work_industry() has always done
+        squared = [(x - (income + 0.01))**2 for x in squared]
+        draw_list = [x / y for x, y in zip(empdata, squared)]
+    return bisect.bisect(core.cdf(draw_list), random.random())
+
+def reference_j2w_select(counties, workers):
+    """Draws a work county and takes its worker out, see J2WDist.select()."""
+    variate = random.random() * sum(workers)
+    cum = 0.0
+    for count, county in enumerate(counties):
+        cum += workers[count]
+        if variate < cum:
+            workers[count] -= 1
+            return county
+    return county
+
+class ReferenceSchoolType:
+    """Draws school divisions and types, see assign_county.AssignType.
+
+    Attributes:
+        school_pop (dict): See AssignType, updated as students are drawn.
+    """
+
+    def __init__(self, school_pop):
+        """See class docstring."""
+        self.school_pop = school_pop
+
+    def draw(self, age, household_type):
+        if household_type in (2, 3, 4, 5, 7, 8) or age < 5 or age > 24:
+            return 'non student', 'no'
+        if household_type == 6:
+            self.school_pop['postsec']['bach_or_grad'] -= 1
+            return 'on campus college', 'bach_or_grad'
+        if age < 11:
+            return 'elem', self.pub_or_priv('elem')
+        if age < 14:
+            return 'mid', self.pub_or_priv('mid')
+        if age < 19:
+            split = random.random()
+            if age == 18 and split > 0.35:
+                postsec = self.school_pop['postsec']
+                bach_prop = postsec['bach_or_grad'] / sum(postsec.values())
+                type2 = 'bach_or_grad' if random.random() < bach_prop else 'associates'
+                postsec[type2] -= 1
+                return 'college', type2
+            return 'high', self.pub_or_priv('high')
+        postsec = self.school_pop['postsec']
+        split = random.random()
+        total = sum(postsec.values())
+        props = [postsec['bach_or_grad'] / total, postsec['associates'] / total]
+        props.append(1.0 - props[0] - props[1])
+        type2 = ['bach_or_grad', 'associates', 'non_degree'][bisect.bisect(core.cdf(props), split)]
+        postsec[type2] -= 1
+        return 'college', type2
+
+    def pub_or_priv(self, type1):
+        split = random.random()
+        public = self.school_pop['public'][type1]
+        type2 = 'public' if split < public / (public + self.school_pop['private'][type1]) else 'private'
+        self.school_pop[type2][type1] -= 1
+        return type2
+
+def work_industry_checks(fips, inc_emp):
+    """Builds the checks of industry.get_work_industry() and get_work_industries().
+
+    Every worker profile is checked on its own, as a profile whose draws
+    are wrong (e.g. the median income one, which perturbs the income) is
+    a small share of the outcomes of all profiles together.
+    """
+    markers = [False] * len(industry_vectors(inc_emp, fips, 0)[0])
+    odd_markers = [idx in NO_EMPLOYER_INDUSTRIES for idx in range(len(markers))]
+    profiles = []
+    for gender, label in ((0, 'F'), (1, 'M')):
+        for income in WORKER_INCOMES:
+            profiles.append(('%s %d' % (label, income), gender, income, markers))
+        # Income equal to a median income, which takes the ZeroDivisionError path
+        profiles.append((label + ' median', gender,
+                         industry_vectors(inc_emp, fips, gender)[1][0], markers))
+        profiles.append((label + ' odd', gender, WORKER_INCOMES[1], odd_markers))
+        # Income equal to the median income given to industries without
+        # employers, so that the perturbed income decides every draw
+        profiles.append((label + ' odd 200000', gender, 200000.0, odd_markers))
+
+    def profile_checks(name, gender, income, profile_markers):
+        def reference(n):
+            outcomes = []
+            for _ in range(n):
+                empdata, incdata = industry_vectors(inc_emp, fips, gender)
+                outcomes.append(reference_work_industry(empdata, incdata, income,
+                                                        profile_markers))
+            return outcomes
+
+        def candidate(n):
+            return [industry.get_work_industry(fips, gender, income, inc_emp,
+                                               profile_markers)[1] for _ in range(n)]
+
+        def batch_candidate(n):
+            # Workers of a batch share the markers of their work county, and
+            # are mixed with workers of the other profiles that share them
+            batch = [profile for profile in profiles if profile[3] is profile_markers]
+            genders = [profile[1] for _ in range(n) for profile in batch]
+            incomes = [profile[2] for _ in range(n) for profile in batch]
+            indices = industry.get_work_industries(fips, genders, incomes, inc_emp,
+                                                   profile_markers)
+            position = [profile[0] for profile in batch].index(name)
+            return indices[position::len(batch)].tolist()
+
+        return [Check('get_work_industry ' + name, reference, candidate),
+                Check('get_work_industries ' + name, reference, batch_candidate)]
+
+    return [check for profile in profiles for check in profile_checks(*profile)]
+
+def j2w_check(fips, j2w):
+    """Builds the check of adjacency.J2WDist.select(), with depletion."""
+    counties, initial = j2w.flows(fips)
+    flows = dict(zip(counties, initial))
+    total = sum(initial)
+
+    def bucket(draw):
+        return (draw % total) * DEPLETION_BUCKETS // total
+
+    def reference(n):
+        outcomes = []
+        workers = []
+        for draw in range(n):
+            if sum(workers) == 0:
+                workers = list(initial)
+            outcomes.append((bucket(draw), reference_j2w_select(counties, workers)))
+        return outcomes
+
+    def candidate(n):
+        outcomes = []
+        county_flow_dist = adjacency.J2WDist(j2w, fips)
+        for draw in range(n):
+            # Rebuilt once exhausted, as module2.assign_work_counties() does
+            if county_flow_dist.total_workers() == 0:
+                county_flow_dist = adjacency.J2WDist(j2w, fips)
+            outcomes.append((bucket(draw), county_flow_dist.select()))
+        return outcomes
+
+    def half_cycle_counts(outcomes):
+        # Every county is drawn as many times as it has workers over a
+        # cycle, so its draws in half a cycle vary less than independent
+        # draws would, which the marginal frequencies cannot show
+        counts = []
+        for start in range(0, len(outcomes) - total + 1, total):
+            drawn = collections.Counter(county for _, county in outcomes[start:start + total // 2])
+            counts.extend(drawn[county] - flows[county] / 2 for county in counties)
+        return counts
+
+    return Check('J2WDist.select', reference, candidate, half_cycle_counts)
+
+def select_location_checks(fips):
+    """Builds the checks of find_other_trips.GeoAttributes.select_location()."""
+    lat, lon = map(float, adjacency.read_data(fips).coords)
+    x, y = pixel.find_pixel_coords(lat, lon)
+    geo = find_other_trips.GeoAttributes(x, y, fips, 'H')
+    geo.generate_new_dist()
+
+    def reference(n):
+        outcomes = []
+        cdfs = dict()
+        for _ in range(n):
+            indust = geo.select_industry('H', 'H')
+            if indust not in cdfs:
+                cdfs[indust] = core.cdf(geo.pat_place_dist[indust])
+            index = bisect.bisect(cdfs[indust], random.random())
+            place = geo.pat_county.indust_dict[indust].pat_places[index]
+            outcomes.append((place[0], float(place[-2]), float(place[-1].strip('\n'))))
+        return outcomes
+
+    def candidate(n):
+        geo.pat_place_samplers = dict()
+        outcomes = []
+        for _ in range(n):
+            name, _, _, place_lat, place_lon, _ = geo.select_location('H', 'H')
+            outcomes.append((name, place_lat, place_lon))
+        return outcomes
+
+    # Industries without patronage places cannot be drawn from
+    industries = sorted(indust for indust, dist in geo.pat_place_dist.items() if len(dist))
+
+    def place_reference(n):
+        outcomes = []
+        cdfs = {indust: core.cdf(geo.pat_place_dist[indust]) for indust in industries}
+        for draw in range(n):
+            indust = industries[draw % len(industries)]
+            outcomes.append((indust, bisect.bisect(cdfs[indust], random.random())))
+        return outcomes
+
+    def place_candidate(n):
+        geo.pat_place_samplers = dict()
+        return [(industries[draw % len(industries)],
+                 geo.get_pat_place_sampler(industries[draw % len(industries)]).draw())
+                for draw in range(n)]
+
+    return [Check('select_location', reference, candidate,
+                  lambda outcomes: [distance.between_points(lat, lon, place_lat, place_lon)
+                                    for _, place_lat, place_lon in outcomes]),
+            # Industries are drawn with select_location() in proportion to
+            # their patrons, so every industry is also checked on its own
+            Check('select_location.pat_places', place_reference, place_candidate)]
+
+def school_type_check(state, rand):
+    """Builds the check of assign_county.AssignType.get_school_type()."""
+    type_assigner = assign_county.AssignType(state)
+    school_pop = copy.deepcopy(type_assigner.school_pop)
+    persons = [(rand.randint(3, 26), rand.choice((0, 0, 1, 1, 2, 6))) for _ in range(SCHOOL_PERSONS)]
+
+    # Enrollment is taken as students are drawn, so is restored every
+    # time the persons are drawn for, before it runs out
+    def reference(n):
+        outcomes = []
+        for draw in range(n):
+            if draw % len(persons) == 0:
+                assigner = ReferenceSchoolType(copy.deepcopy(school_pop))
+            age, household_type = persons[draw % len(persons)]
+            outcomes.append((age,) + assigner.draw(age, household_type))
+        return outcomes
+
+    def candidate(n):
+        outcomes = []
+        for draw in range(n):
+            if draw % len(persons) == 0:
+                type_assigner.school_pop = copy.deepcopy(school_pop)
+            age, household_type = persons[draw % len(persons)]
+            outcomes.append((age,) + tuple(type_assigner.get_school_type(age, household_type)))
+        return outcomes
+
+    return Check('AssignType.get_school_type', reference, candidate)
+
+def activity_pattern_check():
+    """Builds the check of module4.assign_activity_pattern()."""
+    distributions = module4.read_activity_pattern_dists()
+    samplers = module4.build_activity_pattern_samplers(distributions)
+    cdfs = {traveler_type: core.cdf(dist) for traveler_type, dist in distributions.items()}
+    # Works in the country and has a school, so the traveler type is kept
+    person = ['NA'] * 40
+    person[15], person[-3] = '00001', 'School'
+
+    def reference(n):
+        return [(draw % 7, bisect.bisect(cdfs[draw % 7], random.random())) for draw in range(n)]
+
+    def candidate(n):
+        return [(draw % 7, int(module4.assign_activity_pattern(draw % 7, samplers, person)))
+                for draw in range(n)]
+
+    return Check('assign_activity_pattern', reference, candidate)
+
+def build_checks(fips, state, rand):
+    """Builds every check for a county.
+
+    Inputs:
+        fips (str): 5 digit FIPS code of the county checked.
+        state (str): State name, without spaces, of the county.
+        rand (random.Random): Draws the persons of the school type check.
+
+    Returns:
+        checks (list): Check for every sampler.
+    """
+    return (work_industry_checks(fips, industry.read_employment_income_by_industry())
+            + [j2w_check(fips, adjacency.read_j2w())]
+            + select_location_checks(fips)
+            + [school_type_check(state, rand), activity_pattern_check()])
+
+def print_results(results, alpha, tolerance):
+    print('%-32s %-10s %12s %10s  %s' % ('Check', 'Test', 'p-value', 'Distance', 'Status'))
+    for result in results:
+        print('%-32s %-10s %12.3g %10.4f  %s' % (result['check'], result['test'],
+                                                result['p_value'], result['distance'],
+                                                'FAILED' if failed(result, alpha, tolerance)
+                                                else 'ok'))
+
+def failed(result, alpha, tolerance):
+    """Whether a test rejects equivalence by more than the tolerance."""
+    return result['p_value'] < alpha and result['distance'] > tolerance
+
+def main(args):
+    work_dir = None
+    try:
+        if args.data_root is None:
+            work_dir = tempfile.mkdtemp(prefix='equivalence_')
+            states = synthetic_data.generate(work_dir, args.persons, num_states=1,
+                                             seed=args.seed)
+            fips = args.county or states[0].counties[0].fips
+        else:
+            paths.set_root(args.data_root)
+            if args.county is None:
+                raise ValueError('A county is needed when checking an existing data root')
+            fips = args.county
+        state = [state[0] for state in core.read_states() if state[2] == fips[:2]][0]
+        checks = build_checks(fips, state.replace(' ', ''), random.Random(args.seed))
+        if args.keyword:
+            checks = [check for check in checks
+                      if any(keyword in check.name for keyword in args.keyword)]
+        print('Checking county', fips, 'with', args.number, 'draws per sampler')
+        results = []
+        for check in checks:
+            results.extend(run_check(check, args.number, args.seed))
+        print_results(results, args.alpha, args.tolerance)
+        failures = [result for result in results if failed(result, args.alpha, args.tolerance)]
+        if failures:
+            print(len(failures), 'test(s) failed:',
+                  ', '.join(result['check'] + ' ' + result['test'] for result in failures))
+            return 1
+        print('All samplers are equivalent')
+        return 0
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            paths.set_root(paths.DEFAULT_ROOT)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check optimized samplers against references')
+    parser.add_argument('-n', '--number', type=int, default=50000,
+                        help='Draws per sampler (default: %(default)s)')
+    parser.add_argument('-a', '--alpha', type=float, default=0.001,
+                        help='Significance level of every test (default: %(default)s)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.01,
+                        help='Distance between distributions allowed (default: %(default)s)')
+    parser.add_argument('-d', '--data-root',
+                        help='Existing data root to check (default: a synthetic one)')
+    parser.add_argument('-c', '--county',
+                        help='FIPS code of the county checked (default: the first synthetic one)')
+    parser.add_argument('-p', '--persons', type=int, default=5000,
+                        help='Persons in the synthetic state (default: %(default)s)')
+    parser.add_argument('-k', '--keyword', nargs='+',
+                        help='Only run checks whose name contains a keyword')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: %(default)s)')
+    sys.exit(main(parser.parse_args()))
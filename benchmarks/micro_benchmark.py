@@ -0,0 +1,321 @@
+'''
+Micro-benchmarks for the per-person hot paths of Modules 2 through 5.
+
+Times the inner functions that dominate module runtime, one call at a
+time, on a county of a synthetic data root (see synthetic_data.py), or of
+an existing data root. For every function, reports:
+
+    ops/s       Calls per second, over all timed calls
+    p50, p99    Median and 99th percentile latency of a call
+    alloc       Median peak memory allocated during a call, traced with
+                tracemalloc in a separate, untimed pass
+
+Results can be saved to a JSON file and compared against a saved
+baseline, to see what an optimization changed.
+
+Usage:
+    python -m benchmarks.micro_benchmark -n 10000 -o baseline.json
+    python -m benchmarks.micro_benchmark -n 10000 -b baseline.json
+    python -m benchmarks.micro_benchmark -d D:/Data/ -c 34001 -k select_public_schools
+'''
+
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+from model.utils import core, paths, pixel
+from model.module2 import adjacency, industry, workplace
+from model.module3 import assign_county, school_assigner
+from model.module4 import module4
+from model.module5 import activity, find_other_trips
+from benchmarks import synthetic_data
+
+# Calls traced for allocations, at most
+ALLOCATION_CALLS = 200
+# Workers per call of batched benchmarks, e.g. get_work_industries
+WORKER_BATCH = 1000
+# Activity patterns built by the Pattern benchmark, covering H, W, S and O nodes
+BENCHMARK_PATTERNS = [1, 2, 4, 9, 15, 20]
+
+class Benchmark:
+    """A function timed one call at a time.
+
+    Attributes:
+        name (str): Benchmark name, used in reports and to select benchmarks.
+        function (function): Function timed, called without arguments.
+        prepare (function): Called without arguments before every call of
+            function, outside of the timing, e.g. to draw inputs or reset
+            state. May be None.
+        scale (float): Share of the requested number of calls made, for
+            functions too slow to call as often as the others.
+    """
+
+    def __init__(self, name, function, prepare=None, scale=1.0):
+        """See class docstring."""
+        self.name = name
+        self.function = function
+        self.prepare = prepare
+        self.scale = scale
+
+    def calls(self, number):
+        """Returns the number of calls to make for a requested number."""
+        return max(int(number * self.scale), 10)
+
+def time_calls(benchmark, number):
+    """Times every call of a benchmark, in nanoseconds.
+
+    Garbage collection is disabled while timing, as in timeit.
+    """
+    function, prepare = benchmark.function, benchmark.prepare
+    clock = time.perf_counter_ns
+    times = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(number):
+            if prepare is not None:
+                prepare()
+            start = clock()
+            function()
+            times.append(clock() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return times
+
+def trace_allocations(benchmark, number):
+    """Returns the median peak memory allocated by a call, in bytes."""
+    function, prepare = benchmark.function, benchmark.prepare
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(number):
+            if prepare is not None:
+                prepare()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            function()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return percentile(peaks, 50)
+
+def percentile(values, percent):
+    """Returns a percentile of a list of values, by nearest rank."""
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def run_benchmark(benchmark, number, warmup):
+    """Runs a benchmark.
+
+    Inputs:
+        benchmark (Benchmark): Benchmark to run.
+        number (int): Requested number of timed calls, see Benchmark.calls().
+        warmup (int): Number of untimed calls made first, e.g. to fill caches.
+
+    Returns:
+        result (dict): Number of calls, ops/s, p50 and p99 latency in
+            microseconds and median peak allocation in bytes.
+    """
+    time_calls(benchmark, warmup)
+    times = time_calls(benchmark, benchmark.calls(number))
+    total = sum(times)
+    return {'calls': len(times),
+            'ops_per_sec': len(times) / (total / 1e9) if total else None,
+            'p50_us': percentile(times, 50) / 1e3,
+            'p99_us': percentile(times, 99) / 1e3,
+            'alloc_bytes': trace_allocations(benchmark, min(benchmark.calls(number),
+                                                            ALLOCATION_CALLS))}
+
+def person_row(county, rand):
+    """Builds a Module 4 row of a worker and student living in a county.
+
+    Only the columns read by the benchmarked functions are filled in.
+    """
+    lat, lon = map(float, county.coords)
+    row = ['NA'] * 40
+    row[0], row[1] = county.fips[:2], county.fips[2:]
+    row[6], row[7] = str(lat + rand.uniform(-0.1, 0.1)), str(lon + rand.uniform(-0.1, 0.1))
+    row[14], row[15], row[16] = county.fips, county.fips, '54'
+    row[17] = 'Employer'
+    row[28], row[29] = str(lat + rand.uniform(-0.1, 0.1)), str(lon + rand.uniform(-0.1, 0.1))
+    row[30], row[35] = county.fips, 'School'
+    row[36], row[37] = str(lat + rand.uniform(-0.1, 0.1)), str(lon + rand.uniform(-0.1, 0.1))
+    return row
+
+def build_benchmarks(fips, state_abbrev, rand):
+    """Builds every benchmark for a county.
+
+    Inputs:
+        fips (str): 5 digit FIPS code of the county benchmarked.
+        state_abbrev (str): 2 character abbreviation of the county's state.
+        rand (random.Random): Draws the inputs of every call.
+
+    Returns:
+        benchmarks (list): Benchmark for every hot path.
+    """
+    county = adjacency.read_data(fips)
+    lat, lon = map(float, county.coords)
+    j2w = adjacency.read_j2w()
+    j2w_dist = adjacency.J2WDist(j2w, fips)
+    all_workers = list(j2w_dist.workers)
+    inc_emp = industry.read_employment_income_by_industry()
+    working_county = workplace.WorkingCounty(fips)
+    no_employers_present = [len(patrons) == 0 for patrons in working_county.patrons]
+    assigner = school_assigner.SchoolAssigner(fips, state_abbrev)
+    samplers = module4.build_activity_pattern_samplers(module4.read_activity_pattern_dists())
+    rows = [person_row(county, rand) for _ in range(100)]
+    pat_county = find_other_trips.PatronageCounty(fips)
+    x, y = pixel.find_pixel_coords(lat, lon)
+    geo = find_other_trips.GeoAttributes(x, y, fips, 'H')
+    geo.generate_new_dist()
+    # Inputs of the next call, drawn by prepare functions
+    inputs = dict()
+
+    def refill_j2w():
+        # select() takes a worker out of the distribution on every draw
+        if j2w_dist.total_workers() < 1:
+            j2w_dist.workers[:] = all_workers
+            j2w_dist.build_tree()
+
+    def draw_worker():
+        inputs['gender'] = rand.randint(0, 1)
+        inputs['income'] = float(rand.randint(10000, 200000))
+
+    def draw_workers():
+        inputs['genders'] = [rand.randint(0, 1) for _ in range(WORKER_BATCH)]
+        inputs['incomes'] = [float(rand.randint(10000, 200000)) for _ in range(WORKER_BATCH)]
+
+    def draw_home():
+        inputs['lat'] = lat + rand.uniform(-0.1, 0.1)
+        inputs['lon'] = lon + rand.uniform(-0.1, 0.1)
+
+    def draw_traveler():
+        inputs['traveler_type'] = rand.randint(0, 6)
+        inputs['person'] = rand.choice(rows)
+
+    def draw_pattern():
+        inputs['pattern'] = rand.choice(BENCHMARK_PATTERNS)
+        inputs['person'] = rand.choice(rows)
+
+    def new_assign_county():
+        inputs['assign_county'] = assign_county.AssignCounty(fips)
+
+    def move_geo():
+        geo.pix_coords = (x + rand.randint(-20, 20), y + rand.randint(-20, 20))
+
+    return [
+        Benchmark('J2WDist.select', j2w_dist.select, refill_j2w),
+        Benchmark('get_work_county_fips',
+                  lambda: j2w_dist.get_work_county_fips(fips, 0, 5), refill_j2w),
+        Benchmark('get_work_industry',
+                  lambda: industry.get_work_industry(fips, inputs['gender'], inputs['income'],
+                                                     inc_emp, no_employers_present),
+                  draw_worker),
+        Benchmark('get_work_industries',
+                  lambda: industry.get_work_industries(fips, inputs['genders'], inputs['incomes'],
+                                                       inc_emp, no_employers_present),
+                  draw_workers, scale=0.1),
+        Benchmark('WorkingCounty.__init__', lambda: workplace.WorkingCounty(fips), scale=0.01),
+        Benchmark('select_industry_and_employer',
+                  lambda: working_county.select_industry_and_employer(fips, inputs['gender'],
+                                                                      inputs['income'], inc_emp),
+                  draw_worker),
+        Benchmark('assemble_neighborly_dist',
+                  lambda: inputs['assign_county'].assemble_neighborly_dist(),
+                  new_assign_county, scale=0.01),
+        Benchmark('select_public_schools',
+                  lambda: assigner.select_public_schools('high', inputs['lat'], inputs['lon']),
+                  draw_home),
+        Benchmark('assign_activity_pattern',
+                  lambda: module4.assign_activity_pattern(inputs['traveler_type'], samplers,
+                                                          inputs['person']),
+                  draw_traveler),
+        Benchmark('Pattern',
+                  lambda: activity.Pattern(inputs['pattern'], inputs['person'], 0),
+                  draw_pattern),
+        Benchmark('build_pat_place_distribution',
+                  lambda: geo.build_pat_place_distribution(pat_county), move_geo, scale=0.1),
+        Benchmark('select_location', lambda: geo.select_location('H', 'H'))]
+
+def print_results(results, baseline=None):
+    """Prints benchmark results, with the speedup over a baseline if given."""
+    header = '%-30s %8s %12s %10s %10s %10s' % ('Benchmark', 'Calls', 'ops/s',
+                                                 'p50 us', 'p99 us', 'alloc B')
+    if baseline is not None:
+        header += ' %9s' % 'Speedup'
+    print(header)
+    for name, result in results.items():
+        line = '%-30s %8d %12.0f %10.1f %10.1f %10d' % (name, result['calls'],
+                                                          result['ops_per_sec'] or 0,
+                                                          result['p50_us'], result['p99_us'],
+                                                          result['alloc_bytes'])
+        if baseline is not None:
+            base = baseline.get(name)
+            if base and base.get('ops_per_sec') and result['ops_per_sec']:
+                line += ' %8.2fx' % (result['ops_per_sec'] / base['ops_per_sec'])
+            else:
+                line += ' %9s' % '-'
+        print(line)
+
+def main(args):
+    work_dir = None
+    try:
+        if args.data_root is None:
+            work_dir = tempfile.mkdtemp(prefix='micro_benchmark_')
+            print('Writing synthetic data root to', work_dir)
+            states = synthetic_data.generate(work_dir, args.persons, seed=args.seed)
+            fips = args.county or states[0].counties[0].fips
+        else:
+            paths.set_root(args.data_root)
+            if args.county is None:
+                raise ValueError('A county is needed when benchmarking an existing data root')
+            fips = args.county
+        state_abbrev = [state[1] for state in core.read_states() if state[2] == fips[:2]][0]
+        random.seed(args.seed)
+        benchmarks = build_benchmarks(fips, state_abbrev, random.Random(args.seed))
+        if args.keyword:
+            benchmarks = [benchmark for benchmark in benchmarks
+                          if any(keyword in benchmark.name for keyword in args.keyword)]
+        print('Benchmarking county', fips, 'with', args.number, 'calls per benchmark')
+        results = dict()
+        for benchmark in benchmarks:
+            results[benchmark.name] = run_benchmark(benchmark, args.number, args.warmup)
+        baseline = None
+        if args.baseline is not None:
+            with open(args.baseline) as read:
+                baseline = json.load(read)['results']
+        print_results(results, baseline)
+        if args.output is not None:
+            with open(args.output, 'w') as write:
+                json.dump({'created': str(datetime.now()), 'county': fips,
+                           'number': args.number, 'results': results}, write, indent=2)
+            print('Results written to', args.output)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark per-person hot paths')
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='Number of timed calls per benchmark (default: %(default)s)')
+    parser.add_argument('-w', '--warmup', type=int, default=10,
+                        help='Number of untimed calls first (default: %(default)s)')
+    parser.add_argument('-d', '--data-root',
+                        help='Existing data root to benchmark (default: a synthetic one)')
+    parser.add_argument('-c', '--county', help='FIPS code of the county benchmarked')
+    parser.add_argument('-p', '--persons', type=int, default=10000,
+                        help='Persons in the synthetic data root (default: %(default)s)')
+    parser.add_argument('-k', '--keyword', nargs='+',
+                        help='Only run benchmarks whose name contains a keyword')
+    parser.add_argument('-o', '--output', help='File to save results to, as JSON')
+    parser.add_argument('-b', '--baseline', help='Results file to compare against')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: %(default)s)')
+    main(parser.parse_args())
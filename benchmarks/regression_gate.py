@@ -0,0 +1,293 @@
+'''
+Performance regression gate.
+
+Runs the micro-benchmarks (see micro_benchmark.py) and whole-stage
+benchmarks of the hottest stages on a synthetic data root, and compares
+them to a stored baseline, benchmarks/baseline.json by default. Exits
+with status 1 and prints the benchmarks that regressed if any did, so it
+can be run before merging a change.
+
+Every benchmark is run several times, and its median throughput and
+memory are compared. A benchmark regresses when its median is worse than
+the baseline median by more than a tolerance, and by more than the noise
+seen across runs, taken as a multiple of the median absolute deviation
+of the baseline and current runs:
+
+    band = max(tolerance, noise * (mad(baseline) + mad(current)) / median(baseline))
+
+Stage benchmarks:
+    module2.assign_workers_to_employers   Assigns employers to every worker
+                                          of a state, in rows per second
+    find_other_trips.get_other_trip       First pass over every Module 5
+                                          trip file of a state, in rows per
+                                          second
+
+Baselines depend on the machine, so a baseline should be recorded with
+--update on the machine the gate is run on.
+
+Usage:
+    python -m benchmarks.regression_gate --update
+    python -m benchmarks.regression_gate
+    python -m benchmarks.regression_gate -r 7 -t 0.05 -k get_other_trip
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import statistics
+import tracemalloc
+from datetime import datetime
+from model.utils import core, paths
+from model.module2 import module2
+from model.module3 import module3
+from model.module4 import module4
+from model.module5 import module5, find_other_trips
+from benchmarks import synthetic_data, micro_benchmark
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Metrics compared, and whether higher values are better
+METRICS = {'ops_per_sec': True, 'alloc_bytes': False}
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the progress output of modules run by a benchmark."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+class StageBenchmark:
+    """A whole stage of a module, run over every row of a state.
+
+    Attributes:
+        name (str): Benchmark name.
+        function (function): Runs the stage without arguments.
+        rows (int): Number of rows the stage processes.
+    """
+
+    def __init__(self, name, function, rows):
+        """See class docstring."""
+        self.name = name
+        self.function = function
+        self.rows = rows
+
+    def run(self):
+        """Runs the stage once timed, and once traced for memory.
+
+        Returns:
+            result (dict): Rows per second and peak memory allocated, in bytes.
+        """
+        with quiet():
+            start = time.perf_counter()
+            self.function()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            try:
+                self.function()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return {'ops_per_sec': self.rows / elapsed, 'alloc_bytes': peak}
+
+def count_rows(file_path):
+    """Counts data rows (excluding the header) of a file."""
+    with open(file_path) as read:
+        return sum(1 for _ in read) - 1
+
+def build_stage_benchmarks(state):
+    """Runs Modules 2 through 4 on a state and builds the stage benchmarks.
+
+    Inputs:
+        state (str): State name, without spaces, of the data root in paths.
+
+    Returns:
+        benchmarks (list): StageBenchmark for every stage.
+    """
+    output_path = paths.MODULES[1]
+    with quiet():
+        module2.main(state)
+        module3.main(state)
+        module4.main(state)
+        # Module 2 removes its intermediate files, so the sorted workers
+        # file the employer stage reads is written again
+        module2.assign_to_work_counties(state)
+        module2.separate_workers_non_workers(state)
+        core.sort_by_input_column(output_path, state + 'Module2NN_work_county_work.csv',
+                                  str(module2.WORK_COUNTY_FIPS_INDEX), output_path,
+                                  state + 'Module2NN_sorted_work_county.csv')
+        base_path = paths.MODULES[4] + state + '_'
+        active_files, _ = module5.build_initial_trip_files(
+            paths.MODULES[3] + state + 'Module4NN2ndRun.csv', base_path)
+        module5.sort_files_before_pass(base_path, active_files, '1')
+    pass_files = [(file_info[0],) + tuple(base_path + file_name for file_name in
+                                          module5.gen_file_names(file_info, '1', 'pass'))
+                  for file_info in active_files]
+
+    def first_pass():
+        for fips, input_file, output_file in pass_files:
+            find_other_trips.get_other_trip(input_file, output_file, '1', fips=fips)
+
+    return [StageBenchmark('module2.assign_workers_to_employers',
+                           lambda: module2.assign_workers_to_employers(state),
+                           count_rows(output_path + state + 'Module2NN_sorted_work_county.csv')),
+            StageBenchmark('find_other_trips.get_other_trip', first_pass,
+                           sum(count_rows(input_file) for _, input_file, _ in pass_files))]
+
+def run_suite(args):
+    """Runs every benchmark several times on a synthetic data root.
+
+    Returns:
+        results (dict): Associates each benchmark with the value of every
+            metric in every run, see METRICS.
+    """
+    work_dir = tempfile.mkdtemp(prefix='regression_gate_')
+    try:
+        with quiet():
+            states = synthetic_data.generate(work_dir, args.persons, num_states=1,
+                                             seed=args.seed)
+        state = states[0]
+        fips = state.counties[0].fips
+        micro_benchmarks = micro_benchmark.build_benchmarks(
+            fips, state.abbrev, micro_benchmark.random.Random(args.seed))
+        stage_benchmarks = build_stage_benchmarks(state.name)
+        results = dict()
+
+        def record(name, result):
+            for metric in METRICS:
+                results.setdefault(name, dict()).setdefault(metric, []).append(result[metric])
+
+        for repeat in range(args.repeat):
+            print('Run', repeat + 1, 'of', args.repeat)
+            for benchmark in micro_benchmarks:
+                if selected(benchmark.name, args.keyword):
+                    record(benchmark.name, micro_benchmark.run_benchmark(benchmark, args.number,
+                                                                         args.warmup))
+            for benchmark in stage_benchmarks:
+                if selected(benchmark.name, args.keyword):
+                    record(benchmark.name, benchmark.run())
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        paths.set_root(paths.DEFAULT_ROOT)
+
+def selected(name, keywords):
+    """Whether a benchmark was selected by keyword, or no keyword was given."""
+    return not keywords or any(keyword in name for keyword in keywords)
+
+def median_absolute_deviation(values):
+    median = statistics.median(values)
+    return statistics.median([abs(value - median) for value in values])
+
+def compare(baseline, current, tolerances, noise):
+    """Compares benchmark results to a baseline.
+
+    Inputs:
+        baseline, current (dict): Results, see run_suite().
+        tolerances (dict): Relative change allowed for every metric.
+        noise (float): Multiple of the median absolute deviation of runs
+            allowed on top of the tolerance.
+
+    Returns:
+        rows (list): For every benchmark and metric, a dictionary with the
+            baseline and current medians, relative change, band and status,
+            one of 'ok', 'improved', 'regressed' or 'new'.
+    """
+    rows = []
+    for name, metrics in current.items():
+        for metric, higher_is_better in METRICS.items():
+            values = metrics[metric]
+            row = {'benchmark': name, 'metric': metric, 'current': statistics.median(values),
+                   'baseline': None, 'change': None, 'band': None, 'status': 'new'}
+            base_values = baseline.get(name, dict()).get(metric)
+            if base_values:
+                base = statistics.median(base_values)
+                row['baseline'] = base
+                if base:
+                    spread = (median_absolute_deviation(base_values)
+                              + median_absolute_deviation(values)) / abs(base)
+                    row['band'] = max(tolerances[metric], noise * spread)
+                    row['change'] = (row['current'] - base) / abs(base)
+                    # Positive when the benchmark got worse
+                    worse = -row['change'] if higher_is_better else row['change']
+                    if worse > row['band']:
+                        row['status'] = 'regressed'
+                    elif -worse > row['band']:
+                        row['status'] = 'improved'
+                    else:
+                        row['status'] = 'ok'
+                else:
+                    row['status'] = 'ok'
+            rows.append(row)
+    return rows
+
+def print_comparison(rows):
+    print('%-38s %-12s %14s %14s %9s %8s  %s' % ('Benchmark', 'Metric', 'Baseline', 'Current',
+                                                 'Change', 'Band', 'Status'))
+    for row in rows:
+        print('%-38s %-12s %14s %14s %9s %8s  %s' % (
+            row['benchmark'], row['metric'],
+            '-' if row['baseline'] is None else '%.1f' % row['baseline'],
+            '%.1f' % row['current'],
+            '-' if row['change'] is None else '%+.1f%%' % (100 * row['change']),
+            '-' if row['band'] is None else '%.1f%%' % (100 * row['band']),
+            row['status'].upper() if row['status'] == 'regressed' else row['status']))
+
+def machine():
+    """Describes the machine results were recorded on."""
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+def main(args):
+    results = run_suite(args)
+    if args.update:
+        with open(args.baseline, 'w') as write:
+            json.dump({'created': str(datetime.now()), 'machine': machine(),
+                       'persons': args.persons, 'number': args.number,
+                       'results': results}, write, indent=2)
+        print('Baseline written to', args.baseline)
+        return 0
+    with open(args.baseline) as read:
+        baseline = json.load(read)
+    if baseline.get('machine') != machine():
+        print('Warning: the baseline was recorded on another machine:', baseline.get('machine'))
+    rows = compare(baseline['results'], results,
+                   {'ops_per_sec': args.tolerance, 'alloc_bytes': args.memory_tolerance},
+                   args.noise)
+    print_comparison(rows)
+    regressed = [row for row in rows if row['status'] == 'regressed']
+    if regressed:
+        print(len(regressed), 'benchmark metric(s) regressed:',
+              ', '.join(row['benchmark'] + ' ' + row['metric'] for row in regressed))
+        return 1
+    print('No regressions')
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare benchmark results to a baseline')
+    parser.add_argument('-B', '--baseline', default=BASELINE_FILE,
+                        help='Baseline results file (default: %(default)s)')
+    parser.add_argument('-u', '--update', action='store_true',
+                        help='Record the results as the new baseline instead of comparing')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs of every benchmark (default: %(default)s)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Relative throughput loss allowed (default: %(default)s)')
+    parser.add_argument('-M', '--memory-tolerance', type=float, default=0.2,
+                        help='Relative memory growth allowed (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=3.0,
+                        help='Multiple of the run to run deviation allowed (default: %(default)s)')
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help='Calls per micro-benchmark run (default: %(default)s)')
+    parser.add_argument('-w', '--warmup', type=int, default=10,
+                        help='Untimed calls before every micro-benchmark run (default: %(default)s)')
+    parser.add_argument('-p', '--persons', type=int, default=20000,
+                        help='Persons in the synthetic state (default: %(default)s)')
+    parser.add_argument('-k', '--keyword', nargs='+',
+                        help='Only run benchmarks whose name contains a keyword')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: %(default)s)')
+    sys.exit(main(parser.parse_args()))
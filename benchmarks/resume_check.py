@@ -0,0 +1,199 @@
+'''
+Crash and resume checks of the Module 5 checkpoints.
+
+For every step of Module 5 (see checkpoint.RunManifest), a run is crashed
+while the step is writing its files, leaving them half written, then run
+again with resume on. The resumed run must write the same trip tours as a
+run that was never interrupted, and leave no intermediate files behind.
+
+Random draws are seeded at the start of every step, and of every file
+passed over, by name, so a resumed run draws the same numbers as an
+uninterrupted one whichever steps it skips. Every run is a separate
+process, working on a copy of the data root so that the outputs there
+are left alone. Steps are checked for every processor count given, as
+Module 5 runs extra steps (sort_before_0, load_balance) in parallel.
+
+Exits with status 1 if any check fails.
+
+Usage:
+    python -m benchmarks.resume_check -d /tmp/synthetic -s SynthA
+    python -m benchmarks.resume_check -d /tmp/synthetic -s SynthA -n 2 -k pass_1
+'''
+
+import os
+import sys
+import json
+import zlib
+import random
+import shutil
+import argparse
+import filecmp
+import tempfile
+import multiprocessing
+import numpy as np
+from model.utils import paths, checkpoint
+from model.module5 import module5, find_other_trips
+
+# Exit status of a run crashed on purpose
+CRASH_STATUS = 3
+# get_other_trip() of Module 5, before it is seeded
+GET_OTHER_TRIP = find_other_trips.get_other_trip
+RUN_STEP = checkpoint.RunManifest.run
+
+def seed(name):
+    """Seeds random and np.random from a step or file name."""
+    value = zlib.crc32(name.encode())
+    random.seed(value)
+    np.random.seed(value)
+
+def seeded_other_trip(input_file, *args, **kwargs):
+    """get_other_trip(), seeded by the name of the file passed over.
+
+    Defined at module level, so that it is found by pool workers.
+    """
+    seed(os.path.basename(input_file))
+    return GET_OTHER_TRIP(input_file, *args, **kwargs)
+
+def crash_in(crash_step):
+    """Replaces RunManifest.run() with one that seeds every step.
+
+    Inputs:
+        crash_step (str): Step after which the process exits, with every
+            file it wrote cut to half its size, or None.
+    """
+    def run(manifest, step, function, outputs=(), consumed=()):
+        def seeded():
+            seed(step)
+            data = function()
+            if step == crash_step:
+                written = outputs(data) if callable(outputs) else outputs
+                for path in written:
+                    os.truncate(path, os.path.getsize(path) // 2)
+                print('Crashing in step', step)
+                sys.stdout.flush()
+                os._exit(CRASH_STATUS)
+            return data
+        return RUN_STEP(manifest, step, seeded, outputs, consumed)
+    checkpoint.RunManifest.run = run
+    find_other_trips.get_other_trip = seeded_other_trip
+
+def run_module5(root, state, processors, resume=False, crash_step=None):
+    """Runs Module 5 for a state, in its own process.
+
+    Inputs:
+        root (str): Data root to run in.
+        state (str): State name, without spaces.
+        processors (int): Number of processors passed to Module 5.
+        resume (bool): Whether to skip steps completed by a previous run.
+        crash_step (str): See crash_in().
+
+    Returns:
+        exit_code (int): Exit code of the process.
+    """
+    def target():
+        paths.set_root(root)
+        crash_in(crash_step)
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            module5.main(state, processors, resume=resume)
+            sys.stdout.flush()
+    process = multiprocessing.Process(target=target)
+    process.start()
+    process.join()
+    return process.exitcode
+
+def module5_files(root):
+    """Returns the names of the files in the Module 5 output folder of a data root."""
+    folder = os.path.join(root, 'Output', 'Module5')
+    return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+def clear_module5(root, state):
+    """Removes the Module 5 outputs and run manifest of a state."""
+    folder = os.path.join(root, 'Output', 'Module5')
+    for name in module5_files(root):
+        os.remove(os.path.join(folder, name))
+    checkpoint.remove_path(os.path.join(root, 'Output', 'Checkpoints',
+                                        state + '_module5.json'))
+
+def reference_run(root, state, processors):
+    """Runs Module 5 without interruption.
+
+    Returns:
+        steps (list): Names of the steps run, in order.
+        outputs (dict): Associates every output file name with its path,
+            in a folder of its own.
+    """
+    clear_module5(root, state)
+    if run_module5(root, state, processors) != 0:
+        raise RuntimeError('Module 5 failed for ' + state)
+    with open(os.path.join(root, 'Output', 'Checkpoints', state + '_module5.json')) as read:
+        steps = list(json.load(read)['steps'])
+    folder = tempfile.mkdtemp(prefix='reference_')
+    outputs = dict()
+    for name in module5_files(root):
+        outputs[name] = os.path.join(folder, name)
+        shutil.copy(os.path.join(root, 'Output', 'Module5', name), outputs[name])
+    return steps, outputs
+
+def check_step(root, state, processors, step, reference):
+    """Crashes Module 5 in a step, resumes it, and compares the outputs.
+
+    Returns:
+        problems (list): Descriptions of what went wrong, if anything.
+    """
+    clear_module5(root, state)
+    exit_code = run_module5(root, state, processors, crash_step=step)
+    if exit_code != CRASH_STATUS:
+        return ['crashed run exited with %s' % exit_code]
+    exit_code = run_module5(root, state, processors, resume=True)
+    if exit_code != 0:
+        return ['resumed run exited with %s' % exit_code]
+    problems = []
+    names = module5_files(root)
+    for name in names:
+        if module5.TEMP_NAME in name:
+            problems.append('left behind ' + name)
+        elif name not in reference:
+            problems.append('wrote extra file ' + name)
+        elif not filecmp.cmp(os.path.join(root, 'Output', 'Module5', name),
+                             reference[name], shallow=False):
+            problems.append('wrote different ' + name)
+    problems.extend('did not write ' + name for name in sorted(set(reference) - set(names)))
+    return problems
+
+def main(args):
+    """Checks every step of Module 5, for every processor count."""
+    if multiprocessing.get_start_method() != 'fork':
+        raise RuntimeError('Checks patch Module 5, and need processes to be forked')
+    root = tempfile.mkdtemp(prefix='resume_check_')
+    failed = 0
+    try:
+        data_root = os.path.join(root, 'data')
+        shutil.copytree(args.data_root, data_root)
+        for processors in args.processors:
+            steps, reference = reference_run(data_root, args.state, processors)
+            for step in steps:
+                if args.keyword and not any(keyword in step for keyword in args.keyword):
+                    continue
+                problems = check_step(data_root, args.state, processors, step, reference)
+                print('%-16s %2d processors  %s' % (step, processors,
+                                                    'FAIL' if problems else 'ok'))
+                for problem in problems:
+                    print('    ' + problem)
+                failed += bool(problems)
+            shutil.rmtree(os.path.dirname(next(iter(reference.values()))), ignore_errors=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('%d checks failed' % failed if failed else 'All checks passed')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crash and resume checks of Module 5')
+    parser.add_argument('-d', '--data-root', required=True,
+                        help='Data root with the Module 4 output of the state')
+    parser.add_argument('-s', '--state', required=True, help='State to run')
+    parser.add_argument('-n', '--processors', type=int, nargs='+', default=[1, 2],
+                        help='Processor counts to check (default: %(default)s)')
+    parser.add_argument('-k', '--keyword', nargs='+',
+                        help='Only check steps whose name contains a keyword')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,362 @@
+'''
+End-to-end throughput and scaling benchmark for Modules 2 through 5.
+
+For every population size, a synthetic state is generated (see
+synthetic_data.py) and module_runner is run on it for Modules 2, 3 and 4
+once, and for Module 5 once per processor count. Every run is a separate
+process, watched by a monitor that samples the disk used below the output
+folder and, if psutil is installed, the resident memory of the process
+and its workers. For every run, the harness records:
+
+    wall_time         Seconds the run took
+    persons_per_sec   Persons of the state processed per second
+    peak_rss          Peak resident memory of the largest process, from the
+                      operating system where available, otherwise of the
+                      process tree as sampled
+    disk_high_water   Most disk used by the run above what was used before
+    steps             Per step (and so per Module 5 iteration), seconds,
+                      rows and disk and memory high water marks, from the
+                      run report of the module (see model.utils.metrics)
+
+Results are written as JSON, with scaling curves as CSV: persons per
+second by population size for every module, and Module 5 speedup and
+parallel efficiency by processor count. If matplotlib is installed, the
+curves are also plotted.
+
+Usage:
+    python -m benchmarks.scaling_benchmark -p 100000 1000000 -n 1 2 4 8 -o scaling
+'''
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from model.utils import paths, metrics
+from benchmarks import synthetic_data
+
+MODULES = ['module2', 'module3', 'module4', 'module5']
+# Module whose runs are repeated for every processor count
+PARALLEL_MODULE = 'module5'
+# Trailing iteration number of Module 5 step names, e.g. pass_2
+ITERATION_PATTERN = re.compile(r'_(\d+)$')
+RUNNER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'module_runner.py')
+
+def directory_size(path):
+    """Returns the size of every file below a directory, in bytes."""
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Temporary files may be removed while walking
+                pass
+    return total
+
+def process_tree_rss(pid):
+    """Returns the resident memory of a process and its children, or None."""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for member in processes:
+        try:
+            total += member.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+class ResourceMonitor(threading.Thread):
+    """Samples disk and memory use of a run in the background.
+
+    Attributes:
+        pid (int): Process id of the run.
+        path (str): Folder whose disk use is sampled.
+        interval (float): Seconds between samples.
+        baseline (int): Disk used below path when the monitor was created.
+        samples (list): Tuples of epoch time, bytes of disk used above the
+            baseline and resident memory of the process tree (or None).
+    """
+
+    def __init__(self, pid, path, interval):
+        """See class docstring."""
+        threading.Thread.__init__(self, daemon=True)
+        self.pid = pid
+        self.path = path
+        self.interval = interval
+        self.baseline = directory_size(path)
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+        self.sample()
+
+    def sample(self):
+        self.samples.append((time.time(), directory_size(self.path) - self.baseline,
+                             process_tree_rss(self.pid)))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def high_water(self, start=None, stop=None):
+        """Returns the most disk and memory used between two epoch times.
+
+        Returns:
+            disk (int): Bytes of disk used above the baseline, or None.
+            rss (int): Resident memory of the process tree, or None.
+        """
+        samples = [sample for sample in self.samples
+                   if (start is None or sample[0] >= start) and (stop is None or sample[0] <= stop)]
+        disk = max([sample[1] for sample in samples], default=None)
+        rss = max([sample[2] for sample in samples if sample[2] is not None], default=None)
+        return disk, rss
+
+def wait_for(process):
+    """Waits for a process to exit.
+
+    Returns:
+        returncode (int): Exit code of the process.
+        peak_rss (int): Peak resident memory of the largest process of the
+            process tree in bytes, or None if the platform cannot tell.
+    """
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        peak = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        return process.returncode, peak
+    return process.wait(), None
+
+def run_module(root, state, module, processors, log_path, interval):
+    """Runs a module for a state in its own process, monitoring it.
+
+    Inputs:
+        root (str): Data root to run on.
+        state (str): State name, without spaces.
+        module (str): Module name (e.g. module2).
+        processors (int): Number of processors passed to the module, or None.
+        log_path (str): File the output of the run is written to.
+        interval (float): Seconds between resource samples.
+
+    Returns:
+        run (dict): Measurements of the run, see module docstring.
+    """
+    command = [sys.executable, RUNNER, '--data-root', root, '-m', module, '-s', state]
+    if processors is not None:
+        command += ['-n', str(processors)]
+    environment = dict(os.environ)
+    # Temporary files go below the output folder, so that they are measured
+    temp_dir = paths.OUTPUT + 'Temp'
+    os.makedirs(temp_dir, exist_ok=True)
+    for variable in ('TMPDIR', 'TEMP', 'TMP'):
+        environment[variable] = temp_dir
+    start = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                                   env=environment)
+        monitor = ResourceMonitor(process.pid, paths.OUTPUT, interval)
+        monitor.start()
+        returncode, peak_rss = wait_for(process)
+        monitor.stop()
+    wall_time = time.time() - start
+    disk, sampled_rss = monitor.high_water()
+    run = {'module': module, 'processors': processors, 'returncode': returncode,
+           'wall_time': wall_time, 'peak_rss': peak_rss or sampled_rss,
+           'disk_high_water': disk, 'log': log_path, 'steps': dict(), 'iterations': dict()}
+    try:
+        with open(metrics.report_path(module, state)) as read:
+            report = json.load(read)
+    except (OSError, ValueError):
+        report = None
+    if report is not None:
+        for name, step in report['steps'].items():
+            step_disk, step_rss = monitor.high_water(step.get('start'), step.get('stop'))
+            step = dict(step, disk_high_water=step_disk, rss_high_water=step_rss)
+            run['steps'][name] = step
+            match = ITERATION_PATTERN.search(name)
+            if module == PARALLEL_MODULE and match:
+                iteration = run['iterations'].setdefault(match.group(1),
+                                                         {'seconds': 0.0, 'disk_high_water': None})
+                iteration['seconds'] += step.get('seconds') or 0.0
+                if step_disk is not None:
+                    iteration['disk_high_water'] = max(step_disk, iteration['disk_high_water'] or 0)
+    return run
+
+def clear_outputs(module, state):
+    """Removes the outputs and checkpoints of a previous run of a module."""
+    folder = paths.MODULES[int(module[len('module'):]) - 1]
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    for path in (metrics.report_path(module, state),):
+        if os.path.exists(path):
+            os.remove(path)
+
+def run_size(work_dir, persons, processor_counts, modules, args):
+    """Generates a state of a given size and runs every module on it.
+
+    Returns:
+        runs (list): Measurements of every run, see run_module().
+    """
+    root = os.path.join(work_dir, 'persons_' + str(persons))
+    print('Generating', persons, 'persons at', root)
+    states = synthetic_data.generate(root, persons, num_states=1,
+                                     counties_per_state=args.counties, seed=args.seed)
+    state = states[0].name
+    runs = []
+    for module in modules:
+        counts = processor_counts if module == PARALLEL_MODULE else [None]
+        for processors in counts:
+            clear_outputs(module, state)
+            log_path = os.path.join(work_dir, '%s_%d_%s.log' % (module, persons, processors or 1))
+            print('Running', module, 'on', persons, 'persons',
+                  'with ' + str(processors) + ' processors' if processors else '',
+                  'at', datetime.now())
+            run = run_module(root, state, module, processors, log_path, args.interval)
+            run['persons'] = persons
+            run['persons_per_sec'] = persons / run['wall_time'] if run['wall_time'] else None
+            runs.append(run)
+            print('%s took %.1f s (%.0f persons/s)%s' % (
+                module, run['wall_time'], run['persons_per_sec'] or 0,
+                '' if run['returncode'] == 0 else ', failed, see ' + log_path))
+    if not args.keep:
+        shutil.rmtree(root, ignore_errors=True)
+    return runs
+
+def throughput_curves(runs):
+    """Returns rows of persons per second by module and population size."""
+    return [[run['module'], run['processors'] or 1, run['persons'], run['wall_time'],
+             run['persons_per_sec'], run['peak_rss'], run['disk_high_water']]
+            for run in runs]
+
+def speedup_curves(runs):
+    """Returns rows of Module 5 speedup and efficiency by processor count.
+
+    Speedup is relative to the run with the fewest processors for the
+    same population size.
+    """
+    rows = []
+    parallel_runs = [run for run in runs if run['module'] == PARALLEL_MODULE]
+    for persons in sorted(set(run['persons'] for run in parallel_runs)):
+        size_runs = sorted((run for run in parallel_runs if run['persons'] == persons),
+                           key=lambda run: run['processors'])
+        base = size_runs[0]
+        for run in size_runs:
+            speedup = base['wall_time'] / run['wall_time'] * base['processors']
+            pass_seconds = sum(step.get('seconds') or 0 for name, step in run['steps'].items()
+                               if name.startswith('pass_'))
+            sort_seconds = sum(step.get('seconds') or 0 for name, step in run['steps'].items()
+                               if name.startswith('sort_'))
+            rows.append([persons, run['processors'], run['wall_time'], speedup,
+                         speedup / run['processors'], pass_seconds, sort_seconds])
+    return rows
+
+def write_csv(file_path, header, rows):
+    with open(file_path, 'w+', newline='') as write:
+        writer = csv.writer(write)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def plot_curves(output, throughput, speedup):
+    """Plots scaling curves, if matplotlib is installed."""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib not installed - skipping plots')
+        return
+    figure, (left, right) = plt.subplots(1, 2, figsize=(12, 5))
+    for module in sorted(set(row[0] for row in throughput)):
+        rows = sorted((row for row in throughput if row[0] == module and row[1] == 1),
+                      key=lambda row: row[2])
+        left.plot([row[2] for row in rows], [row[4] for row in rows], marker='o', label=module)
+    left.set_xscale('log')
+    left.set_xlabel('Persons')
+    left.set_ylabel('Persons per second')
+    left.legend()
+    for persons in sorted(set(row[0] for row in speedup)):
+        rows = [row for row in speedup if row[0] == persons]
+        right.plot([row[1] for row in rows], [row[3] for row in rows], marker='o',
+                   label=str(persons) + ' persons')
+    right.set_xlabel('Processors')
+    right.set_ylabel(PARALLEL_MODULE + ' speedup')
+    right.legend()
+    figure.tight_layout()
+    figure.savefig(output + '_curves.png')
+    print('Scaling curves plotted to', output + '_curves.png')
+
+def print_report(runs):
+    print('%-10s %10s %6s %10s %12s %12s %12s' % ('Module', 'Persons', 'Procs', 'Wall s',
+                                                  'Persons/s', 'Peak RSS MB', 'Disk MB'))
+    for run in runs:
+        print('%-10s %10d %6d %10.1f %12.0f %12s %12s' % (
+            run['module'], run['persons'], run['processors'] or 1, run['wall_time'],
+            run['persons_per_sec'] or 0,
+            '%.1f' % (run['peak_rss'] / 1024.0 ** 2) if run['peak_rss'] is not None else '-',
+            '%.1f' % (run['disk_high_water'] / 1024.0 ** 2)
+            if run['disk_high_water'] is not None else '-'))
+
+def main(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='scaling_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    runs = []
+    for persons in args.persons:
+        runs.extend(run_size(work_dir, persons, args.processors, args.modules, args))
+    print_report(runs)
+    with open(args.output + '.json', 'w') as write:
+        json.dump({'created': str(datetime.now()), 'counties': args.counties,
+                   'seed': args.seed, 'runs': runs}, write, indent=2)
+    throughput = throughput_curves(runs)
+    speedup = speedup_curves(runs)
+    write_csv(args.output + '_throughput.csv',
+              ['module', 'processors', 'persons', 'wall_time', 'persons_per_sec',
+               'peak_rss', 'disk_high_water'], throughput)
+    write_csv(args.output + '_speedup.csv',
+              ['persons', 'processors', 'wall_time', 'speedup', 'efficiency',
+               'pass_seconds', 'sort_seconds'], speedup)
+    print('Results written to', args.output + '.json')
+    plot_curves(args.output, throughput, speedup)
+    if args.work_dir is None and not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark module throughput and scaling')
+    parser.add_argument('-p', '--persons', type=int, nargs='+', default=[100000, 1000000],
+                        help='Population sizes of the generated states (default: %(default)s)')
+    parser.add_argument('-n', '--processors', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Processor counts to run ' + PARALLEL_MODULE
+                             + ' with (default: %(default)s)')
+    parser.add_argument('-m', '--modules', nargs='+', default=MODULES, choices=MODULES,
+                        help='Modules to run, in order (default: all)')
+    parser.add_argument('-c', '--counties', type=int, default=16,
+                        help='Counties in the generated states (default: %(default)s)')
+    parser.add_argument('-o', '--output', default='scaling',
+                        help='Prefix of the result files (default: %(default)s)')
+    parser.add_argument('-w', '--work-dir',
+                        help='Folder for generated data and logs (default: a temporary folder)')
+    parser.add_argument('-i', '--interval', type=float, default=0.5,
+                        help='Seconds between resource samples (default: %(default)s)')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep generated data and logs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: %(default)s)')
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+'''
+Throughput benchmark for sorting large state files.
+
+Compares the pure Python external merge sort in model.utils.external_sort
+against the Rscript based sort that it replaced. A synthetic file shaped
+like Module2NN_work_county_work.csv is generated unless an input file is
+provided.
+
+Usage:
+    python -m benchmarks.sort_benchmark -r 1000000 -c 16
+    python -m benchmarks.sort_benchmark -i D:/Data/Output/Module2/ -f TexasModule2NN_work_county_work.csv -c 16
+'''
+
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from model.utils import core, paths, writing, external_sort
+
+def write_synthetic_file(file_path, num_rows, seed=0):
+    """Writes a synthetic residence file with Module 2 work county columns.
+
+    Inputs:
+        file_path (str): Output path for the synthetic file.
+        num_rows (int): Number of person rows to write.
+        seed (int): Seed for the random number generator.
+    """
+    rand = random.Random(seed)
+    work_counties = [str(34000 + 2 * i + 1) for i in range(21)] + ['-2']
+    with open(file_path, 'w+') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['Residence_State', 'County_Code', 'Tract_Code', 'Block_Code',
+                         'HH_ID', 'HH_TYPE', 'Latitude', 'Longitude', 'Person_ID_Number',
+                         'Age', 'Sex', 'Traveler_Type', 'Income_Bracket', 'Income_Amount',
+                         'Residence_County', 'Work_County_FIPS'])
+        for person in range(num_rows):
+            county = str(2 * (person * 21 // num_rows) + 1).rjust(3, '0')
+            writer.writerow(['34', county, str(rand.randint(100, 999999)),
+                             str(rand.randint(1000, 9999)), str(person // 3),
+                             str(rand.randint(0, 8)), '%.6f' % rand.uniform(39, 41),
+                             '%.6f' % rand.uniform(-75.5, -74), str(person),
+                             str(rand.randint(0, 90)), str(rand.randint(0, 1)),
+                             str(rand.randint(0, 6)), str(rand.randint(1, 10)),
+                             str(rand.randint(0, 250000)), '34' + county,
+                             rand.choice(work_counties)])
+
+def time_sort(sort_function, input_path, input_file, sort_column, output_path, output_file):
+    """Times a single sort of a file.
+
+    Returns:
+        elapsed (float): Wall clock time of the sort, in seconds.
+    """
+    start = time.perf_counter()
+    sort_function(input_path, input_file, sort_column, output_path, output_file)
+    return time.perf_counter() - start
+
+def count_rows(file_path):
+    """Counts data rows (excluding the header) of a file."""
+    with open(file_path, 'rb') as read:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: read.read(1 << 20), b'')) - 1
+
+def report(name, elapsed, num_rows, num_bytes):
+    """Prints throughput for a single sort."""
+    print('%-32s %9.2f s %12.0f rows/s %8.1f MB/s'
+          % (name, elapsed, num_rows / elapsed, num_bytes / elapsed / 1e6))
+
+def main(args):
+    work_dir = tempfile.mkdtemp(prefix='sort_benchmark_')
+    try:
+        if args.input_file is None:
+            input_path, input_file = work_dir + '/', 'synthetic.csv'
+            print('Writing', args.rows, 'synthetic rows')
+            write_synthetic_file(input_path + input_file, args.rows)
+        else:
+            input_path, input_file = args.input_path, args.input_file
+        num_bytes = os.path.getsize(input_path + input_file)
+        num_rows = count_rows(input_path + input_file)
+        print('Sorting', num_rows, 'rows (%.1f MB) by column %s' % (num_bytes / 1e6, args.column))
+        for limit in args.memory_limits:
+            memory_limit = int(limit * 1024 * 1024)
+            def python_sort(*sort_args):
+                core.sort_by_input_column(*sort_args, memory_limit=memory_limit, temp_dir=work_dir)
+            elapsed = time_sort(python_sort, input_path, input_file, args.column,
+                                work_dir + '/', 'sorted_python.csv')
+            report('external sort (%g MB runs)' % limit, elapsed, num_rows, num_bytes)
+        if os.path.isfile(args.rscript):
+            paths.R_SCRIPT_EXE = args.rscript
+            elapsed = time_sort(core.r_sort_by_input_column, input_path, input_file, args.column,
+                                work_dir + '/', 'sorted_r.csv')
+            report('Rscript data.table sort', elapsed, num_rows, num_bytes)
+        else:
+            print('Rscript not found at', args.rscript, '- skipping R comparison')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark state file sorting')
+    parser.add_argument('-r', '--rows', type=int, default=1000000,
+                        help='Number of synthetic rows to sort')
+    parser.add_argument('-i', '--input-path', help='Path to an existing file to sort')
+    parser.add_argument('-f', '--input-file', help='Name of an existing file to sort')
+    parser.add_argument('-c', '--column', default='16',
+                        help='Column to sort by, first column is 1')
+    parser.add_argument('-m', '--memory-limits', type=float, nargs='+',
+                        default=[external_sort.DEFAULT_MEMORY_LIMIT / 1024 / 1024, 64],
+                        help='Run memory budgets to benchmark, in MB')
+    parser.add_argument('--rscript', default=paths.R_SCRIPT_EXE,
+                        help='Path to the Rscript executable')
+    main(parser.parse_args())
@@ -0,0 +1,519 @@
+'''
+Synthetic data root generator for offline benchmarking.
+
+Writes a self-consistent data root with everything Modules 2 through 5
+read, so that they can be run and timed without the real D:/Data tree:
+
+    ListofStates.csv, countyfips.csv        States and county names
+    WorkFlow/allCounties.csv                County centroids
+    WorkFlow/county_adjacency2010.csv       County adjacency
+    WorkFlow/J2W.txt                        Journey to Work flows
+    Employment/SexByIndustryByCounty_MOD.csv
+    Employment/CountyEmployeeFiles/         EmpPat file per county
+    Schools/School Database/                School files and enrollment
+    Trip Distributions and Times/TripTypeDistributions.csv
+    Output/Module1/<State>Module1NN2ndRun.csv
+
+Counties are laid out on a grid, with each state a block of the grid, and
+are adjacent to the (up to 8) counties around them, across state borders.
+Persons are only generated in combinations the modules can handle, e.g.
+workers never live in household types that cannot work, and every county
+has employers in every industry.
+
+The population is written a row at a time, so any size fits in memory;
+10 thousand persons take a second, 50 million take around an hour.
+
+Usage:
+    python -m benchmarks.synthetic_data -o /tmp/synthetic -p 100000
+    python module_runner.py --data-root /tmp/synthetic -m module2 -s SynthA
+'''
+
+import os
+import json
+import math
+import random
+import argparse
+from model.utils import paths, writing
+
+# State codes used, in order. Codes from 60 on are treated as territories
+# by Module 2, and 15 is skipped as core.correct_FIPS() renames 15005.
+STATE_CODES = [code for code in range(1, 57) if code != 15]
+# Size of a county grid cell, in degrees
+CELL_SIZE = 0.3
+# South west corner of the grid
+GRID_ORIGIN = (30.0, -115.0)
+# Share of a county's workers that work in the county, in neighboring
+# counties, and abroad
+J2W_SHARES = (0.7, 0.28, 0.02)
+# One employer of each of these NAICS codes is written for every county,
+# covering every industry of Module 2 and Module 5
+NAICS_CODES = [('111110', 'Agriculture'), ('211111', 'Mining'), ('236115', 'Construction'),
+               ('311111', 'Manufacturing'), ('423110', 'Wholesale Trade'),
+               ('445110', 'Grocery Stores'), ('481111', 'Transportation'),
+               ('221111', 'Utilities'), ('511110', 'Information'), ('522110', 'Finance'),
+               ('531110', 'Real Estate'), ('541110', 'Professional Services'),
+               ('551111', 'Management'), ('561110', 'Administrative Services'),
+               ('611110', 'Educational Services'), ('621111', 'Health Care'),
+               ('711110', 'Arts'), ('722511', 'Restaurants'), ('811111', 'Other Services'),
+               ('921110', 'Public Administration')]
+# Columns of SexByIndustryByCounty_MOD.csv, see industry.IncomeEmployment
+EMP_INC_INDS = [29, 41, 53, 65, 77, 89, 113, 125, 137, 161,
+                173, 197, 209, 221, 245, 257, 281, 293, 305, 317]
+SEX_BY_INDUSTRY_COLUMNS = 326
+# Activity pattern weights by traveler type (columns) for every activity
+# pattern (rows), see activity.trip_type_to_pattern(). Pattern 14 (H-W-O-W-H)
+# is not drawn, as find_other_trips looks up an 'otr' industry key for it.
+ACTIVITY_PATTERN_WEIGHTS = [
+    # 0     1     2     3     4     5     6
+    [0.50, 0.00, 0.00, 0.00, 0.00, 0.00, 0.30],   # 0  H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.45, 0.00],   # 1  H-W-H
+    [0.00, 0.55, 0.00, 0.45, 0.00, 0.00, 0.00],   # 2  H-S-H
+    [0.30, 0.00, 0.00, 0.00, 0.00, 0.00, 0.40],   # 3  H-O-H
+    [0.00, 0.00, 0.40, 0.00, 0.40, 0.00, 0.00],   # 4  H-S-W-H
+    [0.00, 0.00, 0.40, 0.00, 0.30, 0.00, 0.00],   # 5  H-W-S-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.20, 0.00],   # 6  H-W-O-H
+    [0.00, 0.20, 0.00, 0.20, 0.00, 0.00, 0.00],   # 7  H-S-O-H
+    [0.10, 0.00, 0.00, 0.00, 0.00, 0.00, 0.15],   # 8  H-O-O-H
+    [0.00, 0.00, 0.10, 0.00, 0.15, 0.00, 0.00],   # 9  H-S-W-O-H
+    [0.00, 0.00, 0.10, 0.00, 0.15, 0.00, 0.00],   # 10 H-W-S-O-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.15, 0.00],   # 11 H-W-H-O-H
+    [0.00, 0.10, 0.00, 0.20, 0.00, 0.00, 0.00],   # 12 H-S-H-O-H
+    [0.10, 0.00, 0.00, 0.00, 0.00, 0.00, 0.15],   # 13 H-O-H-O-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00],   # 14 H-W-O-W-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.10, 0.00],   # 15 H-W-O-H-O-H
+    [0.00, 0.05, 0.00, 0.05, 0.00, 0.00, 0.00],   # 16 H-S-O-H-O-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.05, 0.00],   # 17 H-W-H-O-O-H
+    [0.00, 0.05, 0.00, 0.05, 0.00, 0.00, 0.00],   # 18 H-S-H-O-O-H
+    [0.00, 0.00, 0.00, 0.00, 0.00, 0.05, 0.00],   # 19 H-W-O-H-O-H-O-H
+    [0.00, 0.05, 0.00, 0.05, 0.00, 0.00, 0.00]]   # 20 H-S-O-H-O-H-O-H
+
+class SyntheticCounty:
+    """A county of the synthetic grid.
+
+    Attributes:
+        state (SyntheticState): State the county is in.
+        code (str): 3 digit county code.
+        fips (str): 5 digit FIPS code.
+        name (str): County name, as in countyfips.csv (e.g. C001 County).
+        short_name (str): County name without ' County', as used in
+            employer and school files.
+        row, col (int): Position of the county on the grid.
+        lat, lon (float): South west corner of the county.
+        population (int): Number of persons living in the county.
+    """
+
+    def __init__(self, state, index, row, col):
+        """See class docstring."""
+        self.state = state
+        self.code = str(2 * index + 1).rjust(3, '0')
+        self.fips = state.code + self.code
+        self.short_name = 'C' + self.code
+        self.name = self.short_name + ' County'
+        self.row, self.col = row, col
+        self.lat = GRID_ORIGIN[0] + row * CELL_SIZE
+        self.lon = GRID_ORIGIN[1] + col * CELL_SIZE
+        self.population = 0
+
+    @property
+    def centroid(self):
+        return self.lat + CELL_SIZE / 2, self.lon + CELL_SIZE / 2
+
+    def random_point(self, rand):
+        """Returns a random lat, lon pair within the county."""
+        return (self.lat + rand.uniform(0.01, CELL_SIZE - 0.01),
+                self.lon + rand.uniform(0.01, CELL_SIZE - 0.01))
+
+class SyntheticState:
+    """A state of the synthetic grid.
+
+    Attributes:
+        name (str): State name, without spaces (e.g. SynthA).
+        abbrev (str): 2 character abbreviation (e.g. ZA).
+        code (str): 2 digit state code.
+        counties (list): SyntheticCounty of every county in the state.
+    """
+
+    def __init__(self, index):
+        """See class docstring."""
+        letters = chr(ord('A') + index % 26) + ('' if index < 26 else chr(ord('A') + index // 26 - 1))
+        self.name = 'Synth' + letters
+        self.abbrev = 'Z' + chr(ord('A') + index % 26) if index < 26 else 'Y' + chr(ord('A') + index - 26)
+        self.code = str(STATE_CODES[index]).rjust(2, '0')
+        self.counties = []
+
+    @property
+    def population(self):
+        return sum(county.population for county in self.counties)
+
+def build_grid(num_states, counties_per_state):
+    """Lays out states and counties on a grid.
+
+    Each state is a square block of counties, and states are placed in a
+    square arrangement of blocks.
+
+    Returns:
+        states (list): SyntheticState of every state.
+        grid (dict): Associates each grid position with its county.
+    """
+    if num_states > len(STATE_CODES):
+        raise ValueError('At most ' + str(len(STATE_CODES)) + ' states can be generated')
+    if counties_per_state > 499:
+        raise ValueError('At most 499 counties per state can be generated')
+    block = int(math.ceil(math.sqrt(counties_per_state)))
+    blocks_per_row = int(math.ceil(math.sqrt(num_states)))
+    states = []
+    grid = dict()
+    for state_index in range(num_states):
+        state = SyntheticState(state_index)
+        block_row, block_col = divmod(state_index, blocks_per_row)
+        for index in range(counties_per_state):
+            row, col = divmod(index, block)
+            county = SyntheticCounty(state, index, block_row * block + row, block_col * block + col)
+            state.counties.append(county)
+            grid[(county.row, county.col)] = county
+        states.append(state)
+    return states, grid
+
+def neighbors(county, grid):
+    """Returns the counties around a county, across state borders."""
+    return [grid[(county.row + d_row, county.col + d_col)]
+            for d_row in (-1, 0, 1) for d_col in (-1, 0, 1)
+            if (d_row or d_col) and (county.row + d_row, county.col + d_col) in grid]
+
+def allocate_population(states, num_persons, rand):
+    """Splits the population between counties, with skewed county sizes."""
+    counties = [county for state in states for county in state.counties]
+    weights = [rand.lognormvariate(0, 1) for _ in counties]
+    total = sum(weights)
+    for county, weight in zip(counties, weights):
+        county.population = int(num_persons * weight / total)
+    for county in rand.sample(counties, num_persons - sum(c.population for c in counties)):
+        county.population += 1
+
+def open_csv(file_path):
+    """Opens a csv file for writing, creating its folder if needed."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    return open(file_path, 'w+')
+
+def write_states(states):
+    """Writes ListofStates.csv, ListofStatesNoAlaska.csv and countyfips.csv."""
+    for file_name in ('ListofStates.csv', 'ListofStatesNoAlaska.csv'):
+        with open_csv(paths.MAIN_DRIVE + file_name) as write:
+            writer = writing.csv_writer(write)
+            for state in states:
+                writer.writerow([state.name, state.abbrev, state.code])
+    with open_csv(paths.MAIN_DRIVE + 'countyfips.csv') as write:
+        writer = writing.csv_writer(write)
+        for state in states:
+            for county in state.counties:
+                writer.writerow([state.abbrev, state.code, county.code, county.name])
+
+def write_counties(states, grid):
+    """Writes allCounties.csv and county_adjacency2010.csv."""
+    with open_csv(paths.WORKFLOW + 'allCounties.csv') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['Index', 'State_Code', 'County_Code', 'FIPS', 'Lat', 'Lon', 'Name'])
+        index = 0
+        for state in states:
+            for county in state.counties:
+                lat, lon = county.centroid
+                writer.writerow([index, state.code, county.code, county.fips,
+                                 '%.6f' % lat, '%.6f' % lon, county.name])
+                index += 1
+    with open_csv(paths.WORKFLOW + 'county_adjacency2010.csv') as write:
+        writer = writing.csv_writer(write)
+        for state in states:
+            for county in state.counties:
+                home = county.name + ', ' + state.abbrev
+                writer.writerow([home, county.fips, home, county.fips])
+                for neighbor in neighbors(county, grid):
+                    writer.writerow([home, county.fips,
+                                     neighbor.name + ', ' + neighbor.state.abbrev, neighbor.fips])
+
+def write_j2w(states, grid):
+    """Writes J2W.txt, with flows in proportion to county population.
+
+    Destination state codes have 3 digits, and destinations abroad have a
+    state code that does not start with 0, as in the Census file.
+    """
+    own, near, abroad = J2W_SHARES
+    with open_csv(paths.WORKFLOW + 'J2W.txt') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['Residence_State', 'Residence_County', 'Work_State',
+                         'Work_County', 'Workers'])
+        for state in states:
+            for county in state.counties:
+                workers = max(county.population, 10)
+                writer.writerow([state.code, county.code, '0' + state.code, county.code,
+                                 max(int(workers * own), 1)])
+                adjacent = neighbors(county, grid)
+                for neighbor in adjacent:
+                    writer.writerow([state.code, county.code, '0' + neighbor.state.code,
+                                     neighbor.code, max(int(workers * near / len(adjacent)), 1)])
+                writer.writerow([state.code, county.code, '300', '001',
+                                 max(int(workers * abroad), 1)])
+
+def write_sex_by_industry(states, rand):
+    """Writes SexByIndustryByCounty_MOD.csv.
+
+    Each industry has a total employment, the percentage of men and women
+    employed in it and their median incomes. Unused columns are zero.
+    """
+    with open_csv(paths.EMPLOYMENT + 'SexByIndustryByCounty_MOD.csv') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['Id', 'FIPS', 'Geography']
+                        + ['Column' + str(i) for i in range(3, SEX_BY_INDUSTRY_COLUMNS)])
+        for state in states:
+            for county in state.counties:
+                row = ['0'] * SEX_BY_INDUSTRY_COLUMNS
+                row[0:3] = ['0500000US' + county.fips, county.fips,
+                            county.name + ', ' + state.name]
+                for ind in EMP_INC_INDS:
+                    male = rand.uniform(20, 80)
+                    row[ind - 2] = str(rand.randint(100, 10000))
+                    row[ind] = '%.1f' % male
+                    row[ind + 2] = '%.1f' % (100 - male)
+                    row[ind + 6] = '%.2f' % rand.uniform(15000, 120000)
+                    row[ind + 8] = '%.2f' % rand.uniform(15000, 120000)
+                writer.writerow(row)
+
+def employer_row(county, rand, name, naics, description, employees):
+    """Builds an EmpPat file row, also used for post-secondary schools."""
+    lat, lon = county.random_point(rand)
+    return [name, str(rand.randint(1, 9999)) + ' Main St', county.short_name + ' City',
+            county.state.abbrev, str(rand.randint(10000, 99999)), county.short_name,
+            'NA', 'NA', 'NA', naics, description, '1', str(rand.randint(1, 2000)),
+            str(employees), 'NA', '%.6f' % lat, '%.6f' % lon]
+
+def write_employers(states, employers_per_county, rand):
+    """Writes the EmpPat file of every county.
+
+    Every county has an employer in every industry, and as many more
+    employers, of random industries, as needed to reach employers_per_county.
+    """
+    for state in states:
+        for county in state.counties:
+            file_path = (paths.COUNTY + state.abbrev + '/' + county.fips + '_'
+                         + state.abbrev + '_EmpPatFile.csv')
+            with open_csv(file_path) as write:
+                writer = writing.csv_writer(write)
+                num_employers = max(employers_per_county, len(NAICS_CODES))
+                for index in range(num_employers):
+                    naics, description = (NAICS_CODES[index] if index < len(NAICS_CODES)
+                                          else rand.choice(NAICS_CODES))
+                    writer.writerow(employer_row(county, rand, 'Employer ' + county.fips + '-'
+                                                 + str(index), naics, description,
+                                                 rand.randint(1, 500)))
+
+def write_schools(states, grid, rand):
+    """Writes public, private and post-secondary school files.
+
+    Some counties have no public elementary or middle schools, or no
+    private or post-secondary schools, so that every fallback of Module 3
+    is exercised. Counties without elementary schools are spread out so
+    that a neighbor always has one.
+    """
+    school_dbase = paths.SCHOOL_DBASE
+    for state in states:
+        for county in state.counties:
+            counts = {'Elem': rand.randint(2, 6), 'Mid': rand.randint(1, 3),
+                      'High': rand.randint(1, 2)}
+            if (county.row + 2 * county.col) % 11 == 0:
+                counts['Elem'] = 0
+            if rand.random() < 0.05:
+                counts['Mid'] = 0
+            for school_type, count in counts.items():
+                if count == 0:
+                    continue
+                file_path = (school_dbase + 'CountyPublicSchools/' + school_type + '/'
+                             + county.fips + school_type + '.csv')
+                with open_csv(file_path) as write:
+                    writer = writing.csv_writer(write)
+                    for index in range(count):
+                        lat, lon = county.random_point(rand)
+                        writer.writerow([state.abbrev, county.short_name, county.short_name + ' City',
+                                         school_type + ' School ' + county.fips + '-' + str(index),
+                                         'NA', rand.randint(100, 2000), '%.6f' % lat, '%.6f' % lon])
+            num_private = rand.choice([0, 1, 2, 3, 4])
+            if num_private:
+                with open_csv(school_dbase + 'CountyPrivateSchools/' + county.fips
+                              + 'Private.csv') as write:
+                    writer = writing.csv_writer(write)
+                    for index in range(num_private):
+                        lat, lon = county.random_point(rand)
+                        writer.writerow(['Private School ' + county.fips + '-' + str(index),
+                                         state.abbrev, county.short_name + ' City', county.short_name,
+                                         '%.6f' % lat, '%.6f' % lon, str(index % 3 + 1),
+                                         rand.randint(20, 800)])
+            for suffix in ('University', 'CommunityCollege', 'NonDegree'):
+                if rand.random() < 0.3:
+                    continue
+                with open_csv(school_dbase + 'PostSecSchoolsByCounty/' + state.abbrev + '/'
+                              + county.fips + suffix + '.csv') as write:
+                    writer = writing.csv_writer(write)
+                    writer.writerow(employer_row(county, rand, suffix + ' ' + county.fips,
+                                                 '611310', 'Colleges', rand.randint(50, 5000)))
+
+def write_enrollment(states):
+    """Writes state enrollment files, in proportion to state population.
+
+    Module 3 takes every student it assigns out of the state enrollment,
+    so enrollment is set well above the number of students generated.
+    """
+    school_dbase = paths.SCHOOL_DBASE
+    with open_csv(school_dbase + 'stateenrollmentindegrees.csv') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['State', 'Total', 'NonDegree', 'Degree', 'Bachelors',
+                         'Graduate', 'Associates'])
+        for state in states:
+            pop = max(state.population, 100)
+            writer.writerow([state.name, pop * 0.5, pop * 0.05, pop * 0.45,
+                             pop * 0.25, pop * 0.05, pop * 0.15])
+    with open_csv(school_dbase + 'statehighelemmidenrollment.csv') as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['State', 'Total2006', 'ElemMid2006', 'High2006', 'Total2007',
+                         'ElemMid2007', 'High2007', 'Total2008', 'Total2009'])
+        for state in states:
+            total = max(state.population, 100) * 0.6
+            writer.writerow([state.name, total, total * 0.7, total * 0.3, total,
+                             total * 0.69, total * 0.31, total, total])
+
+def write_activity_patterns():
+    """Writes TripTypeDistributions.csv."""
+    with open_csv(paths.TRIP_DISTS + 'TripTypeDistributions.csv') as write:
+        writer = writing.csv_writer(write)
+        writer.writerows(ACTIVITY_PATTERN_WEIGHTS)
+
+def person_types(age, household_type, rand):
+    """Draws a traveler type for a person.
+
+    Only household types 0 and 1 have workers or students, matching
+    adjacency.J2WDist.get_work_county_fips() and assign_county.AssignType.
+    Traveler types 2, 4 and 5 work, and 1 through 4 go to school.
+    """
+    if household_type == 6:
+        return 3
+    if household_type != 0 and household_type != 1:
+        return 0 if age < 5 else 6
+    split = rand.random()
+    if age < 5:
+        return 0
+    if age < 16:
+        return 1
+    if age < 19:
+        return 1 if split < 0.8 else 2
+    if age < 25:
+        return 3 if split < 0.4 else 4 if split < 0.6 else 5 if split < 0.9 else 6
+    if age < 65:
+        return 5 if split < 0.75 else 6
+    return 6 if split < 0.85 else 5
+
+def household(rand):
+    """Draws a household type and the ages of its members."""
+    split = rand.random()
+    if split < 0.02:
+        # College dormitory resident
+        return 6, [rand.randint(18, 22)]
+    if split < 0.2:
+        # Non-family household
+        return rand.choice([2, 3, 4, 5, 7]), [rand.randint(25, 90)
+                                              for _ in range(rand.randint(1, 2))]
+    adults = [rand.randint(25, 70) for _ in range(rand.randint(1, 2))]
+    children = [rand.randint(0, 24) for _ in range(rand.choice([0, 0, 1, 2, 3]))]
+    return rand.choice([0, 0, 1]), adults + children
+
+def write_population(state, rand):
+    """Writes the Module 1 output file of a state, grouped by county."""
+    file_path = paths.MODULES[0] + state.name + 'Module1NN2ndRun.csv'
+    person_id = 0
+    household_id = 0
+    with open_csv(file_path) as write:
+        writer = writing.csv_writer(write)
+        writer.writerow(['Residence_State', 'County_Code', 'Tract_Code', 'Block_Code',
+                         'HH_ID', 'HH_TYPE', 'Latitude', 'Longitude', 'Person_ID_Number',
+                         'Age', 'Sex', 'Traveler_Type', 'Income_Bracket', 'Income_Amount'])
+        for county in state.counties:
+            remaining = county.population
+            while remaining > 0:
+                household_type, ages = household(rand)
+                lat, lon = county.random_point(rand)
+                tract = str(rand.randint(100, 999999))
+                block = str(rand.randint(1000, 9999))
+                for age in ages[:remaining]:
+                    traveler_type = person_types(age, household_type, rand)
+                    if traveler_type in (2, 4, 5):
+                        income = rand.randint(10000, 200000)
+                    else:
+                        income = 0
+                    writer.writerow([state.code, county.code, tract, block, household_id,
+                                     household_type, '%.6f' % lat, '%.6f' % lon, person_id,
+                                     age, rand.randint(0, 1), traveler_type,
+                                     min(income // 20000 + 1, 10), income])
+                    person_id += 1
+                remaining -= len(ages[:remaining])
+                household_id += 1
+
+def make_output_dirs():
+    """Creates the output folder of every module."""
+    for module_path in paths.MODULES:
+        os.makedirs(module_path, exist_ok=True)
+
+def generate(root, num_persons, num_states=2, counties_per_state=16,
+             employers_per_county=50, seed=0):
+    """Writes a synthetic data root.
+
+    Inputs:
+        root (str): Folder to write the data root to. paths is pointed at
+            it, see paths.set_root().
+        num_persons (int): Number of persons, over all states.
+        num_states (int): Number of states.
+        counties_per_state (int): Number of counties in each state.
+        employers_per_county (int): Number of employers in each county.
+        seed (int): Seed for the random number generator.
+
+    Returns:
+        states (list): SyntheticState of every state written.
+    """
+    rand = random.Random(seed)
+    paths.set_root(root)
+    states, grid = build_grid(num_states, counties_per_state)
+    allocate_population(states, num_persons, rand)
+    make_output_dirs()
+    print('Writing reference data to', paths.MAIN_DRIVE)
+    write_states(states)
+    write_counties(states, grid)
+    write_j2w(states, grid)
+    write_sex_by_industry(states, rand)
+    write_employers(states, employers_per_county, rand)
+    write_schools(states, grid, rand)
+    write_enrollment(states)
+    write_activity_patterns()
+    for state in states:
+        print('Writing', state.population, 'persons for', state.name)
+        write_population(state, rand)
+    with open_csv(paths.MAIN_DRIVE + 'synthetic.json') as write:
+        json.dump({'persons': num_persons, 'states': [state.name for state in states],
+                   'counties_per_state': counties_per_state,
+                   'employers_per_county': employers_per_county, 'seed': seed},
+                  write, indent=2)
+    return states
+
+def main(args):
+    generate(args.output, args.persons, args.states, args.counties,
+             args.employers, args.seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic data root')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Folder to write the data root to')
+    parser.add_argument('-p', '--persons', type=int, default=10000,
+                        help='Number of persons over all states (default: %(default)s)')
+    parser.add_argument('-s', '--states', type=int, default=2,
+                        help='Number of states (default: %(default)s)')
+    parser.add_argument('-c', '--counties', type=int, default=16,
+                        help='Number of counties per state (default: %(default)s)')
+    parser.add_argument('-e', '--employers', type=int, default=50,
+                        help='Number of employers per county (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: %(default)s)')
+    main(parser.parse_args())
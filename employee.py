@@ -1,5 +1,6 @@
 import argparse
 from datetime import datetime
+import model.utils.core as core
 import model.utils.paths as paths
 import model.utils.reading as reading
 import model.utils.writing as writing
@@ -18,6 +19,8 @@ class EmployerFileBuilder:
         name_data (list): Information on each county, where the first element 
             is a FIPS code, and a second element is a list with each element
             the space-split county name associated with the corresponding FIPS code.
+        county_resolver (CountyNameResolver): Index over name_data for
+            matching county names to FIPS codes.
         patronage_data (list): Information on every employer associated with
             the state.
     """
@@ -64,6 +67,7 @@ class EmployerFileBuilder:
             for line in county_data:
                 splitter = line.split(',')
                 self.name_data.append([splitter[3], splitter[6].split(' ')])
+            self.county_resolver = core.CountyNameResolver(self.name_data)
 
     def lookup_zip(self, zip_code):
         """Return FIPS County code for a given zip code.
@@ -81,8 +85,8 @@ class EmployerFileBuilder:
     def lookup_name(self, county_name, code):
         """Match County Name from EMP file to County Name in FIPS Related Data.
         
-        This string comparison is slow and should only be used when a mapping between
-        zip code to fips code does not exist.
+        Should only be used when a mapping between zip code to fips code
+        does not exist.
         
         Inputs:
             county_name (str): Name of the county.
@@ -91,22 +95,7 @@ class EmployerFileBuilder:
         Returns:
             fips_code (str): A FIPS code for a county.
         """
-        splitter = county_name.strip('"').split(' ')
-        for county in self.name_data:
-            if splitter[0] == county[1][0] and len(splitter) == 1:
-                if county[0][0:2] == code:
-                    return county[0]
-            elif splitter[0] == county[1][0] and splitter[1] == county[1][1] and len(splitter) == 2:
-                if county[0][0:2] == code:
-                    return county[0]
-            elif len(county[1]) == 3 and len(splitter) > 2:
-                if splitter[0] == county[1][0] and splitter[1] == county[1][1] and splitter[2] == county[1][2]:
-                    if [0][0:2] == code:
-                        return county[0]
-            elif len(county[1]) > 3 and len(splitter) > 1:
-                if splitter[0] == county[1][0] and splitter[1] == county[1][1]:
-                    if county[0][0:2] == code:
-                        return county[0]
+        return self.county_resolver.lookup(county_name, code)
 
     def state_employment_to_county_employment(self):
         """Read in state employement file and parse it into county files.
@@ -26,7 +26,11 @@ is original.
 """
 
 import random
-from ..utils import paths, reading, distance
+import numpy as np
+from ..utils import paths, reading, distance, refdata
+
+# Binary cache of the Journey to Work Census, see read_j2w_cache()
+J2W_CACHE = 'J2W.npz'
 
 class County:
     """County data encapsulation and access functionality.  
@@ -105,6 +109,9 @@ def read_counties(fips):
         lat (float): Latitude point of centroid of county.
         lon (float): Longitutde Point of centroid of county.
     """
+    bundle = refdata.load()
+    if bundle is not None:
+        return bundle.county_coords(fips)
     fname = paths.WORKFLOW + '/allCounties.csv'
     with open(fname) as file:
         for line in file:
@@ -113,20 +120,32 @@ def read_counties(fips):
                 return splitter[4], splitter[5]
         
 def read_data(fips):
-    file_path = paths.WORKFLOW + 'county_adjacency2010.csv'
-    with open(file_path) as read:
-        reader = reading.csv_reader(read)
-        neighbors = []
-        for row in reader:
-            if row[1] == fips:
-                neighbors.append(row)
+    """Get a county and all of its neighbors from the county adjacency file.
+
+    Inputs:
+        fips (str): County FIPS code.
+
+    Returns:
+        home_county (County): County identified by fips, with all of its
+            neighbors added.
+    """
+    bundle = refdata.load()
+    if bundle is not None:
+        neighbors = bundle.neighbors(fips)
+    else:
+        file_path = paths.WORKFLOW + 'county_adjacency2010.csv'
+        with open(file_path) as read:
+            reader = reading.csv_reader(read)
+            neighbors = []
+            for row in reader:
+                if row[1] == fips:
+                    neighbors.append((row[2], row[3]))
     neighbor_counties = []
     home_county = None
-    for neighbor in neighbors:
-        county_name, state_abbrev = neighbor[2].split(', ')
-        curr_fips = neighbor[3]
+    for neighbor_name, curr_fips in neighbors:
+        county_name, state_abbrev = neighbor_name.split(', ')
         state_code, county_code = curr_fips[0:2], curr_fips[2:5]
-        if neighbor[3] == fips:
+        if curr_fips == fips:
             home_county = County(county_name, state_abbrev, curr_fips, state_code, county_code)
         else:
             neighbor_counties.append(County(county_name, state_abbrev, curr_fips, state_code, county_code))
@@ -151,75 +170,200 @@ def get_distance(fips1, fips2):
         
 def read_j2w():
     """Read Journey to Work Census.
+
+    The census is read from the reference data bundle if there is one, and
+    otherwise from its binary cache, see read_j2w_cache().
     
     Returns: 
-        J2W (list): J2W census data.
+        J2W (J2WMatrix): J2W census data.
     """
+    bundle = refdata.load()
+    if bundle is not None:
+        return J2WMatrix(bundle.j2w())
+    return J2WMatrix(read_j2w_cache())
+
+def read_j2w_cache():
+    """Read the Journey to Work Census arrays from their binary cache.
+
+    The cache, J2W.npz next to J2W.txt, holds the arrays of
+    refdata.compile_j2w() and the modification time and size of J2W.txt
+    they were compiled from. It is memory mapped on load, and compiled
+    again whenever J2W.txt changes.
+
+    Returns:
+        arrays (dict): J2W matrix arrays, see refdata.compile_j2w().
+    """
+    source = paths.WORKFLOW + 'J2W.txt'
+    cache = paths.WORKFLOW + J2W_CACHE
+    stamp = refdata.file_stamp(source)
+    arrays = refdata.load_npz(cache)
+    if (arrays is not None and int(arrays['version']) == refdata.BUNDLE_VERSION
+            and float(arrays['source_mtime']) == stamp['mtime']
+            and int(arrays['source_size']) == stamp['size']):
+        return arrays
+    print('Compiling', source, 'to', cache)
+    arrays = refdata.compile_j2w(source)
+    refdata.save_npz(cache, dict(arrays, version=np.array(refdata.BUNDLE_VERSION),
+                                 source_mtime=np.array(stamp['mtime']),
+                                 source_size=np.array(stamp['size'])))
+    return arrays
+
+class J2WMatrix:
+    """Journey to Work data as a compressed sparse row (CSR) matrix.
+
+    Flows are kept in the arrays of refdata.compile_j2w(), memory mapped
+    from the bundle or the binary cache, rather than in a dict per county.
+
+    Attributes:
+        fips (list): FIPS codes of all counties in the census, by index.
+        index (dict): Associates each FIPS code with its index in fips.
+        offsets (ndarray): Flows out of the county of index i are held
+            between offsets[i] and offsets[i + 1] of dest and workers.
+        dest (ndarray): Index of the destination county of every flow.
+        workers (ndarray): Number of workers of every flow, as int32.
+    """
+
+    def __init__(self, arrays):
+        """Initializes the matrix.
+
+        Inputs:
+            arrays (dict): J2W matrix arrays, see refdata.compile_j2w().
+        """
+        self.fips = arrays['j2w_fips'].tolist()
+        self.index = {fips: idx for idx, fips in enumerate(self.fips)}
+        self.offsets = arrays['j2w_offsets']
+        self.dest = arrays['j2w_dest']
+        self.workers = arrays['j2w_workers']
+
+    def __contains__(self, fips):
+        """Whether workers commute out of a county."""
+        idx = self.index.get(fips)
+        return idx is not None and self.offsets[idx] != self.offsets[idx + 1]
+
+    def flows(self, fips):
+        """Get the counties workers commute to from a county.
+
+        Inputs:
+            fips (str): A county FIPS code.
+
+        Returns:
+            counties (list): FIPS codes of the counties commuted to.
+            workers (list): Number of workers commuting to each county.
+
+        Raises:
+            KeyError: If no workers commute out of the county.
+        """
+        if fips not in self:
+            raise KeyError(fips)
+        idx = self.index[fips]
+        start, end = self.offsets[idx:idx + 2].tolist()
+        return ([self.fips[dest] for dest in self.dest[start:end].tolist()],
+                self.workers[start:end].tolist())
     
-    j2w_data = dict()
-    with open(paths.WORKFLOW + '/J2W.txt') as read:
-        reader = reading.csv_reader(read)
-        next(reader)
-        for row in reader:
-            curr_fips = row[0] + row[1]
-            if curr_fips not in j2w_data:
-                j2w_data[curr_fips] = dict()
-            dest_fips = row[2] + row[3]
-            movements = int(row[4])
-            j2w_data[curr_fips][dest_fips] = movements
-    return j2w_data
-    
+# Counties commuted to from below which select() scans the worker counts,
+# as descending a tree is slower than a linear scan for short lists
+TREE_MIN_COUNTIES = 30
+
 class J2WDist:
     """Journey to Work data encapsulation.  
+
+    Workers are drawn without replacement, see select(). For counties
+    commuting to at least TREE_MIN_COUNTIES counties, worker counts are
+    kept in a binary indexed (Fenwick) tree, so that a draw, which finds a
+    county by cumulative worker count and takes a worker out of it, takes
+    O(log n) time in the number of counties commuted to. The total is
+    kept as workers are taken out rather than summed for every draw.
     
     Attributes:    
-        movements (list): Movements from adjacency.get_movements().
         counties (list): All FIPS codes that workers are commuting to.
         workers (list): Number of workers that are commuting from a county 
             to another county. The indices in counties correlate to the
             indices in workers, so the element from workers[0] describes
             the number of workers moving from a county to the county identified
             in counties[0].
+        tree (list): Binary indexed tree over workers, where tree[i] holds
+            the sum of the workers of counties i - (i & -i) to i - 1, or
+            None if workers are scanned.
+        total (int): Number of workers left to draw.
     """    
 
     def __init__(self, j2w_data, curr_fips):
         """Initializes all J2W data.
     
         Inputs: 
-            See J2WDist class docstring.
+            j2w_data (J2WMatrix): J2W census data, see read_j2w().
+            curr_fips (str): FIPS code of the county commuted from.
         """
-        self.movements = j2w_data[curr_fips]
-        self.counties, self.workers = self.set_counties()
-
-    def set_counties(self):
-        """Set county and worker movement lists for a county."""
-        counties = []
-        workers = []
-        for county, worker in self.movements.items():
-            counties.append(county)
-            workers.append(worker)
-        return counties, workers
+        self.counties, self.workers = j2w_data.flows(curr_fips)
+        self.build_tree()
+
+    def build_tree(self):
+        """Builds the tree, if needed, and total from workers, in O(n) time."""
+        size = len(self.workers)
+        self.total = sum(self.workers)
+        if size < TREE_MIN_COUNTIES:
+            self.tree = None
+            return
+        tree = [0] + self.workers
+        for index in range(1, size + 1):
+            parent = index + (index & -index)
+            if parent <= size:
+                tree[parent] += tree[index]
+        self.tree = tree
 
     def total_workers(self):
         """Get total number of workers commuting out of a county."""
-        return sum(self.workers)
+        return self.total
 
     def select(self):
         """Randomly select a work county from the list of commutable counties.
+
+        The county drawn is the first whose cumulative worker count exceeds
+        a uniform variate over all workers left, as a linear scan would
+        find, and one of its workers is taken out. If no workers are left,
+        the last county is returned.
         
         Returns:
             county (str): A county FIPS code.
         """
-        variate = random.random() * sum(self.workers)
-        cum = 0.0
-        count = 0
-        for county in self.counties:
-            cum += self.workers[count]
+        variate = random.random() * self.total
+        tree = self.tree
+        if tree is None:
+            return self.scan(variate)
+        size = len(tree) - 1
+        position = 0
+        # Workers of the counties before position, summed exactly as ints
+        before = 0
+        step = 1 << size.bit_length()
+        while step:
+            following = position + step
+            if following <= size and before + tree[following] <= variate:
+                position = following
+                before += tree[following]
+            step >>= 1
+        if position == size:
+            return self.counties[-1]
+        self.workers[position] -= 1
+        self.total -= 1
+        index = position + 1
+        while index <= size:
+            tree[index] -= 1
+            index += index & -index
+        return self.counties[position]
+
+    def scan(self, variate):
+        """Draws a work county by scanning the worker counts, see select()."""
+        workers = self.workers
+        cum = 0
+        position = 0
+        for worker in workers:
+            cum += worker
             if variate < cum:
-                self.workers[count] -= 1
-                return county
-            count += 1
-        return county
+                workers[position] -= 1
+                self.total -= 1
+                return self.counties[position]
+            position += 1
+        return self.counties[-1]
 
     def get_work_county_fips(self, home_fips, household_type, traveler_type):
         """Select a work county for a worker to commute to.
@@ -14,7 +14,7 @@ Median Income and prepares that dataset for operations, extracting the
 
 Relies on access to the ACS Industry data.
 
-DEPENDENCIES: None
+DEPENDENCIES: NumPy
 
 Note: None of this code is taken from Mufti's Module 2 Synthesizer
 which performs all of these tasks in an entirely different way.
@@ -22,7 +22,8 @@ which performs all of these tasks in an entirely different way.
 """
 import random
 import bisect
-from ..utils import paths, reading, core
+import numpy as np
+from ..utils import paths, reading, core, refdata
 
 class IncomeEmployment:
     """Income and Employment data encapsulation functionality.
@@ -30,51 +31,39 @@ class IncomeEmployment:
     Note that 0 refers to female, 1 refers to male.    
     
     Attributes:    
-        all_inc (dict): Income related data for each county by gender, with each 
-            key as a gender and value a list of lists, with each list containing
-            information on income statistics for a specific county.
-        all_emp (dict): Employment related data for each county by gender, with each 
-            key as a gender and value a list of lists, with each list containing
-            information on employment statistics for a specific county.
+        all_inc (ndarray): Median income of every industry, by gender and
+            county, with shape (gender, county, industry).
+        all_emp (ndarray): Number of employees of every industry, by gender
+            and county, with shape (gender, county, industry).
         id_inds (list): List of indices for row identifier information.
         emp_inc_inds (list): List of indices for employment and income related data.
-        FIPS_index_dict (dict): Associates a FIPS code with an index.
+        FIPS_index_dict (dict): Associates a FIPS code with a county index.
     """
-    def __init__(self):
-        """Initializes all prerequisites to obtain income and employment data."""
-        # 0 = Women, 1 = Male
-        self.all_inc = {0: [], 1: []}
-        self.all_emp = {0: [], 1: []}   
-        self.id_inds = [0, 1, 2]
-        self.emp_inc_inds = [29, 41, 53, 65, 77, 89, 113, 125, 137, 161, 
-                             173, 197, 209, 221, 245, 257, 281, 293, 305, 317]
-        self.FIPS_index_dict = {}
-        
-    def get_row_inc_emp_data(self, row):
-        """Functionality for getting income and employment data from a specific row.
-        
+    def __init__(self, ids, columns, values):
+        """Initializes income and employment data from numeric columns.
+
         Inputs:
-            row (list): Row from file, usually of form 'SexByIndustryByCounty_MOD.csv'.
+            ids (ndarray): Row identifiers, the first three columns of
+                'SexByIndustryByCounty_MOD.csv', one row per county.
+            columns (list): Column numbers of values, see
+                refdata.sex_by_industry_columns().
+            values (ndarray): Numeric values of those columns, one row
+                per county.
         """
-        row_inc = {0: [], 1: []}
-        row_emp = {0: [], 1: []}
-        #Create Men Employment By Industry, Women Employment, Men Median Income By Industry, Women Med Income
-        _get_row_identifiers(row_inc, row, self.id_inds)
-        _get_row_identifiers(row_emp, row, self.id_inds)
-        _get_row_emp_percents(row_emp, row, self.emp_inc_inds)
-        _get_row_inc_data(row_inc, row, [ind + 6 for ind in self.emp_inc_inds])
-        
-        for key in self.all_emp:
-            self.all_emp[key].append(row_emp[key])
-        for key in self.all_inc:
-            self.all_inc[key].append(row_inc[key])
-        
-        self._create_FIPS_index_dict()
-        
-    def _create_FIPS_index_dict(self):
-        """Creates mapping from FIPS code to index in employment and income dictionary."""
-        for index, county_data in enumerate(self.all_emp[1]):    
-            self.FIPS_index_dict[county_data[1]] = index
+        self.id_inds = [0, 1, 2]
+        self.emp_inc_inds = refdata.EMP_INC_INDS
+        position = {column: idx for idx, column in enumerate(columns)}
+
+        def select(offset):
+            return values[:, [position[ind + offset] for ind in self.emp_inc_inds]]
+
+        #Employment is the total employment times the percentage for each gender
+        total = select(-2)
+        # 0 = Women, 1 = Male
+        self.all_emp = np.stack([select(2) * total / 100.0, select(0) * total / 100.0])
+        self.all_inc = np.stack([select(8), select(6)])
+        self.FIPS_index_dict = {fips: idx for idx, fips in
+                                enumerate(ids[:, self.id_inds[1]].tolist())}
     
     def get_county_index(self, work_county):
         """Get county index for a work county.
@@ -87,47 +76,6 @@ class IncomeEmployment:
                 in IncomeEmployment.
         """
         return self.FIPS_index_dict[work_county]
-        
-def _get_row_identifiers(dictionary, row, indices):
-    """Gets row identifier information from income and employment data.
-    
-    Inputs:
-        dictionary (dict): Data dictionary for income and employment data.
-        row (list): Row from file, usually of form 'SexByIndustryByCounty_MOD.csv'.
-        indices (list): Indexes of interest from file row.
-    """
-    for key in dictionary:
-        for index in indices:
-            dictionary[key].append(row[index])
-
-def _get_row_emp_percents(dictionary, row, indices):
-    """Gets percentage information for employment data.
-    
-    Inputs:
-        dictionary (dict): Data dictionary for income and employment data.
-        row (list): Row from file, usually of form 'SexByIndustryByCounty_MOD.csv'.
-        indices (list): Indexes of interest from file row.
-    """
-    for key in dictionary:
-        for index in indices:
-            total = float(row[index-2])
-            if key == 0:
-                index += 2 
-            dictionary[key].append(float(row[index]) * total / 100.0)
-                
-def _get_row_inc_data(dictionary, row, indices):
-    """Gets information for income data.
-    
-    Inputs:
-        dictionary (dict): Data dictionary for income and employment data.
-        row (list): Row from file, usually of form 'SexByIndustryByCounty_MOD.csv'.
-        indices (list): Indexes of interest from file row.
-    """
-    for key in dictionary:
-        for index in indices:
-            if key == 0:
-                index += 2 
-            dictionary[key].append(float(row[index]))
             
 def read_county_employment(fips):
     """Read in county employment/patronage file and get list of all employers.
@@ -170,13 +118,12 @@ def read_employment_income_by_industry():
         inc_emp (IncomeEmployment): Contains income and employment data 
             as well as functions to interact with this data.
     """
-    with open(paths.EMPLOYMENT + 'SexByIndustryByCounty_MOD.csv') as empl_file:
-        reader = reading.csv_reader(empl_file)
-        next(reader)
-        inc_emp = IncomeEmployment()
-        for row in reader:
-            inc_emp.get_row_inc_emp_data(row)
-        return inc_emp
+    bundle = refdata.load()
+    if bundle is not None:
+        return IncomeEmployment(*bundle.sex_by_industry())
+    arrays = refdata.compile_sex_by_industry(paths.EMPLOYMENT + 'SexByIndustryByCounty_MOD.csv')
+    return IncomeEmployment(arrays['industry_ids'], arrays['industry_columns'].tolist(),
+                            arrays['industry_values'])
 
 def get_work_industry(work_county, gender, income, inc_emp, markers):
     """Returns the industry of work given information about a worker.
@@ -202,8 +149,9 @@ def get_work_industry(work_county, gender, income, inc_emp, markers):
         return -2, -2
     #Normal In-Country Worker
     county_idx = inc_emp.get_county_index(work_county)
-    empdata = inc_emp.all_emp[gender][county_idx][3:]
-    incdata = inc_emp.all_inc[gender][county_idx][3:]
+    #A row of 20 industries is faster to weigh as floats than as an array
+    empdata = inc_emp.all_emp[gender, county_idx].tolist()
+    incdata = inc_emp.all_inc[gender, county_idx].tolist()
     _zero_industries(markers, empdata, incdata)
     incdata[:] = [(x - income)**2 for x in incdata]
     try:
@@ -219,6 +167,49 @@ def get_work_industry(work_county, gender, income, inc_emp, markers):
     industry = dist_index_to_naisc_code(idx)
     return industry, idx
 
+def get_work_industries(work_county, genders, incomes, inc_emp, markers):
+    """Returns the industries of work of many workers of a work county.
+
+    Batched version of get_work_industry(): the weights of every worker
+    and industry are computed at once by broadcasting, and industries are
+    drawn with one vectorized inverse CDF, using NumPy's global random
+    state. Incomes equal to a median income are perturbed, for those
+    workers only, as get_work_industry() does, i.e. on the squared
+    differences from the median incomes.
+
+    Raises:
+        ZeroDivisionError: If the weights of a worker sum to zero, as
+            core.cdf() does in get_work_industry().
+
+    Inputs:
+        work_county (str): The FIPS code of an in-country work county.
+        genders (list): 0 for Female, 1 for Male, for every worker.
+        incomes (list): Income of every worker.
+        inc_emp (IncomeEmployment): Income Employment data for a given county.
+        markers (list): Each element describes if an NAISC industry does not have
+            any employers of this type in the county. See dist_index_to_naisc_code
+            for index -> NAISC mapping.
+
+    Returns:
+        idx (ndarray): Index of the NAISC Industry Code of every worker.
+    """
+    county_idx = inc_emp.get_county_index(work_county)
+    no_employers = np.asarray(markers, dtype=bool)
+    genders = np.asarray(genders, dtype=np.intp)
+    empdata = np.where(no_employers, 0.0, inc_emp.all_emp[:, county_idx])[genders]
+    incdata = np.where(no_employers, 200000.0, inc_emp.all_inc[:, county_idx])[genders]
+    incomes = np.asarray(incomes, dtype=np.float64)[:, np.newaxis]
+    incdata = (incdata - incomes)**2
+    perturbed = ~incdata.all(axis=1)
+    incdata[perturbed] = (incdata[perturbed] - (incomes[perturbed] + 0.01))**2
+    weights = np.cumsum(empdata / incdata, axis=1)
+    totals = weights[:, -1:]
+    if not np.all((totals > 0) & np.isfinite(totals)):
+        raise ZeroDivisionError('float division by zero')
+    weights /= totals
+    x = np.random.random_sample(len(weights))
+    return (weights <= x[:, np.newaxis]).sum(axis=1)
+
 def _zero_industries(markers, empdata, incdata):
     """Zeros out industries types that do not have any employers in a county.
     
@@ -16,17 +16,20 @@ and efficiently process large state files (TX, CA).
 '''
 import sys
 import os
+import shutil
+import itertools
+import multiprocessing
 from datetime import datetime
 from . import adjacency, industry, workplace
-from ..utils import reading, writing, paths, core
+from ..utils import (reading, writing, paths, core, intermediate, checkpoint, metrics, memory,
+                     progress, profiling)
 
-#Paths for module 2 input and output
-INPUT_PATH = paths.MODULES[0]
-OUTPUT_PATH = paths.MODULES[1]
 #Global Variables that contain the indices of certain columns
 WORK_COUNTY_FIPS_INDEX = 16
 RESIDENCE_COUNTY_FIPS_INDEX = 15
 RESIDENCE_COUNTY_INDEX = 14
+# Workers of a work county assigned employers at once, at most
+EMPLOYER_BATCH_ROWS = 100000
 
 def write_headers_employers(writer):
     """Writes 'Module2NN_work_county_non_work.csv' file type headers.
@@ -55,56 +58,202 @@ def write_headers_work_counties(writer):
                     + ['Income_Bracket'] + ['Income_Amount'] + ['Residence_County']
                     + ['Work_County_FIPS'])
 
-def assign_to_work_counties(state_name):
+def assign_to_work_counties(state_name, num_processors=1):
     """Assigns all workers to a work county.
 
     Inputs:
         state_name (str): Name of state being processed.
+        num_processors (int): Number of processes to assign work counties
+            with, see assign_work_counties_parallel().
     """
+    # Read up front in parallel too, so a stale J2W cache is compiled
+    # once rather than by every worker
     j2w = adjacency.read_j2w()
+    memory.checkpoint(memory.REFERENCE, 'j2w')
     start_time = datetime.now()
     print(state_name + " started at: " + str(start_time))
-    with open(INPUT_PATH + state_name + 'Module1NN2ndRun.csv') as read, \
-    open(OUTPUT_PATH + state_name + 'Module2NN_work_county.csv', 'w+') as write:
+    input_file = paths.MODULES[0] + state_name + 'Module1NN2ndRun.csv'
+    output_file = paths.MODULES[1] + state_name + 'Module2NN_work_county.csv'
+    if num_processors > 1:
+        assign_work_counties_parallel(state_name, input_file, output_file, num_processors)
+        print(state_name + " took this much time: " + str(datetime.now()-start_time))
+        return
+    with open(input_file) as read, open(output_file, 'w+') as write:
         reader = reading.csv_reader(read)
         writer = writing.csv_writer(write)
         write_headers_work_counties(writer)
-        trailing_fips = ''
         next(reader)
-        for count, row in enumerate(reader):
-            #Get County FIPS Code
-            fips = row[0] + row[1]
-            fips = core.correct_FIPS(fips)
-            if fips != trailing_fips:
-                print('Iterating through county identified by FIPS: ' + fips)
-                trailing_fips = fips
-                #Initialize New County J2W Distribution
-                county_flow_dist = adjacency.J2WDist(j2w, trailing_fips)
-            #If Distribution is Exhausted, Rebuild From Scratch (not ideal, but
-            #assumptions were made to distribution of traveler_type that are not right)
-            #FAIL SAFE: SHOULD NOT HAPPEN
-            if county_flow_dist.total_workers() == 0:
-                county_flow_dist = adjacency.J2WDist(j2w, trailing_fips)
-            household_type = int(row[5])
-            traveler_type = int(row[11])
-            work_county_fips = str(county_flow_dist.get_work_county_fips(fips, household_type, traveler_type))
-            work_county_fips = core.correct_FIPS(work_county_fips, is_work_county_fips=True)
-            writer.writerow(row + [fips] + [work_county_fips])
-            if count % 1000000 == 0:
-                print(str(count) + ' residents done')
-                print('Time Elapsed: ' + str(datetime.now() - start_time))
-        print(str(count) + ' residents done')
+        writer.writerows(assign_work_counties(reader, j2w, reading.count_lines(input_file) - 1))
         print(state_name + " took this much time: " + str(datetime.now()-start_time))
 
+def residence_county_ranges(input_file):
+    """Splits a Module 1 file into runs of rows of the same residence county.
+
+    Runs are split exactly where assign_work_counties() starts a new
+    J2WDist, so each run can be assigned on its own.
+
+    Inputs:
+        input_file (str): Path to the Module 1 output file.
+
+    Returns:
+        ranges (list): [fips, start, end, rows] of every run, in file
+            order, with start and end as byte offsets in the file.
+    """
+    ranges = []
+    with open(input_file, 'rb') as read:
+        position = len(read.readline())
+        trailing_key = None
+        for line in read:
+            key = line.split(b',', 2)[:2]
+            if key != trailing_key:
+                trailing_key = key
+                fips = core.correct_FIPS(b''.join(key).decode())
+                if not ranges or ranges[-1][0] != fips:
+                    ranges.append([fips, position, position, 0])
+            position += len(line)
+            ranges[-1][2] = position
+            ranges[-1][3] += 1
+    return ranges
+
+def assign_work_counties_parallel(state_name, input_file, output_file, num_processors):
+    """Assigns all workers to a work county, a residence county at a time per process.
+
+    Each residence county's J2WDist is independent, so the runs of rows of
+    every residence county, see residence_county_ranges(), are assigned in
+    a pool of processes that each memory map the J2W matrix. Every run is
+    written to a part file, and the parts are appended to the output in
+    file order as soon as all runs before them are done. Largest counties
+    are started first, so they do not hold up the end of the step.
+
+    Inputs:
+        state_name (str): Name of state being processed.
+        input_file (str): Path to the Module 1 output file.
+        output_file (str): Path to the work county file.
+        num_processors (int): Number of processes in the pool.
+    """
+    ranges = residence_county_ranges(input_file)
+    part_files = [paths.MODULES[1] + state_name + 'Module2NN_work_county_part' + str(idx) + '.csv'
+                  for idx in range(len(ranges))]
+    tracker = progress.Progress('assign_work_counties', sum(rows for _, _, _, rows in ranges))
+    work_queue = multiprocessing.Queue()
+    pool = multiprocessing.Pool(num_processors, initializer=progress.init_worker,
+                                initargs=(work_queue,))
+    results = [None] * len(ranges)
+    try:
+        for idx in sorted(range(len(ranges)), key=lambda idx: ranges[idx][3], reverse=True):
+            fips, start, end, _ = ranges[idx]
+            results[idx] = pool.apply_async(profiling.profile_call,
+                                            (fips, assign_work_county_range, input_file,
+                                             part_files[idx], fips, start, end))
+        with open(output_file, 'w+') as write:
+            write_headers_work_counties(writing.csv_writer(write))
+            stitched = 0
+            while stitched < len(results):
+                tracker.drain(work_queue)
+                while stitched < len(results) and results[stitched].ready():
+                    snapshot = results[stitched].get()
+                    metrics.merge(snapshot)
+                    with open(part_files[stitched]) as read:
+                        shutil.copyfileobj(read, write)
+                    os.remove(part_files[stitched])
+                    stitched += 1
+    except BaseException:
+        # A failed run stops the others, and its parts are of no use
+        pool.terminate()
+        pool.join()
+        for part_file in part_files:
+            try:
+                os.remove(part_file)
+            except FileNotFoundError:
+                pass
+        raise
+    pool.close()
+    pool.join()
+    tracker.drain(work_queue, timeout=0)
+    tracker.finish()
+
+def assign_work_county_range(input_file, output_file, fips, start, end):
+    """Assigns a run of residents of one residence county a work county.
+
+    Run in a worker process, see assign_work_counties_parallel().
+
+    Inputs:
+        input_file (str): Path to the Module 1 output file.
+        output_file (str): Path to the part file the rows are written to.
+        fips (str): FIPS code of the residence county.
+        start (int): Byte offset of the first row of the run.
+        end (int): Byte offset just past the last row of the run.
+
+    Returns:
+        snapshot (dict): Metrics of the run, see metrics.collect().
+    """
+    metrics.reset()
+    memory.start()
+    j2w = adjacency.read_j2w()
+    memory.checkpoint(memory.REFERENCE, 'j2w')
+    with open(output_file, 'w+') as write:
+        reader = reading.csv_reader(reading.read_range(input_file, start, end))
+        writer = writing.csv_writer(write)
+        writer.writerows(assign_work_counties(reader, j2w, tracker=progress.TaskProgress()))
+    return metrics.collect()
+
+def assign_work_counties(reader, j2w, total=None, tracker=None):
+    """Assigns every resident a work county.
+
+    Inputs:
+        reader (iterator): Module 1 rows, without header, grouped by
+            residence county.
+        j2w (J2WMatrix): Journey to Work data, see adjacency.read_j2w().
+        total (int): Number of rows, for progress output.
+        tracker (TaskProgress): Gets the rows done, when run in a worker
+            process, instead of a Progress of the step.
+
+    Returns:
+        rows (generator): Every row with the residence county FIPS code
+            and work county FIPS code appended.
+    """
+    trailing_fips = ''
+    rows = metrics.counter('rows', step='assign_work_counties')
+    rebuilt = metrics.counter('fallbacks', kind='j2w_rebuilt')
+    county_timer = metrics.county_timer('assign_work_counties')
+    if tracker is None:
+        tracker = progress.Progress('assign_work_counties', total)
+    for row in reader:
+        #Get County FIPS Code
+        fips = row[0] + row[1]
+        fips = core.correct_FIPS(fips)
+        if fips != trailing_fips:
+            print('Iterating through county identified by FIPS: ' + fips)
+            county_timer.switch(fips)
+            trailing_fips = fips
+            #Initialize New County J2W Distribution
+            county_flow_dist = adjacency.J2WDist(j2w, trailing_fips)
+        #If Distribution is Exhausted, Rebuild From Scratch (not ideal, but
+        #assumptions were made to distribution of traveler_type that are not right)
+        #FAIL SAFE: SHOULD NOT HAPPEN
+        if county_flow_dist.total_workers() == 0:
+            county_flow_dist = adjacency.J2WDist(j2w, trailing_fips)
+            rebuilt.inc()
+        household_type = int(row[5])
+        traveler_type = int(row[11])
+        work_county_fips = str(county_flow_dist.get_work_county_fips(fips, household_type, traveler_type))
+        work_county_fips = core.correct_FIPS(work_county_fips, is_work_county_fips=True)
+        rows.inc()
+        yield row + [fips] + [work_county_fips]
+        tracker.update()
+    county_timer.stop()
+    tracker.finish()
+
 def separate_workers_non_workers(state_name):
     """Separate workers from non workers in order to assign employer.
 
     Inputs:
         state_name (str): Name of state being processed.
     """
-    with open(OUTPUT_PATH + state_name + 'Module2NN_work_county.csv') as read, \
-    open(OUTPUT_PATH + state_name + 'Module2NN_work_county_work.csv', 'w+') as write_work, \
-    open(OUTPUT_PATH + state_name + 'Module2NN_work_county_non_work.csv', 'w+') as write_non_work:
+    input_file = paths.MODULES[1] + state_name + 'Module2NN_work_county.csv'
+    with open(input_file) as read, \
+    open(paths.MODULES[1] + state_name + 'Module2NN_work_county_work.csv', 'w+') as write_work, \
+    open(paths.MODULES[1] + state_name + 'Module2NN_work_county_non_work.csv', 'w+') as write_non_work:
         reader = reading.csv_reader(read)
         writer_work = writing.csv_writer(write_work)
         writer_non_work = writing.csv_writer(write_non_work)
@@ -112,23 +261,39 @@ def separate_workers_non_workers(state_name):
         write_headers_employers(writer_non_work)
         count_work = 0
         count_non_work = 0
+        count = 0
+        tracker = progress.Progress('separate_workers', reading.count_lines(input_file) - 1)
         next(reader)
         for count, row in enumerate(reader):
             if row[15] == '-1':
-                work_industry = '-1'
-                employer = ['Non-Worker'] + ['NA' for i in range(0, 16)]
-                writer_non_work.writerow(row + [work_industry] + employer[:6] 
-                                         + employer[9:14] + employer[15:17])
+                writer_non_work.writerow(non_worker_row(row))
                 count_non_work += 1
             else:
                 writer_work.writerow(row)
                 count_work += 1
-            if count % 1000000 == 0:
-                print('Number of Workers parsed: ' +  str(count))
+            tracker.update()
+        tracker.finish()
 
         print('number of Work: ' + str(count_work))
         print('number of NonWork: ' + str(count_non_work))
         print('Work + NonWork: ' + str(count))
+        metrics.counter('rows', step='separate_workers').inc(count_work + count_non_work)
+        metrics.gauge('workers').set(count_work)
+        metrics.gauge('non_workers').set(count_non_work)
+
+def non_worker_row(row):
+    """Fills in the work industry and employer of a non-worker.
+
+    Inputs:
+        row (list): Row with work county assigned, see assign_work_counties().
+
+    Returns:
+        row (list): Row with the same columns as a worker assigned to
+            an employer.
+    """
+    work_industry = '-1'
+    employer = ['Non-Worker'] + ['NA' for i in range(0, 16)]
+    return row + [work_industry] + employer[:6] + employer[9:14] + employer[15:17]
 
 def assign_workers_to_employers(state_name):
     """Assign work industry and work place to workers sorted by work county.
@@ -137,40 +302,77 @@ def assign_workers_to_employers(state_name):
         state_name (str): Name of state being processed.
     """
     inc_emp = industry.read_employment_income_by_industry()
+    memory.checkpoint(memory.REFERENCE, 'income_employment')
     start_time = datetime.now()
-    with open(OUTPUT_PATH + state_name + 'Module2NN_sorted_work_county.csv') as read, \
-    open(OUTPUT_PATH + state_name + 'Module2NN_assigned_employer.csv', 'w+') as write:
+    input_file = paths.MODULES[1] + state_name + 'Module2NN_sorted_work_county.csv'
+    with open(input_file) as read, \
+    open(paths.MODULES[1] + state_name + 'Module2NN_assigned_employer.csv', 'w+') as write:
         reader = reading.csv_reader(read)
         writer = writing.csv_writer(write)
         write_headers_employers(writer)
-        trailing_county = ''
-        current_county = ''
         next(reader)
-        for count, row in enumerate(reader):
-            work_county_fips = str(row[15])
-            work_county_fips = core.correct_FIPS(work_county_fips, is_work_county_fips=True)
-            if work_county_fips == '-2':
-                work_industry = '-2'
-                employer = ['International Destination for Work'] + ['NA' for i in range(0, 16)]
-            else:
-                gender = int(row[10])
-                income = float(row[13])
-                if trailing_county != work_county_fips:
-                    current_county = workplace.WorkingCounty(work_county_fips)
-                    trailing_county = work_county_fips
-                work_industry, index, employer = current_county.select_industry_and_employer(work_county_fips,
-                                                                                             gender, income, inc_emp)
-            writer.writerow(row + [work_industry] + employer[:6] 
-                            + employer[9:14] + employer[15:17])
-            if count % 10000 == 0:
-                print(str(count) + ' Working residents done')
-                print('Time Elapsed: ' + str(datetime.now() - start_time))
+        writer.writerows(assign_employers(reader, inc_emp, reading.count_lines(input_file) - 1))
         print(state_name + " took this much time: " + str(datetime.now()-start_time))
 
+def assign_employers(reader, inc_emp, total=None):
+    """Assigns every worker a work industry and employer.
+
+    Workers of a work county are assigned in batches of up to
+    EMPLOYER_BATCH_ROWS, see WorkingCounty.select_industries_and_employers().
+
+    Inputs:
+        reader (iterator): Worker rows, without header, grouped by work county.
+        inc_emp (IncomeEmployment): County level income and employment data.
+        total (int): Number of workers, for progress output.
+
+    Returns:
+        rows (generator): Every row with the work industry and employer
+            information appended.
+    """
+    trailing_county = ''
+    current_county = ''
+    rows = metrics.counter('rows', step='assign_employers')
+    international = metrics.counter('international_workers')
+    county_timer = metrics.county_timer('assign_employers')
+    tracker = progress.Progress('assign_employers', total)
+    for work_county_fips, county_rows in itertools.groupby(reader, key=_work_county_fips):
+        if work_county_fips == '-2':
+            work_industry = '-2'
+            employer = ['International Destination for Work'] + ['NA' for i in range(0, 16)]
+            for row in county_rows:
+                international.inc()
+                rows.inc()
+                yield row + [work_industry] + employer[:6] + employer[9:14] + employer[15:17]
+                tracker.update()
+            continue
+        if trailing_county != work_county_fips:
+            county_timer.switch(work_county_fips)
+            current_county = workplace.WorkingCounty(work_county_fips)
+            trailing_county = work_county_fips
+        while True:
+            batch = list(itertools.islice(county_rows, EMPLOYER_BATCH_ROWS))
+            if not batch:
+                break
+            genders = [int(row[10]) for row in batch]
+            incomes = [float(row[13]) for row in batch]
+            selections = current_county.select_industries_and_employers(work_county_fips, genders,
+                                                                        incomes, inc_emp)
+            for row, (work_industry, index, employer) in zip(batch, selections):
+                rows.inc()
+                yield row + [work_industry] + employer[:6] + employer[9:14] + employer[15:17]
+                tracker.update()
+    county_timer.stop()
+    tracker.finish()
+
+def _work_county_fips(row):
+    """Returns the corrected work county FIPS code of a worker row."""
+    return core.correct_FIPS(str(row[15]), is_work_county_fips=True)
+
 def merge_sorted_files(file_name_1, file_name_2, output_file, column_sort):
     """Merge two files by sorted column.
 
-    Used to merge workers and non-workers by residing county.
+    Used to merge workers and non-workers by residing county. The output
+    is handed off to Module 3, so is written in the intermediate format.
 
     Inputs:
         file_name_1 (str): First file to be merged.
@@ -179,10 +381,9 @@ def merge_sorted_files(file_name_1, file_name_2, output_file, column_sort):
         column_sort (int): Column to sort files by.
     """
     with open(file_name_1) as read_1, open(file_name_2) as read_2, \
-    open(output_file, 'w+') as write:
+    intermediate.open_writer(output_file) as writer:
         reader_file_1 = reading.csv_reader(read_1)
         reader_file_2 = reading.csv_reader(read_2)
-        writer = writing.csv_writer(write)
         write_headers_employers(writer)
         next(reader_file_1)
         next(reader_file_2)
@@ -215,36 +416,52 @@ def _get_fips_code(curr_person, fips_index):
     else:
         return int(float(curr_person[fips_index]))
 
-def main(state_name):
+def main(state_name, num_processors=1, *, resume=False):
     """Process a state in Module 2.
 
     Inputs:
         state_name (str): Name of state being processed.
+        num_processors (int): Number of processes to assign work counties
+            with.
+        resume (bool): Whether to skip steps completed by a previous run,
+            see checkpoint.RunManifest.
     """
     start_time = datetime.now()
+    metrics.reset()
+    manifest = checkpoint.RunManifest(state_name, 'module2', resume)
+    output_path = paths.MODULES[1]
+    work_county_file = output_path + state_name + 'Module2NN_work_county.csv'
+    work_file = output_path + state_name + 'Module2NN_work_county_work.csv'
+    non_work_file = output_path + state_name + 'Module2NN_work_county_non_work.csv'
+    sorted_work_file = output_path + state_name + 'Module2NN_sorted_work_county.csv'
+    assigned_file = output_path + state_name + 'Module2NN_assigned_employer.csv'
+    sorted_assigned_file = output_path + state_name + 'Module2NN_assigned_employer_sorted_residence_county.csv'
+    output_file = output_path + state_name + 'Module2NN_AllWorkersEmployed_SortedResidenceCounty.csv'
     print('Assigning workers in input file to work counties')
-    assign_to_work_counties(state_name)
+    manifest.run('assign_work_counties', lambda: assign_to_work_counties(state_name, num_processors),
+                 outputs=[work_county_file])
     print('Separating workers from non-workers for this input file')
-    separate_workers_non_workers(state_name)
-    os.remove(OUTPUT_PATH + state_name + 'Module2NN_work_county.csv')
+    manifest.run('separate_workers', lambda: separate_workers_non_workers(state_name),
+                 outputs=[work_file, non_work_file], consumed=[work_county_file])
     print('Sorting the workers who work in one input file by working county')
-    input_file = state_name + 'Module2NN_work_county_work.csv'
-    output_file = state_name + 'Module2NN_sorted_work_county.csv'
-    core.sort_by_input_column(OUTPUT_PATH, input_file, str(WORK_COUNTY_FIPS_INDEX), OUTPUT_PATH, output_file)
+    manifest.run('sort_work_county',
+                 lambda: core.sort_by_input_column(output_path, os.path.basename(work_file),
+                                                   str(WORK_COUNTY_FIPS_INDEX), output_path,
+                                                   os.path.basename(sorted_work_file)),
+                 outputs=[sorted_work_file])
     print('Assigning workers in one input file to employers')
-    assign_workers_to_employers(state_name)
-    os.remove(OUTPUT_PATH + input_file)
-    os.remove(OUTPUT_PATH + output_file)
+    manifest.run('assign_employers', lambda: assign_workers_to_employers(state_name),
+                 outputs=[assigned_file], consumed=[work_file, sorted_work_file])
     print('Sorting workers assigned to employers in one input file by residence county')
-    input_file = state_name + 'Module2NN_assigned_employer.csv'
-    output_file = state_name + 'Module2NN_assigned_employer_sorted_residence_county.csv'
-    core.sort_by_input_column(OUTPUT_PATH, input_file, str(RESIDENCE_COUNTY_FIPS_INDEX), OUTPUT_PATH, output_file)
+    manifest.run('sort_residence_county',
+                 lambda: core.sort_by_input_column(output_path, os.path.basename(assigned_file),
+                                                   str(RESIDENCE_COUNTY_FIPS_INDEX), output_path,
+                                                   os.path.basename(sorted_assigned_file)),
+                 outputs=[sorted_assigned_file], consumed=[assigned_file])
     print('Merging the two files sorted by residence county into one file that is also sorted by residence county')
-    os.remove(OUTPUT_PATH + input_file)
-    state_name_1 = OUTPUT_PATH + state_name + 'Module2NN_work_county_non_work.csv'
-    state_name_2 = OUTPUT_PATH + state_name + 'Module2NN_assigned_employer_sorted_residence_county.csv'
-    output_file = OUTPUT_PATH + state_name + 'Module2NN_AllWorkersEmployed_SortedResidenceCounty.csv'
-    merge_sorted_files(state_name_1, state_name_2, output_file, RESIDENCE_COUNTY_INDEX)
+    manifest.run('merge', lambda: merge_sorted_files(non_work_file, sorted_assigned_file,
+                                                     output_file, RESIDENCE_COUNTY_INDEX),
+                 outputs=[intermediate.file_path(output_file)],
+                 consumed=[non_work_file, sorted_assigned_file])
     print('Total time to process the input file: ' + str(datetime.now() - start_time))
-    os.remove(state_name_1)
-    os.remove(state_name_2)
+    metrics.write_report('module2', state_name)
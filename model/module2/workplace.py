@@ -19,11 +19,10 @@ NOTE: This is all original work, none of these methods are taken from
 Mufti's Module 2, as they are performed entirely in a new fashion.
 """
 
-import random
-import bisect
 import collections
+import numpy as np
 from . import industry, adjacency
-from ..utils import core
+from ..utils import sampler
 
 class WorkingCounty:
     """Employment and Patronage data encapsulation for a given county.  
@@ -37,8 +36,8 @@ class WorkingCounty:
             about the employer.
         patrons (list): Each element is a list detailing the number of employees/patrons
             employed by an employer within each NAISC industry code.
-        patrons_cdf (list): Each element is a list detailing the CDF of employees/patrons
-            employed by an employer within each NAISC industry code.
+        patron_samplers (list): Each element is an AliasSampler drawing an employer
+            within each NAISC industry code, weighted by employees/patrons.
         
     """    
 
@@ -47,7 +46,7 @@ class WorkingCounty:
         self.data = industry.read_county_employment(fips)
         self.county = adjacency.read_data(fips)
         self.industries = self.create_industry_lists()
-        self.patrons, self.patrons_cdf = self.create_industry_distributions()
+        self.patrons, self.patron_samplers = self.create_industry_distributions()
 
     def print_county(self):
         """Print County object."""
@@ -90,49 +89,39 @@ class WorkingCounty:
             patrons (list): Each element is a list detailing the number of 
                 employees/patrons employed by an employer within each 
                 NAISC industry code.
-            patrons_cdf (list): Each element is a list detailing the CDF of 
-                employees/patrons employed by an employer within each
-                NAISC industry code.
+            patron_samplers (list): Each element is an AliasSampler drawing
+                an employer within each NAISC industry code, weighted by
+                employees/patrons.
         """
         all_patrons = []
-        all_patrons_cdf = []
+        all_patron_samplers = []
         for naisc_division in self.industries:
             patrons = []
-            patrons_percentage = []
-            patrons_cdf = []
             for employer in naisc_division:
                 tot_employees = int(employer[13][0:].strip("'"))
                 if tot_employees > 0:
                     patrons.append(tot_employees)
-            total_spots = sum(patrons)
-            if total_spots > 0:
-                patrons_percentage = [float(s)/(total_spots) for s in patrons]
-            else:
-                patrons_percentage = []
-            patrons_cdf = core.cdf(patrons_percentage)
             all_patrons.append(patrons)
-            all_patrons_cdf.append(patrons_cdf)
-        return all_patrons, all_patrons_cdf
+            all_patron_samplers.append(sampler.AliasSampler(patrons))
+        return all_patrons, all_patron_samplers
 
-    def draw_from_industry_distribution(self, index):
+    def draw_from_industry_distribution(self, index, n=None):
         """Select an Employer from a given industry in this workingCounty
         
         Inputs: 
             index (int): Index corresponding to NAISC industry category.
+            n (int): Number of employers to draw, or None for one.
         
         Returns: 
-            idx (int): Index corresponding to employer within NAISC industry category.
+            idx (int or ndarray): Index corresponding to employer within NAISC
+                industry category, or an array of n such indices.
         """
-        draw_cdf = self.patrons_cdf[index]
-        if len(draw_cdf) == 0:
-            print(self.spots_cdf)
-            print(self.spots)
+        patron_sampler = self.patron_samplers[index]
+        if len(patron_sampler) == 0:
+            print(self.patrons)
             print(index)
-            print(self.spots[index])
-            print(self.spots_cdf[index])
             raise ValueError('CDF has no elements')
-        idx = bisect.bisect(draw_cdf, random.random())
-        return idx
+        return patron_sampler.draw(n)
 
     'Selection of Industry and Employer for a Particular Resident, Given Work County and Demographic Data'
     def select_industry_and_employer(self, work_county, gender, income, inc_emp):
@@ -160,6 +149,35 @@ class WorkingCounty:
         employer_index = self.draw_from_industry_distribution(indust_index)
         return indust, indust_index, self.industries[indust_index][employer_index]
 
+    def select_industries_and_employers(self, work_county, genders, incomes, inc_emp):
+        """Select an Employer for many workers of this WorkingCounty at once.
+
+        Industries are drawn with industry.get_work_industries(), and the
+        employers of all workers of an industry with one vectorized draw.
+
+        Inputs: 
+            work_county (str): FIPS code for a county.
+            genders (list): 0 for Female, 1 for Male, for every worker.
+            incomes (list): Income of every worker.
+            inc_emp (IncomeEmployment): County level income and employment data.
+
+        Returns: 
+            selections (list): (indust, indust_idx, employer) of every worker,
+                see select_industry_and_employer().
+        """
+        no_employers_present = [len(naisc_industry) == 0 for naisc_industry in self.patrons]
+        indust_indexes = industry.get_work_industries(work_county, genders, incomes, inc_emp,
+                                                      no_employers_present)
+        employer_indexes = np.empty(len(indust_indexes), dtype=np.int64)
+        for indust_index in np.unique(indust_indexes).tolist():
+            workers = indust_indexes == indust_index
+            employer_indexes[workers] = self.draw_from_industry_distribution(
+                indust_index, int(workers.sum()))
+        return [(industry.dist_index_to_naisc_code(indust_index), indust_index,
+                 self.industries[indust_index][employer_index])
+                for indust_index, employer_index in zip(indust_indexes.tolist(),
+                                                        employer_indexes.tolist())]
+
 def _convert_code_to_indust(code):
     """Convert NAISC code to industry abbrevation.
     
@@ -16,7 +16,7 @@ import random
 import bisect
 from datetime import datetime
 from ..module2 import adjacency
-from ..utils import reading, writing, paths, core, distance
+from ..utils import writing, paths, core, distance, sampler, refdata, intermediate, metrics, progress
 
 # Constants for National Enrollment in Private and Public Schools
 PUBLIC_SCHOOL_ENROLLMENT_ELEM_MID = 34637.0
@@ -42,8 +42,8 @@ class AssignCounty:
             elements containing information about a school of that
             type associated with the FIPS code. List contains every known
             school that we have data for with that county. The index of
-            the school in each list maps to the corresponding CDF in county_cdfs,
-            and vice versa.
+            the school in each list maps to the corresponding index drawn
+            from county_samplers, and vice versa.
         seats (dict): Dictionary with keys for each private school type
             (elementary, middle, high), where each key maps to an integer 
             detailing the number of enrolled students of that school type
@@ -53,13 +53,12 @@ class AssignCounty:
             to a list with elements as AssignCounties. Each AssignCounty
             is guaranteed to have at least one seat in a private school 
             of the key type it is associated with.
-        county_cdfs (dict): Dictionary with keys for each public school type
-            (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type. The
-            CDF is generated based on the number of seats of that school type
-            and different measures of the distance. The index of each CDF 
-            element in each list maps to a school in schools (for 
-            identification) of that school type and vice versa.
+        county_samplers (dict): Dictionary with keys for each private school type
+            (elementary, middle, high), where each key maps to an AliasSampler
+            over the assignable counties of that type. The weights are based
+            on the number of seats of that school type and different measures
+            of the distance. Each index drawn maps to a county in
+            assignable_counties of that school type and vice versa.
     """
     
     def __init__(self, fips):
@@ -79,7 +78,7 @@ class AssignCounty:
         self.schools = read_private_schools(self.fips)
         self.seats = self.get_total_seats()
         self.assignable_counties = {'elem': [], 'mid': [], 'high': []}
-        self.county_cdfs = {'elem': [], 'mid': [], 'high': []}
+        self.county_samplers = {'elem': None, 'mid': None, 'high': None}
 
     def assemble_neighborly_dist(self):
         """Reads in seat data for neighboring counties and generates CDFs."""
@@ -89,19 +88,20 @@ class AssignCounty:
         private_school_counties.append(self)
         # Create the distributions from the neighbors for the different age demographics
         self.get_valid_private_counties(private_school_counties)
-        self.generate_county_cdfs(private_school_counties)
+        self.generate_county_samplers(private_school_counties)
 
     @property
     def coords(self):
         return self.county.coords
 
-    def generate_county_cdfs(self, private_school_counties):
-        """Generates county CDFs for all private school types.
+    def generate_county_samplers(self, private_school_counties):
+        """Generates county samplers for all private school types.
         
         Inputs:
             private_school_counties (list): Each element is a neighboring
                 AssignCounty to the current county.
         """
+        weights = {'elem': [], 'mid': [], 'high': []}
         homelat, homelon = self.coords
         min_distance = sys.maxsize
         for assign_county in private_school_counties:
@@ -113,14 +113,14 @@ class AssignCounty:
                 raise ValueError('Counties have zero distance, yet are different counties')
             for school_type in assign_county.seats:
                 if assign_county.seats[school_type] > 0:
-                    self.county_cdfs[school_type].append(assign_county.seats[school_type] / county_distance**2)
+                    weights[school_type].append(assign_county.seats[school_type] / county_distance**2)
             if county_distance < min_distance:
                 min_distance = county_distance
         for school_type in self.seats:
             if self.seats[school_type] > 0:
-                self.county_cdfs[school_type].append(self.seats[school_type] / (min_distance * 0.75)**2)
-        for school_type in self.county_cdfs:
-            self.county_cdfs[school_type] = core.cdf(self.county_cdfs[school_type])
+                weights[school_type].append(self.seats[school_type] / (min_distance * 0.75)**2)
+        for school_type in weights:
+            self.county_samplers[school_type] = sampler.AliasSampler(weights[school_type])
 
     def get_valid_private_counties(self, private_school_counties):
         """Determines all assignable counties from neighboring counties.
@@ -171,14 +171,13 @@ class AssignCounty:
         elif type2 == 'public':
             school_county = self.fips
         elif type2 == 'private':
-            split = random.random()
             if type1 not in ('elem', 'mid', 'high'):
                 raise ValueError('Invalid Type1 Value for Private School Student')
             else:
-                if not self.county_cdfs[type1]:
+                if not self.county_samplers[type1]:
                     return self.fips
                 else:
-                    idx = bisect.bisect(self.county_cdfs[type1], split)
+                    idx = self.county_samplers[type1].draw()
                     school_county = self.assignable_counties[type1][idx].fips
             school_county = core.correct_FIPS(school_county)
         else:
@@ -201,8 +200,7 @@ def read_private_schools(fips):
     schools = {'elem': [], 'mid': [], 'high': []}
     path = paths.SCHOOL_DBASE + 'CountyPrivateSchools/'
     try:
-        elem = open(path + fips + 'Private.csv')
-        reader = reading.csv_reader(elem)
+        reader = refdata.read_rows(path + fips + 'Private.csv')
     except IOError:
         # Data does not exist, we can't do anything about this
         pass
@@ -249,13 +247,11 @@ class AssignType:
             state (str): State name, without spaces.
         """
         input_file = paths.SCHOOL_DBASE + 'stateenrollmentindegrees.csv'
-        with open(input_file) as read:
-            post_sec_enrollment = reading.csv_reader(read)
-            for row in post_sec_enrollment:
-                if row[0] == state:
-                    self.school_pop['postsec']['non_degree'] = float(row[2])
-                    self.school_pop['postsec']['bach_or_grad'] = float(row[4]) + float(row[5])
-                    self.school_pop['postsec']['associates'] = float(row[6])
+        for row in refdata.read_rows(input_file):
+            if row[0] == state:
+                self.school_pop['postsec']['non_degree'] = float(row[2])
+                self.school_pop['postsec']['bach_or_grad'] = float(row[4]) + float(row[5])
+                self.school_pop['postsec']['associates'] = float(row[6])
 
     def primary_sec_enrollment(self, state):
         """Generates estimates of primary and secondary enrollment.
@@ -274,23 +270,21 @@ class AssignType:
         # TODO - Might want to update data - we shouldn't need to estimate
         # this as it probably exists somewhere in census by now...
         input_file = paths.SCHOOL_DBASE + 'statehighelemmidenrollment.csv'
-        with open(input_file) as read:
-            primary_sec_enrollment = reading.csv_reader(read)
-            for row in primary_sec_enrollment:
-                if row[0].strip('.').strip(' ') == state:
-                    statetotalenrollment2009 = float(row[8])
-                    statetotalenrollment2006 = float(row[1])
-                    statetotalenrollment2007 = float(row[4])
-                    statehighenrollment2006 = float(row[3])
-                    stateelemmidenrollment2006 = float(row[2])
-                    statehighenrollment2007 = float(row[6])
-                    stateelemmidenrollment2007 = float(row[5])
-                    prop1 = statehighenrollment2006 / statetotalenrollment2006
-                    prop2 = statehighenrollment2007 / statetotalenrollment2007
-                    high_prop = ((prop1+prop2)/2) * statetotalenrollment2009
-                    prop1 = stateelemmidenrollment2006 / statetotalenrollment2006
-                    prop2 = stateelemmidenrollment2007 / statetotalenrollment2007
-                    ele_mid_prop = ((prop1+prop2)/2) * statetotalenrollment2009
+        for row in refdata.read_rows(input_file):
+            if row[0].strip('.').strip(' ') == state:
+                statetotalenrollment2009 = float(row[8])
+                statetotalenrollment2006 = float(row[1])
+                statetotalenrollment2007 = float(row[4])
+                statehighenrollment2006 = float(row[3])
+                stateelemmidenrollment2006 = float(row[2])
+                statehighenrollment2007 = float(row[6])
+                stateelemmidenrollment2007 = float(row[5])
+                prop1 = statehighenrollment2006 / statetotalenrollment2006
+                prop2 = statehighenrollment2007 / statetotalenrollment2007
+                high_prop = ((prop1+prop2)/2) * statetotalenrollment2009
+                prop1 = stateelemmidenrollment2006 / statetotalenrollment2006
+                prop2 = stateelemmidenrollment2007 / statetotalenrollment2007
+                ele_mid_prop = ((prop1+prop2)/2) * statetotalenrollment2009
         return ele_mid_prop, high_prop
         
     def scale_public_and_private(self, ele_mid_prop, high_prop):
@@ -436,6 +430,59 @@ def writer_headers(writer):
                     + ['Type1'] + ['Type2'])
 
 
+def school_county_draws(persons, type_assigner, num_columns=None, total=None):
+    """Draws a school type and school county for every person.
+
+    Only the residence county (column 14), age and household type of a
+    person are used, so persons can be drawn for before being assigned
+    to an employer.
+
+    Inputs:
+        persons (iterator): Rows, without header, grouped by residence county.
+        type_assigner (AssignType): Assigns school types for the state.
+        num_columns (int): Number of columns every row must have, if given.
+        total (int): Number of persons, for progress output.
+
+    Returns:
+        draws (generator): Pairs of each person's row and a list of their
+            school county, type1 and type2.
+    """
+    non_student_count = 0
+    student_count = 0
+    pop_count = 0
+    trailing_fips = ''
+    rows = metrics.counter('rows', step='assign_school_county')
+    county_timer = metrics.county_timer('assign_school_county')
+    tracker = progress.Progress('assign_school_county', total)
+    for person in persons:
+        if num_columns is not None and len(person) != num_columns:
+            print(person)
+            raise ValueError('Possible missing data for person')
+        curr_county = core.correct_FIPS(person[14])
+        age = int(person[9])
+        household_type = int(person[5])
+        if curr_county != trailing_fips:
+            county_timer.switch(curr_county)
+            trailing_fips = curr_county
+            print('Assigning people who live in county "' + curr_county + '" to school counties')
+            assign_county = AssignCounty(curr_county)
+            assign_county.assemble_neighborly_dist()
+        type1, type2 = type_assigner.get_school_type(age, household_type)
+        if type1 == 'non student':
+            school_county = 'NA'
+            non_student_count += 1
+        else:
+            school_county = assign_county.choose_school_county(type1, type2)
+            student_count += 1
+        rows.inc()
+        yield person, [school_county] + [type1] + [type2]
+        pop_count += 1
+        tracker.update()
+    county_timer.stop()
+    tracker.finish()
+    metrics.gauge('students').set(student_count)
+    metrics.gauge('non_students').set(non_student_count)
+
 def main(state):
     """Assigns all eligible students to specific counties for school.
 
@@ -447,42 +494,19 @@ def main(state):
     type_assigner = AssignType(state)
     input_file = paths.MODULES[1] + state + 'Module2NN_AllWorkersEmployed_SortedResidenceCounty.csv'
     output_file = paths.MODULES[2] + state + 'Module3NN_AssignedSchoolCounty.csv'
-    with open(input_file) as read, open(output_file, 'w+') as write:
-        reader = reading.csv_reader(read)
+    with intermediate.open_reader(input_file) as reader, open(output_file, 'w+') as write:
         writer = writing.csv_writer(write)
         writer_headers(writer)
         next(reader)
-        non_student_count = 0
-        student_count = 0
-        pop_count = 0
-        trailing_fips = ''
-        for person in reader:
-            if len(person) != 30:
-                print(person)
-                raise ValueError('Possible missing data for person')
-            curr_county = core.correct_FIPS(person[14])
-            age = int(person[9])
-            household_type = int(person[5])
-            if curr_county != trailing_fips:
-                trailing_fips = curr_county
-                print('Assigning people who live in county "' + curr_county + '" to school counties')
-                assign_county = AssignCounty(curr_county)
-                assign_county.assemble_neighborly_dist()
-            type1, type2 = type_assigner.get_school_type(age, household_type)
-            if type1 == 'non student':
-                school_county = 'NA'
-                non_student_count += 1
-            else:
-                school_county = assign_county.choose_school_county(type1, type2)
-                student_count += 1
-            writer.writerow(person + [school_county] + [type1] + [type2])
-            pop_count += 1
-            if pop_count % 1000000 == 0:
-                print('Have printed out a total of ' + str(pop_count) + ' people')
+        for person, school_fields in school_county_draws(reader, type_assigner, num_columns=30,
+                                                         total=intermediate.count_rows(input_file)):
+            writer.writerow(person + school_fields)
 
+    student_count = metrics.gauge('students').value
+    non_student_count = metrics.gauge('non_students').value
     print('student_count: ' + str(student_count))
     print('non_student_count: ' + str(non_student_count))
-    print('pop: ' + str(pop_count))
+    print('pop: ' + str(student_count + non_student_count))
 
 
 
@@ -16,33 +16,39 @@ were originally written by Hill Wyrough, and were debugged in order to correctly
 and efficiently process large state files (TX, CA).
 '''
 
-import os
 from datetime import datetime
-from ..utils import core
+from ..utils import core, paths, intermediate, checkpoint, metrics
 from . import assign_county, school_assigner
 
 # Index for selecting school counties - used for sorting files
 SCHOOL_COUNTY_INDEX = 31
 
-def main(state):
+def main(state, *, resume=False):
     """Assigns all eligible students to a county and school.
     
     Inputs:
         state (str): Alphabetical state name with no spaces.
+        resume (bool): Whether to skip steps completed by a previous run,
+            see checkpoint.RunManifest.
     """
     start_time = datetime.now()
-    print('assign all individuals in a state to a school county')
-    assign_county.main(state)
-    print('sort the individuals by school county')
-    input_path = 'D:/Data/Output/Module3/'
-    output_path = 'D:/Data/Output/Module3/'
+    metrics.reset()
+    manifest = checkpoint.RunManifest(state, 'module3', resume)
+    path = paths.MODULES[2]
     input_file = state + 'Module3NN_AssignedSchoolCounty.csv'
     output_file = state + 'Module3NN_AssignedSchoolCounty_SortedSchoolCounty.csv'
-    core.sort_by_input_column(input_path, input_file, str(SCHOOL_COUNTY_INDEX),
-                              output_path, output_file)
-    os.remove(input_path + input_file)
+    print('assign all individuals in a state to a school county')
+    manifest.run('assign_school_county', lambda: assign_county.main(state),
+                 outputs=[path + input_file])
+    print('sort the individuals by school county')
+    manifest.run('sort_school_county',
+                 lambda: core.sort_by_input_column(path, input_file, str(SCHOOL_COUNTY_INDEX),
+                                                   path, output_file),
+                 outputs=[path + output_file], consumed=[path + input_file])
     print('assign all indivduals to a school')
-    school_assigner.main(state)
+    manifest.run('assign_school', lambda: school_assigner.main(state),
+                 outputs=[intermediate.file_path(path + state + 'Module3NN_AssignedSchool.csv')],
+                 consumed=[path + output_file])
     print('School Assignments for the state of ' + str(state) + ' took this long: '
           + str(datetime.now() - start_time))
-    os.remove(output_path + output_file)
\ No newline at end of file
+    metrics.write_report('module3', state)
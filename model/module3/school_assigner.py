@@ -13,16 +13,10 @@ and then a particular school given that county and type of school.
 Notes:
 '''
 
-import os
-import random
-import bisect
-import os.path as path
+import numpy as np
 from scipy import spatial
 from ..module2 import adjacency
-from ..utils import core, distance, paths, reading, writing
-
-global neighboringCount
-neighboringCount = 0
+from ..utils import core, distance, paths, reading, writing, sampler, refdata, intermediate, metrics, progress
 
 class SchoolAssigner:
     """Holds all school data for a county and points to its neighbors.
@@ -36,8 +30,8 @@ class SchoolAssigner:
             elements containing information about a school of that
             type associated with the FIPS code. List contains every known
             school that we have data for with that county. The index of
-            the school in each list maps to the corresponding CDF in public_cdfs,
-            and vice versa.
+            the school in each list maps to the corresponding tree entry in
+            public_dists, and vice versa.
         public_dists (dict): Dictionary with keys for each public school type
             (elementary, middle, high), where each key maps to a dictionary
             with two keys. The first key, 'tree', maps to a KDTree that
@@ -45,27 +39,25 @@ class SchoolAssigner:
             in public_schools. The second key, 'cart_to_idx', maps to a 
             dictionary that maps the Cartesian transformed coordinates
             of every school to the school's index in public_schools.
-        private_schools (dict): Dictionary with keys for each public school type
-            (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type
-            with respect to the number of students enrolled in the school.
-            The index of each CDF element in each list maps to a school in
-            public_schools (for identification) and vice versa.
-        private_cdfs (dict): Same style as public_schools, but with
+        private_schools (dict): Same style as public_schools, but with
             private school types instead.
+        private_samplers (dict): Dictionary with keys for each private school
+            type (elementary, middle, high), where each key maps to an
+            AliasSampler over all of the schools of that type weighted by
+            the number of students enrolled in the school. Each index drawn
+            maps to a school in private_schools and vice versa.
         post_sec_schools (dict): Dictionary with keys for each post-secondary
             school type (bachelor/grad, associates, non-degree), where
             each key maps to a list with elements containing information
             about a school of that type associated with the state code.
             List contains every known school that we have data for.
             The index of the school in each list maps to the corresponding
-            CDF in post_sec_cdfs, and vice versa.
-        post_sec_cdfs (dict): Dictionary with keys for each public school type
-            (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type
-            with respect to the number of students enrolled in the school.
-            The index of each CDF element in each list maps to a school in
-            public_schools (for identification) and vice versa.
+            index drawn from post_sec_samplers, and vice versa.
+        post_sec_samplers (dict): Dictionary with keys for each post-secondary
+            school type, where each key maps to an AliasSampler over all of
+            the schools of that type weighted by enrollment and distance.
+            Each index drawn maps to a school in post_sec_schools and
+            vice versa.
     """
 
     # TODO - Fix confusion with State School and complete args
@@ -81,9 +73,9 @@ class SchoolAssigner:
         self.public_schools = read_public_schools(fips)
         self.public_dists = assemble_public_dist(self.public_schools)
         self.private_schools = read_private_schools(fips)
-        self.private_cdfs = assemble_private_dist(self.private_schools)
+        self.private_samplers = assemble_private_dist(self.private_schools)
         self.post_sec_schools = read_post_sec_schools(self.county.neighbors, state_abbrev)
-        self.post_sec_cdfs = assemble_post_sec_dist(self.post_sec_schools, *self.county.coords)
+        self.post_sec_samplers = assemble_post_sec_dist(self.post_sec_schools, *self.county.coords)
 
     def select_school_by_type(self, type1, type2, home_lat, home_lon):
         """Selects school for a student based on demographic attributes.
@@ -129,7 +121,6 @@ class SchoolAssigner:
         Returns:
             school (list): Student's school of assignment.
         """
-        global neighboringCount
         if type1 not in ('elem', 'mid', 'high'):
             raise ValueError('Invalid Type1 for Current Student')
         else:
@@ -141,7 +132,7 @@ class SchoolAssigner:
                 school = self.public_schools[type1][school_idx]
             else:
                 school = select_neighboring_public_school(self.county.neighbors, type1, home_lat, home_lon)
-                neighboringCount += 1
+                metrics.counter('fallbacks', kind='neighboring_public_school').inc()
         return school
 
     def select_private_schools(self, type1, type2, home_lat, home_lon):
@@ -165,15 +156,15 @@ class SchoolAssigner:
             school (list): Student's school of assignment.
             type2 (str): Student's type2 assignment.
         """
-        rand_split = random.random()
         if type1 not in ('elem', 'mid', 'high'):
             raise ValueError('Invalid Type1 for Current Student')
         else:
             if not self.private_schools[type1]:
+                metrics.counter('fallbacks', kind='private_to_public_school').inc()
                 type2 = 'public'
                 return self.select_public_schools(type1, home_lat, home_lon), type2
             else:
-                idx = bisect.bisect(self.private_cdfs[type1], rand_split)
+                idx = self.private_samplers[type1].draw()
                 school = self.private_schools[type1][idx]
         return school, type2
 
@@ -190,21 +181,15 @@ class SchoolAssigner:
         Returns:
             school (list): Student's school of assignment.
         """
-        rand_split = random.random()
         if type2 not in ('bach_or_grad', 'associates', 'non_degree'):
             raise ValueError('Invalid Type2 for Current Student')
         else:
-            if self.post_sec_cdfs[type2]:
-                idx = bisect.bisect(self.post_sec_cdfs[type2], rand_split)
-                try:
-                    school = self.post_sec_schools[type2][idx]
-                except IndexError:
-                    print(type2)
-                    print(self.post_sec_schools[type2])
-                    print(idx)
-                    raise ValueError('hey')
+            if self.post_sec_samplers[type2]:
+                idx = self.post_sec_samplers[type2].draw()
+                school = self.post_sec_schools[type2][idx]
             else:
                 # Send to public high school if no post-secondary school
+                metrics.counter('fallbacks', kind='post_sec_to_public_school').inc()
                 type2 = 'public'
                 school = self.select_public_schools('high', home_lat, home_lon)
         return school, type2
@@ -230,17 +215,15 @@ def read_private_schools(fips):
     input_path = paths.SCHOOL_DBASE + 'CountyPrivateSchools/'
     schools = {'elem': [], 'mid': [], 'high': []}
     try:
-        with open(input_path + fips + 'Private.csv') as read:
-            reader = reading.csv_reader(read)
-            for row in reader:
-                row[7] = int(row[7])
-                if row[6] == '1':
-                    schools['elem'].append(row)
-                elif row[6] == '2' or row[6] == '3':
-                    schools['mid'].append(row)
-                    schools['high'].append(row)
-                else:
-                    raise ValueError('School does not have a code in (1, 2, 3)')
+        for row in refdata.read_rows(input_path + fips + 'Private.csv'):
+            row[7] = int(row[7])
+            if row[6] == '1':
+                schools['elem'].append(row)
+            elif row[6] == '2' or row[6] == '3':
+                schools['mid'].append(row)
+                schools['high'].append(row)
+            else:
+                raise ValueError('School does not have a code in (1, 2, 3)')
     except IOError:
         # File not found, no data available
         pass
@@ -274,11 +257,9 @@ def read_public_schools(fips, school_types=None):
     base_file = paths.SCHOOL_DBASE + 'CountyPublicSchools/'
     for school_type in school_types:
         try:
-            with open(base_file + school_type + '/' + fips + school_type + '.csv') as read:
-                reader = reading.csv_reader(read)
-                for row in reader:
-                    row[5] = int(row[5])
-                    schools[school_type.lower()].append(row)
+            for row in refdata.read_rows(base_file + school_type + '/' + fips + school_type + '.csv'):
+                row[5] = int(row[5])
+                schools[school_type.lower()].append(row)
         except IOError:
             # File not found, no data available
             pass
@@ -302,13 +283,12 @@ def read_post_sec_schools(fips, state_abbrev):
             about a school of that type associated with the state code.
             List contains every known school that we have data for.
             The index of the school in each list maps to the corresponding
-            CDF in post_sec_cdfs, and vice versa.
+            index drawn from post_sec_samplers, and vice versa.
     """
     school_path = paths.SCHOOL_DBASE + 'PostSecSchoolsByCounty/' + state_abbrev + '/'
     post_sec_schools = {'bach_or_grad': [], 'associates': [], 'non_degree': []}
     for fips_code in fips:
-        county_files = [f for f in os.listdir(school_path) if path.isfile(path.join(school_path, f))
-                        and fips_code in f]
+        county_files = [f for f in refdata.listdir(school_path) if fips_code in f]
         for file in county_files:
             if file.endswith('CommunityCollege.csv'):
                 _read_school_file(school_path + file, 'associates', post_sec_schools)
@@ -342,12 +322,11 @@ def assemble_public_dist(public_schools):
                    'mid':  {'tree': None, 'cart_to_idx': None},
                    'high': {'tree': None, 'cart_to_idx': None}}
     for school_type in public_dist:
-        cart_to_idx = dict()
-        data = []
-        for idx, school in enumerate(public_schools[school_type]):
-            x, y, z = distance.to_cart(float(school[6]), float(school[7]))
-            cart_to_idx[(x, y, z)] = idx
-            data.append([x, y, z])
+        schools = public_schools[school_type]
+        x, y, z = distance.to_cart_batch([school[6] for school in schools],
+                                         [school[7] for school in schools])
+        data = list(zip(x.tolist(), y.tolist(), z.tolist()))
+        cart_to_idx = {cart: idx for idx, cart in enumerate(data)}
         if data:
             tree = spatial.KDTree(data)
             public_dist[school_type]['tree'] = tree
@@ -355,31 +334,27 @@ def assemble_public_dist(public_schools):
     return public_dist
 
 def assemble_private_dist(private_schools):
-    """Generates CDFs for all private schools in a county.
+    """Generates samplers for all private schools in a county.
     
     Inputs:
-        private_schools (dict): Dictionary with keys for each public school type
+        private_schools (dict): Dictionary with keys for each private school type
             (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type
-            with respect to the number of students enrolled in the school.
-            The index of each CDF element in each list maps to a school in
-            public_schools (for identification) and vice versa.
+            elements containing information about a school of that type.
     Returns:
-        private_cdfs (dict): Dictionary with keys for each private school type
-            (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type
-            with respect to the number of students enrolled in the school.
-            The index of each CDF element in each list maps to a school in
-            private_schools (for identification) and vice versa.                
+        private_samplers (dict): Dictionary with keys for each private school type
+            (elementary, middle, high), where each key maps to an AliasSampler
+            over all of the schools of that type weighted by the number of
+            students enrolled in the school. Each index drawn maps to a
+            school in private_schools and vice versa.
     """
-    private_cdfs = {'elem': [], 'mid': [], 'high': []}
-    for school_type in private_cdfs:
-        private_cdfs[school_type] = core.cdf([int(school[7]) for school
-                                              in private_schools[school_type]])
-    return private_cdfs
+    private_samplers = {'elem': None, 'mid': None, 'high': None}
+    for school_type in private_samplers:
+        private_samplers[school_type] = sampler.AliasSampler([int(school[7]) for school
+                                                              in private_schools[school_type]])
+    return private_samplers
 
 def assemble_post_sec_dist(post_sec_schools, county_lat, county_lon):
-    """Generates CDFs for all post-secondary schools in a state.
+    """Generates samplers for all post-secondary schools in a state.
 
     Note that employment at post-secondary insitutions is used as a
     proxy for school attendance. This is a reasonable assumption as
@@ -388,23 +363,24 @@ def assemble_post_sec_dist(post_sec_schools, county_lat, county_lon):
     based on this metric.
     
     Returns:
-        post_sec_cdfs (dict): Dictionary with keys for each public school type
-            (elementary, middle, high), where each key maps to a list with
-            elements containing a CDF of all of the schools of that type
-            with respect to the number of students enrolled in the school.
-            The index of each CDF element in each list maps to a school in
-            public_schools (for identification) and vice versa.
+        post_sec_samplers (dict): Dictionary with keys for each post-secondary
+            school type, where each key maps to an AliasSampler over all of
+            the schools of that type weighted by enrollment and distance.
+            Each index drawn maps to a school in post_sec_schools and
+            vice versa.
     """
-    post_sec_cdfs = {'bach_or_grad': [], 'associates': [], 'non_degree': []}
-    for school_type in post_sec_cdfs:
-        post_sec_cdfs[school_type] = core.cdf([int(school[-4])
-                                               / (distance.between_points(county_lat,
-                                                                          county_lon,
-                                                                          float(school[-2]),
-                                                                          float(school[-1])))**2
-                                               for school
-                                               in post_sec_schools[school_type]])
-    return post_sec_cdfs
+    post_sec_samplers = {'bach_or_grad': None, 'associates': None, 'non_degree': None}
+    for school_type in post_sec_samplers:
+        schools = post_sec_schools[school_type]
+        enrollment = np.array([int(school[-4]) for school in schools], dtype=float)
+        school_distance = distance.between_points_batch(county_lat, county_lon,
+                                                        [school[-2] for school in schools],
+                                                        [school[-1] for school in schools])
+        if not school_distance.all():
+            # A zero distance would give the school an infinite weight
+            raise ZeroDivisionError('School at the county centroid')
+        post_sec_samplers[school_type] = sampler.AliasSampler(enrollment / school_distance**2)
+    return post_sec_samplers
     
 def _read_school_file(file_name, school_type, post_sec_schools):
     """Helper function for read_post_sec_schools() for file reading.
@@ -414,10 +390,8 @@ def _read_school_file(file_name, school_type, post_sec_schools):
         school_type (str): Type2 designation for post-secondary school.
         post_sec_schools (dict): See read_post_sec_schools()
     """
-    with open(file_name) as read:
-        reader = reading.csv_reader(read)
-        for row in reader:
-            post_sec_schools[school_type].append(row)
+    for row in refdata.read_rows(file_name):
+        post_sec_schools[school_type].append(row)
 
 def select_neighboring_public_school(counties, school_type, lat, lon):
     """Selects public schools from all neighboring counties of a county.
@@ -465,20 +439,21 @@ def write_headers(writer):
                     + ['School_Name'] + ['School_Lat'] + ['School_Lon'] + ['GC_Distance'])
 
 
-def write_non_student(writer, row):
-    """Writes data for non-students in Module3 output file.
+def non_student_row(row):
+    """Builds the Module3 output row of a non-student.
 
     Inputs:
-        writer (csv.writer): Module3 csv writer.
         row (list): Data describing a row.
+
+    Returns:
+        row (list): Row with school information filled in as 'NA'.
     """
-    writer.writerow(row + ['NA'] + ['NA'] + ['NA'] + ['NA'] + ['NA'])
+    return row + ['NA'] + ['NA'] + ['NA'] + ['NA'] + ['NA']
 
-def write_school_by_type(writer, row, school, type2, tot_dist, home_lat, home_lon):
-    """Writes data for students in Module3 output file.
+def school_row(row, school, type2, tot_dist, home_lat, home_lon):
+    """Builds the Module3 output row of a student.
 
     Inputs:
-        writer (csv.writer): Module3 csv writer.
         row (list): Data describing a student.
         school (list): Student's assigned school.
         type2 (str): The type of school that the student has been assigned
@@ -486,6 +461,12 @@ def write_school_by_type(writer, row, school, type2, tot_dist, home_lat, home_lo
             "associates", "non_degree". Public/Private refers to primary
             and secondary education, while the various types of graduate
             programs refer to post-secondary education.
+        tot_dist (list): Distances to school so far, gets the distance to
+            this student's school appended.
+        home_lat, home_lon (float): Student's home latitude and longitude.
+
+    Returns:
+        row (list): Row with school information and distance appended.
     """
     assert type2 != 'no'
     assert school != None
@@ -493,14 +474,15 @@ def write_school_by_type(writer, row, school, type2, tot_dist, home_lat, home_lo
         raise ValueError('Unknown school detected')
     if type2 == 'public':
         gc_dist = distance.between_points(home_lat, home_lon, school[6], school[7])
-        writer.writerow(row + [school[1]] + [school[0]] + [school[3]] + [school[6]] + [school[7]] + [gc_dist])
+        school_info = [school[1]] + [school[0]] + [school[3]] + [school[6]] + [school[7]]
     elif type2 == 'private':
         gc_dist = distance.between_points(home_lat, home_lon, school[4], school[5])
-        writer.writerow(row + [school[3]] + [school[1]] + [school[0]] + [school[4]] + [school[5]] + [gc_dist])
+        school_info = [school[3]] + [school[1]] + [school[0]] + [school[4]] + [school[5]]
     elif school != 'UNKNOWN':
         gc_dist = distance.between_points(home_lat, home_lon, school[15], school[16])
-        writer.writerow(row + [school[5]] + [school[3]] + [school[0]] + [school[15]] + [school[16]] + [gc_dist])
+        school_info = [school[5]] + [school[3]] + [school[0]] + [school[15]] + [school[16]]
     tot_dist.append(gc_dist)
+    return row + school_info + [gc_dist]
 
 def main(state):
     """Assigns all valid students with county assignments to schools.
@@ -514,37 +496,70 @@ def main(state):
         state (str): State name, no spaces (e.g. Wyoming, NorthCarolina, DC).
     """
     tot_dist = []
-    global neighboringCount
     input_path = paths.MODULES[2] + state + 'Module3NN_AssignedSchoolCounty_SortedSchoolCounty.csv'
     output_path = paths.MODULES[2] + state + 'Module3NN_AssignedSchool.csv'
-    with open(input_path) as read, open(output_path, 'w') as write:
+    with open(input_path) as read, intermediate.open_writer(output_path) as writer:
         reader = reading.csv_reader(read)
-        writer = writing.csv_writer(write)
         next(reader)
         write_headers(writer)
         states = core.read_states(spaces=False)
         state_abbrev = core.match_name_abbrev(states, state)
-        trailing_fips = ''
-        for count, row in enumerate(reader):
-            if row[30] != 'UNASSIGNED' and row[30] != 'NA':
-                school_county = core.correct_FIPS(row[30])
-            type1 = row[31]
-            type2 = row[32]
-            home_lat = float(row[6])
-            home_lon = float(row[7])
-            if trailing_fips != school_county:
-                trailing_fips = school_county
-                trailing_assigner = SchoolAssigner(school_county, state_abbrev)
-            school = None
-            if type2 == 'no':
-                write_non_student(writer, row)
-            else:
-                school, type2 = trailing_assigner.select_school_by_type(type1, type2, home_lat, home_lon)
-                write_school_by_type(writer, row, school, type2, tot_dist, home_lat, home_lon)
-            if count % 1000000 == 0:
-                print('Number of people assigned schools in the state ' + state + ': ' + str(count))
-                print('neighboring county ' + str(neighboringCount))
-        print('Finished assigning residents in '+ state + ' to schools. Total number of residents processed: ' + str(count))
+        writer.writerows(assign_schools(reader, state, state_abbrev, tot_dist,
+                                        reading.count_lines(input_path) - 1))
+    write_distances(state, tot_dist)
+
+def assign_schools(reader, state, state_abbrev, tot_dist, total=None):
+    """Assigns every student a school.
+
+    Inputs:
+        reader (iterator): Rows with school counties assigned, without
+            header, grouped by school county.
+        state (str): State name, no spaces.
+        state_abbrev (str): 2 character state abbreviation.
+        tot_dist (list): Gets the distance of every student to their
+            school appended.
+        total (int): Number of rows, for progress output.
+
+    Returns:
+        rows (generator): Every row with school information appended.
+    """
+    trailing_fips = ''
+    count = 0
+    rows = metrics.counter('rows', step='assign_school')
+    neighboring = metrics.counter('fallbacks', kind='neighboring_public_school')
+    county_timer = metrics.county_timer('assign_school')
+    tracker = progress.Progress('assign_school', total)
+    for count, row in enumerate(reader):
+        if row[30] != 'UNASSIGNED' and row[30] != 'NA':
+            school_county = core.correct_FIPS(row[30])
+        type1 = row[31]
+        type2 = row[32]
+        home_lat = float(row[6])
+        home_lon = float(row[7])
+        if trailing_fips != school_county:
+            county_timer.switch(school_county)
+            trailing_fips = school_county
+            trailing_assigner = SchoolAssigner(school_county, state_abbrev)
+        school = None
+        if type2 == 'no':
+            yield non_student_row(row)
+        else:
+            school, type2 = trailing_assigner.select_school_by_type(type1, type2, home_lat, home_lon)
+            yield school_row(row, school, type2, tot_dist, home_lat, home_lon)
+        rows.inc()
+        tracker.update()
+    county_timer.stop()
+    tracker.finish()
+    print('neighboring county ' + str(neighboring.value))
+    print('Finished assigning residents in '+ state + ' to schools. Total number of residents processed: ' + str(count))
+
+def write_distances(state, tot_dist):
+    """Writes the distance of every student to their school.
+
+    Inputs:
+        state (str): State name, no spaces.
+        tot_dist (list): Distance of every student to their school.
+    """
     with open(state + 'gcd.csv', 'w+') as write:
         writer = writing.csv_writer(write)
         for dist in tot_dist:
@@ -10,10 +10,8 @@ PURPOSE: Assign Each Resident an Activity Pattern
 INPUTS: Activity Pattern Distributions
 DEPENDENCIES: None
 '''
-import random
-import bisect
 from datetime import datetime
-from ..utils import core, paths, reading, writing
+from ..utils import core, paths, reading, sampler, intermediate, checkpoint, metrics, progress
 
 def read_activity_pattern_dists():
     """Creates dictionary mapping traveler type to weight distribution.
@@ -35,15 +33,27 @@ def read_activity_pattern_dists():
                 distributions[index].append(float(weight))
     return distributions
 
-def assign_activity_pattern(traveler_type, distributions, person):
+def build_activity_pattern_samplers(distributions):
+    """Builds an activity pattern sampler for every traveler type.
+
+    Inputs:
+        distributions (dict): See read_activity_pattern_dists().
+
+    Returns:
+        samplers (dict): Each key is a traveler type, that maps to an
+            AliasSampler over that traveler type's activity patterns.
+    """
+    return {traveler_type: sampler.AliasSampler(dist)
+            for traveler_type, dist in distributions.items()}
+
+def assign_activity_pattern(traveler_type, samplers, person):
     """Assigns activity pattern based on traveler type to a person.
 
     Inputs:
         traveler_type (int): Person's traveler type.
-        distributions (dict): Each key is a traveler type, that
-            maps to a list, where each element maps to the probability
-            that a traveler type is assigned an activity pattern, with the
-            activity tour being the index of the element in the list.
+        samplers (dict): Each key is a traveler type, that maps to an
+            AliasSampler drawing the index of an activity pattern, see
+            build_activity_pattern_samplers().
         person (list): Information about a person from input file.
 
     Returns:
@@ -56,10 +66,7 @@ def assign_activity_pattern(traveler_type, distributions, person):
             traveler_type = 6
     if traveler_type == 5 and person[15] == '-2':
             return '-5'
-    dist = distributions[traveler_type]
-    weights = core.cdf(dist)
-    split = random.random()
-    return bisect.bisect(weights, split)
+    return samplers[traveler_type].draw()
 
 def write_headers(writer):
     """Writes headers for Module4 output file."""
@@ -93,9 +100,24 @@ def fix_missing_school_fips(state_county_dict, person):
     county_dict = state_county_dict.get(school_abbrev)
     person[30] = county_dict.get(school_county_name)
 
-def main(state):
+def main(state, *, resume=False):
     """Assigns all persons a traveler type.
 
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        resume (bool): Whether to skip the state if a previous run
+            completed it, see checkpoint.RunManifest.
+    """
+    output_path = paths.MODULES[3] + state + 'Module4NN2ndRun.csv'
+    metrics.reset()
+    manifest = checkpoint.RunManifest(state, 'module4', resume)
+    manifest.run('assign_activity_patterns', lambda: assign_all_activity_patterns(state),
+                 outputs=[intermediate.file_path(output_path)])
+    metrics.write_report('module4', state)
+
+def assign_all_activity_patterns(state):
+    """Assigns all persons in the Module 3 output of a state an activity pattern.
+
     Inputs:
         state (str): Alphabetical state name with no spaces.
     """
@@ -103,40 +125,74 @@ def main(state):
     output_path = paths.MODULES[3] + state + 'Module4NN2ndRun.csv'
     start_time = datetime.now()
     print(state + " started at: " + str(start_time))
-    with open(input_path) as read, open(output_path, 'w+') as write:
-        reader = reading.csv_reader(read)
-        writer = writing.csv_writer(write)
+    with intermediate.open_reader(input_path) as reader, \
+    intermediate.open_writer(output_path) as writer:
         next(reader)
         write_headers(writer)
-        distributions = read_activity_pattern_dists()
-        count = 0
-        school_fixes = 0
-        school_issue = 0
+        samplers = build_activity_pattern_samplers(read_activity_pattern_dists())
         state_county_dict = core.state_county_dict()
-        for person in reader:
-            count += 1
-            traveler_type = int(person[11])
-            school_county_code = person[30]
-            school_county_name = person[33]
-            # TODO - Refactor this out to core.county_dict()...
-            if 'Radford' in school_county_name:
-                school_county_name = 'Radford City'
-            if school_county_code == 'UNASSIGNED':
-                fix_missing_school_fips(state_county_dict, person)
-                school_fixes += 1
-            else:
-                activity_index = assign_activity_pattern(traveler_type, distributions, person)
-            if person[30] is None and person[33] == 'NA' and person[34] != 'NA':
-                school_issue += 1
-                print('FIPS Issue found - no County Provided, skipping.')
-                print('Row number', count)
-                continue
-            else:
-                writer.writerow(person + [activity_index])
-            if count % 1000000 == 0:
-                print(str(count) + ' Residents Completed')
-
-    print(str(count) + ' of all Residents in ' + state + ' have been processed')
+        counts = {'count': 0, 'school_fixes': 0, 'school_issue': 0}
+        writer.writerows(assign_activity_patterns(reader, samplers, state_county_dict, counts,
+                                                  intermediate.count_rows(input_path)))
+    print_summary(state, start_time, counts)
+
+def assign_activity_patterns(reader, samplers, state_county_dict, counts, total=None):
+    """Assigns every person an activity pattern.
+
+    Persons whose school county is unassigned and cannot be fixed are
+    skipped.
+
+    Inputs:
+        reader (iterator): Module 3 rows, without header.
+        samplers (dict): See build_activity_pattern_samplers().
+        state_county_dict (dict): See core.state_county_dict().
+        counts (dict): Number of persons processed ('count'), of school
+            FIPS codes fixed ('school_fixes') and of persons skipped
+            ('school_issue'), updated as persons are processed.
+        total (int): Number of persons, for progress output.
+
+    Returns:
+        rows (generator): Every row with the activity pattern appended.
+    """
+    tracker = progress.Progress('assign_activity_patterns', total)
+    for person in reader:
+        tracker.update()
+        counts['count'] += 1
+        count = counts['count']
+        traveler_type = int(person[11])
+        school_county_code = person[30]
+        school_county_name = person[33]
+        # TODO - Refactor this out to core.county_dict()...
+        if 'Radford' in school_county_name:
+            school_county_name = 'Radford City'
+        if school_county_code == 'UNASSIGNED':
+            fix_missing_school_fips(state_county_dict, person)
+            counts['school_fixes'] += 1
+        else:
+            activity_index = assign_activity_pattern(traveler_type, samplers, person)
+        if person[30] is None and person[33] == 'NA' and person[34] != 'NA':
+            counts['school_issue'] += 1
+            print('FIPS Issue found - no County Provided, skipping.')
+            print('Row number', count)
+            continue
+        else:
+            yield person + [activity_index]
+    tracker.finish()
+
+def print_summary(state, start_time, counts):
+    """Prints a summary of activity pattern assignment for a state.
+
+    The counts are also added to the run metrics.
+
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        start_time (datetime): Time processing started.
+        counts (dict): See assign_activity_patterns().
+    """
+    print(str(counts['count']) + ' of all Residents in ' + state + ' have been processed')
     print(state + " took this much time: " + str(datetime.now()-start_time))
-    print('FIPS MISSING/ABLE TO FIX', school_fixes)
-    print('FIPS MISSING/UNABLE TO FIX', school_issue)
+    print('FIPS MISSING/ABLE TO FIX', counts['school_fixes'])
+    print('FIPS MISSING/UNABLE TO FIX', counts['school_issue'])
+    metrics.counter('rows', step='assign_activity_patterns').inc(counts['count'])
+    metrics.counter('fallbacks', kind='school_fips_fixed').inc(counts['school_fixes'])
+    metrics.counter('fallbacks', kind='school_fips_missing').inc(counts['school_issue'])
@@ -1,12 +1,51 @@
 import sys
 from ..utils import pixel, core
 
+# Pixel coordinates used for nodes without a known location
+NO_LOCATION_PIXEL = pixel.find_pixel_coords(0, 0)
+# Lat, lon column indices for every node type with a known location
+NODE_COORD_INDS = {'H': (6, 7), 'W': (28, 29), 'S': (36, 37)}
+
 class Pattern:
-    def __init__(self, trip_type, person, row):
+    def __init__(self, trip_type, person, row, pixels=None):
         self.pattern = trip_type_to_pattern(trip_type)
-        self.activities = make_activities(self.pattern, person, row)
+        self.activities = make_activities(self.pattern, person, row, pixels)
+
+def find_node_pixels(persons):
+    """Finds pixel coordinates of the H, W and S nodes for many travellers.
+
+    Coordinates are converted to pixels in one vectorized call per node
+    type rather than once per node. Nodes whose location cannot be parsed
+    are left out, so that make_activities() handles them as before.
+
+    Inputs:
+        persons (list): Module4NN rows of the travellers.
+
+    Returns:
+        pixels (list): For every traveller, a dictionary mapping node type
+            to the X, Y pixel coordinates of that node.
+    """
+    pixels = [dict() for _ in persons]
+    for node_type, (lat_ind, lon_ind) in NODE_COORD_INDS.items():
+        members, lats, lons = [], [], []
+        for idx, person in enumerate(persons):
+            if ((node_type == 'W' and person[17] == 'International Destination for Work')
+                    or (node_type == 'S' and len(person) > 36 and person[36] == 'UNKNOWN')):
+                pixels[idx][node_type] = NO_LOCATION_PIXEL
+                continue
+            try:
+                lat, lon = float(person[lat_ind]), float(person[lon_ind])
+            except (ValueError, IndexError):
+                continue
+            members.append(idx)
+            lats.append(lat)
+            lons.append(lon)
+        x_pixels, y_pixels = pixel.find_pixel_coords_batch(lats, lons)
+        for idx, x_pixel, y_pixel in zip(members, x_pixels.tolist(), y_pixels.tolist()):
+            pixels[idx][node_type] = (x_pixel, y_pixel)
+    return pixels
 
-def make_activities(pattern, person, row):
+def make_activities(pattern, person, row, pixels=None):
     """ Fills in the pattern/nodes in a person's activity pattern.
     
     As all details are known for Home, Work and School (H,W,S), everything
@@ -20,6 +59,9 @@ def make_activities(pattern, person, row):
             traveller. 
         row (int): The row number from Module4NN that corresponds to 
             this specific trip
+        pixels (dict): Precomputed pixel coordinates of the traveller's
+            nodes by node type, see find_node_pixels(). Nodes missing
+            from it are converted here.
 
     Output:
         activity_pattern (list): A filled activity pattern detailing the
@@ -30,6 +72,8 @@ def make_activities(pattern, person, row):
             Activity Patterns 19 and 20).
     """
     #TODO - Clean up this logic when time permits...
+    if pixels is None:
+        pixels = {}
     num_activities = pattern[1]
     trip_tour = [[], [], [], [], [], [], [], []]
     for ind in range(num_activities + 1):
@@ -42,7 +86,7 @@ def make_activities(pattern, person, row):
             lon = float(person[7])
             industry = 'NA'
             county = person[0] + person[1]
-            x_pixel, y_pixel = pixel.find_pixel_coords(lat, lon)
+            x_pixel, y_pixel = _node_pixel(pixels, node_type, lat, lon)
         elif node_type == 'W':
             name = person[17]
             if name == 'International Destination for Work':
@@ -50,24 +94,24 @@ def make_activities(pattern, person, row):
                 lon = 'NA'
                 industry = person[16]
                 county = person[16]
-                x_pixel, y_pixel = pixel.find_pixel_coords(0, 0)
+                x_pixel, y_pixel = NO_LOCATION_PIXEL
             else:
                 lat = float(person[28])
                 lon = float(person[29])
                 industry = (person[16])
                 county = person[15]
-                x_pixel, y_pixel = pixel.find_pixel_coords(lat, lon)
+                x_pixel, y_pixel = _node_pixel(pixels, node_type, lat, lon)
         elif node_type == 'S':
             name = person[35]
             if person[36] == 'UNKNOWN':
                 lat = 0
                 lon = 0
-                x_pixel, y_pixel = pixel.find_pixel_coords(0, 0)
+                x_pixel, y_pixel = NO_LOCATION_PIXEL
             else:
                 try:
                     lat = float(person[36])
                     lon = float(person[37])
-                    x_pixel, y_pixel = pixel.find_pixel_coords(lat, lon)
+                    x_pixel, y_pixel = _node_pixel(pixels, node_type, lat, lon)
                 except IndexError:
                     print('person', person)
                     sys.exit()
@@ -96,6 +140,21 @@ def make_activities(pattern, person, row):
                           'NA', 'NA', 'NA', 8233, -5376, ind, row]
     return [trip_tour[i] for i in range(7)]
 
+def _node_pixel(pixels, node_type, lat, lon):
+    """Gets precomputed pixel coordinates for a node, or computes them.
+
+    Inputs:
+        pixels (dict): Precomputed pixel coordinates by node type.
+        node_type (str): Node type, one of 'H', 'W', 'S'.
+        lat, lon (float): Location of the node.
+
+    Returns:
+        x_pixel, y_pixel (int): Pixel coordinates of the node.
+    """
+    if node_type in pixels:
+        return pixels[node_type]
+    return pixel.find_pixel_coords(lat, lon)
+
 def trip_type_to_pattern(trip_type):
     """Constructs an unfilled activity pattern for a trip type.
     
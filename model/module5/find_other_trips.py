@@ -1,8 +1,8 @@
 import random
 import bisect
-import cProfile
+import numpy as np
 from ..module2 import industry
-from ..utils import core, reading, writing, distance, pixel
+from ..utils import core, reading, writing, distance, pixel, sampler, metrics, memory, progress
 
 NAISC_TO_INDUST = {11: 'agr', 21: 'mqo', 31: 'man', 32: 'man', 33: 'man',
                    42: 'wtr', 44: 'rtr', 45: 'rtr', 48: 'tra', 49: 'tra',
@@ -28,6 +28,9 @@ class GeoAttributes:
             by NAISC industry, where each key is an NAISC industry (NAISC code)
             and value a normalized distribution (essentially the CDF) for
             sampling.
+        pat_place_samplers (dict): AliasSampler for each NAISC industry
+            in pat_place_dist, built the first time the industry is drawn
+            from and kept until the distribution changes.
         pat_county (PatronageCounty): Current patronage county, used for
             performing operations on all data associated with distribution
             generation for a FIPS code.
@@ -41,6 +44,7 @@ class GeoAttributes:
         self.pix_coords = (x, y)
         self.curr_node = curr_node
         self.pat_place_dist = None
+        self.pat_place_samplers = dict()
         self.pat_county = None
         self.pat_warehouse = None
         if self.fips is not None:
@@ -90,6 +94,7 @@ class GeoAttributes:
         """
         pat_county = self.pat_warehouse.counties[self.fips]
         self.pat_place_dist = self.build_pat_place_distribution(pat_county)
+        self.pat_place_samplers = dict()
         self.pat_county = pat_county
 
     def build_pat_place_distribution(self, pat_county):
@@ -113,21 +118,15 @@ class GeoAttributes:
         # Note: Restrictons on geography are built into distance calculations
         x, y = self.pix_coords
         for naisc in pat_county.indust_dict.values():
-            pat_places = naisc.pat_places
-            normalized_dist = []
-            pat_pixels = [(float(pat_place[12]), pixel.find_pixel_coords(pat_place[15], pat_place[16]))
-                          for pat_place in pat_places]
+            patrons, pat_x, pat_y = naisc.get_pat_pixels()
+            pixel_dist = distance.between_pixels_batch(x, y, pat_x, pat_y)
             if naisc.indust_type == 'otr':
-                normalized_dist = [ele[0] / distance.between_pixels(x, y, ele[1][0], ele[1][1])**2
-                                   for ele in pat_pixels]
+                normalized_dist = patrons / pixel_dist**2
             else:
-                normalized_dist = [ele[0] / distance.between_pixels(x, y, ele[1][0], ele[1][1])
-                                   for ele in pat_pixels]
-            try:
-                norm = sum(normalized_dist)
-                normalized_dist = [j/norm for j in normalized_dist]
-            except ZeroDivisionError:
-                pass
+                normalized_dist = patrons / pixel_dist
+            norm = normalized_dist.sum()
+            if norm != 0:
+                normalized_dist = normalized_dist / norm
             dist[naisc.naisc] = normalized_dist
         return dist
 
@@ -172,6 +171,24 @@ class GeoAttributes:
         for normalized_patron_count, naisc in zip(core.cdf(patronage_counts), industries):
             naisc.add_normalized_patrons(normalized_patron_count)
 
+    def get_pat_place_sampler(self, indust):
+        """Gets the patronage place sampler for an NAISC industry.
+
+        If the distribution for the industry sums to zero, every patronage
+        place is equally likely to be drawn.
+
+        Inputs:
+            indust (int): NAISC industry code.
+
+        Returns:
+            sampler (AliasSampler): Draws indices of patronage places.
+        """
+        pat_place_sampler = self.pat_place_samplers.get(indust)
+        if pat_place_sampler is None:
+            pat_place_sampler = sampler.AliasSampler(self.pat_place_dist[indust])
+            self.pat_place_samplers[indust] = pat_place_sampler
+        return pat_place_sampler
+
     def select_location(self, predecessor, successor):
         """Selects physical location for O type trips from a distribution.
 
@@ -188,13 +205,7 @@ class GeoAttributes:
         """
         indust = self.select_industry(predecessor, successor)
         pat_places = self.pat_county.indust_dict[indust].pat_places
-        distance_dist = self.pat_place_dist[indust]
-        if sum(distance_dist) == 0:
-            index = random.randint(0, len(distance_dist) - 1)
-        else:
-            weights = core.cdf(distance_dist)
-            split = random.random()
-            index = bisect.bisect(weights, split)
+        index = self.get_pat_place_sampler(indust).draw()
         selected_location = pat_places[index]
         # Get other trip information and return it
         name = selected_location[0]
@@ -235,6 +246,8 @@ class Industry:
         pat_places (list): Elements are lists providing information
             about patronage places (e.g. employer locations) associated
             with that industry.
+        pat_pixels (tuple): Cached arrays of patron counts and X, Y pixel
+            coordinates for every patronage place, see get_pat_pixels().
     """
     def __init__(self, naisc, indust_type):
         """Initializes Industry class
@@ -247,6 +260,7 @@ class Industry:
         self.naisc = naisc
         self.patrons = 0
         self.pat_places = []
+        self.pat_pixels = None
 
     def add_pat_place(self, pat_place, patrons):
         """Adds patronage place to specific industry
@@ -260,6 +274,25 @@ class Industry:
         """
         self.patrons += patrons
         self.pat_places.append(pat_place)
+        self.pat_pixels = None
+
+    def get_pat_pixels(self):
+        """Gets patron counts and pixel coordinates of all patronage places.
+
+        These do not depend on the location of the traveller, so they are
+        computed once and reused for every distribution built for the county.
+
+        Returns:
+            patrons (ndarray): Patron count of each patronage place.
+            pat_x, pat_y (ndarray): X, Y pixel coordinates of each
+                patronage place.
+        """
+        if self.pat_pixels is None:
+            patrons = np.array([float(pat_place[12]) for pat_place in self.pat_places])
+            pat_x, pat_y = pixel.find_pixel_coords_batch([pat_place[15] for pat_place in self.pat_places],
+                                                         [pat_place[16] for pat_place in self.pat_places])
+            self.pat_pixels = patrons, pat_x, pat_y
+        return self.pat_pixels
 
 def parse_patron_num(patron_num):
     """Parses string representation of patron number.
@@ -333,11 +366,7 @@ def write_rebuilt_headers(writer):
                     + ['D Node Lat'] + ['D Node Lon'] + ['D Node Industry']
                     + ['D XCoord'] + ['D YCoord'])
 
-def get_other_trip_worker(input_file, output_file, iteration, state_county_dict, cpu_num=None, fips=None):
-    cProfile.runctx('get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_num, fips)',
-                    globals(), locals(), 'prof%s-%d-%s.prof' %(fips, cpu_num, iteration))
-
-def get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_num=None, fips=None):
+def get_other_trip(input_file, output_file, iteration, cpu_num=None, fips=None):
     """Finds all valid other trips for a given file of trip nodes.
 
     Supports both serial and parallel processing, this function can be called
@@ -353,8 +382,20 @@ def get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_nu
         iteration (str): Current iteration of processing we are on.
         cpu_num (str): CPU Process assigned to this input file.
         fips (str): FIPS code that this file piece belongs to.
+
+    Returns:
+        cpu_num (str), fips (str), snapshot (dict): When run in a worker
+            process (i.e. cpu_num and fips are given), the inputs and the
+            metrics of the worker, see metrics.collect().
     """
     print('Processing', input_file, 'with cpu', cpu_num)
+    if cpu_num is not None:
+        metrics.reset()
+        memory.start()
+    rows = metrics.counter('rows', step='pass_' + iteration)
+    task = progress.TaskProgress()
+    timer = metrics.timer('county', step='pass_' + iteration, county=fips)
+    timer.start()
     # If this is our first iteration, we have no other trips generated yet, so
     # we can't handle O-O type trips, so ignore these when they come up
     if iteration == '1':
@@ -362,8 +403,8 @@ def get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_nu
     # Otherwise, we can handle every trip type
     else:
         valid_prev = ('S', 'H', 'W', 'O')
-    county_name_data = core.read_counties()
-    state_code_dict = core.state_code_dict()
+    county_resolver = core.county_name_resolver()
+    memory.checkpoint(memory.REFERENCE, 'county_names')
     with open(input_file) as read, open(output_file, 'w+') as write:
         reader = reading.csv_reader(read)
         writer = writing.csv_writer(write)
@@ -371,6 +412,8 @@ def get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_nu
         write_rebuilt_headers(writer)
         geo = GeoAttributes()
         for row in reader:
+            rows.inc()
+            task.update()
             if row[4] == 'NA':
                 print('NA found')
                 continue
@@ -379,18 +422,17 @@ def get_other_trip(input_file, output_file, iteration, state_county_dict, cpu_nu
                 name, county_name, curr_state, lat, lon, indust = geo.select_location(row[1], row[2])
                 row[-1] = 1
                 # Lookup the county name
-                try:
-                    fips = state_county_dict[curr_state][county_name]
-                except KeyError:
-                    state_code = state_code_dict[curr_state]
-                    fips = core.lookup_name(county_name, state_code, county_name_data)
+                county_fips = county_resolver.resolve(county_name, curr_state)
                 x_coord, y_coord = pixel.find_pixel_coords(lat, lon)
                 writer.writerow([row[i] for i in range(13)]
-                                + [name] + [fips] + [lat] + [lon]
+                                + [name] + [county_fips] + [lat] + [lon]
                                 + [indust] + [x_coord] + [y_coord])
             else:
               # The trip wasn't generated, so we mark it as not complete and write
               # all geographic attributes as NA
                 writer.writerow([row[i] for i in range(13)] + ['NA']*6)
+    task.send()
+    timer.stop()
+    memory.checkpoint(memory.COUNTY, 'pass_' + iteration + ':' + str(fips))
     if cpu_num is not None and fips is not None:
-        return cpu_num, fips
+        return cpu_num, fips, metrics.collect()
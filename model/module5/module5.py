@@ -1,11 +1,10 @@
 import statistics
-import os
 import multiprocessing
 from datetime import datetime
-from itertools import chain
+from itertools import chain, islice
 import pandas as pd
 from . import activity, find_other_trips
-from ..utils import reading, writing, paths, core
+from ..utils import reading, writing, paths, core, intermediate, checkpoint, metrics, profiling, progress
 
 TEMP_NAME = 'Module5Temp'
 TEMP_FNAME = TEMP_NAME + '.csv'
@@ -14,6 +13,7 @@ TRIP_SEGMENT_LENGTH = 8
 VALID_PREV = ('S', 'H', 'W')
 VALID_END = ('S', 'H', 'W', 'N')
 SCALE_FACTOR = 4
+PIXEL_CHUNK_SIZE = 10000
 
 class TripTour:
     """Represents a traveller's daily trip tour.
@@ -262,6 +262,9 @@ class CSVSplitter:
                         writer = self.build_new_writer(fips)
                 self.prev_key = self.gen_split(row)
                 writer.writerow(row)
+        # The last piece is complete, and must be on disk once the split is done
+        self.current_out.close()
+        self.current_out = None
 
 def write_node_headers(writer):
     """Writes headers for trips comprising trip tours."""
@@ -317,7 +320,7 @@ def get_writer(base_path, fips, active_fips_codes, active_files, file_type):
         active_files.append([fips, '1'])
     return writer
 
-def build_initial_trip_files(file_path, base_path, start_time):
+def build_initial_trip_files(file_path, base_path):
     """Converts all Module 4 Activity Patterns into the nodes they represent.
 
     Writes every row (with activity patterns) as a  node with geographic
@@ -335,7 +338,6 @@ def build_initial_trip_files(file_path, base_path, start_time):
         input_path (str): Completed file path to Module 4 input file.
         base_path (str): Partially completed path to Module 5 output file,
             including state name.
-        start_time (datetime): Module 5 start time.
 
     Returns:
         active_files (list): Contains the files we have constructed
@@ -350,27 +352,53 @@ def build_initial_trip_files(file_path, base_path, start_time):
     active_files = []
     active_fips_codes = set()
     traveller_counter = TravellerCounter()
-    with open(file_path) as read:
-        reader = reading.csv_reader(read)
+    rows = metrics.counter('rows', step='build_initial')
+    county_timer = metrics.county_timer('build_initial')
+    tracker = progress.Progress('build_initial', intermediate.count_rows(file_path))
+    with intermediate.open_reader(file_path) as reader:
         next(reader)
-        for count, row in enumerate(reader):
+        for count, row, pixels in _rows_with_pixels(reader):
+            rows.inc()
             curr_fips = build_fips(row[0], row[1])
             row[0], row[1] = curr_fips[0:2], curr_fips[2:5]
             if curr_fips != trailing_fips:
+                county_timer.switch(curr_fips)
                 if trailing_fips != '':
                     traveller_counter.update_counted_fips(trailing_fips, curr_fips)
                 trailing_fips = curr_fips
                 writer = get_writer(base_path, trailing_fips, active_fips_codes, active_files, 'Pass0')
-            tour = activity.Pattern(int(row[-1]), row, count)
+            tour = activity.Pattern(int(row[-1]), row, count, pixels)
             write_trip(tour, writer)
             traveller_counter.traveller_count += 1
-            if count % 100000 == 0:
-                print(str(count) + ' Residents Completed and taken this much time: '
-                      + str(datetime.now()-start_time))
+            tracker.update()
+    county_timer.stop()
+    tracker.finish()
     traveller_counter.update_fips(curr_fips)
     median_traveller_count = traveller_counter.compute_median_travellers()
     return active_files, median_traveller_count
 
+def _rows_with_pixels(reader, chunk_size=PIXEL_CHUNK_SIZE):
+    """Yields rows with node pixel coordinates computed a chunk at a time.
+
+    Inputs:
+        reader (csv.reader): Module 4 output reader, past the header.
+        chunk_size (int): Number of rows converted to pixels at once.
+
+    Yields:
+        count (int): Row number of the traveller.
+        row (list): Module 4 row of the traveller.
+        pixels (dict): Pixel coordinates of the traveller's nodes, see
+            activity.find_node_pixels().
+    """
+    count = 0
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if not chunk:
+            return
+        for row, pixels in zip(chunk, activity.find_node_pixels(chunk)):
+            yield count, row, pixels
+            count += 1
+
 def load_balance_files(output_path, state, active_fips_codes, row_limit):
     """Splits input files to be roughly the same size for processing.
 
@@ -457,6 +485,11 @@ def gen_file_names(file_info, iteration, process):
         iteration (int): Iteration of processing, either 1 or 2.
         process (str): Functionality being performed, e.g. sorting 
             before processing, processing, sorting after processing, etc.
+            Every step writes files of its own, so that a step completed
+            by an interrupted run is never overwritten by a later one (see
+            checkpoint.RunManifest): sort_before writes Sort files, pass
+            writes Found files, sort_after writes Rows files and rebuild
+            writes the Pass files of the iteration.
 
     Returns:
         input_fname (str): Input file name for iteration.
@@ -470,21 +503,21 @@ def gen_file_names(file_info, iteration, process):
                        + prev_iter + '_' + piece + '.csv')
         output_fname = (fips + '_' + TEMP_NAME + '_' + 'Sort'
                         + curr_iter + '_' + piece + '.csv')
-    elif process == 'pass' or process == 'rebuild':
+    elif process == 'pass':
         input_fname = (fips + '_' + TEMP_NAME + '_' + 'Sort'
                        + curr_iter + '_' + piece + '.csv')
-        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Pass'
+        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Found'
                         + curr_iter + '_' + piece + '.csv')
     elif process == 'sort_after':
-        input_fname = (fips + '_' + TEMP_NAME + '_' + 'Pass'
+        input_fname = (fips + '_' + TEMP_NAME + '_' + 'Found'
                        + curr_iter + '_' + piece + '.csv')
-        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Sort'
+        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Rows'
+                        + curr_iter + '_' + piece + '.csv')
+    elif process == 'rebuild':
+        input_fname = (fips + '_' + TEMP_NAME + '_' + 'Rows'
+                       + curr_iter + '_' + piece + '.csv')
+        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Pass'
                         + curr_iter + '_' + piece + '.csv')
-    elif process == 'remove':
-        input_fname = (fips + '_' + TEMP_NAME + '_' + 'Pass'
-                       + prev_iter + '_' + piece + '.csv')
-        output_fname = (fips + '_' + TEMP_NAME + '_' + 'Sort'
-                        + prev_iter + '_' + piece + '.csv')
     elif process == 'trip_tour':
         input_fname = piece
         output_fname = fips + '_' + 'Module5NN1stRun.csv'
@@ -514,7 +547,9 @@ def sort_files_before_pass(base_path, active_files, iteration):
                     'Node Name': str, 'Node County': str, 'Node Lat': str,
                     'Node Lon': str, 'Node Industry': str, 'XCoord': int,
                     'YCoord': int, 'Segment': int, 'Row': int}
+    county_timer = metrics.county_timer('sort_before_' + iteration)
     for file_info in active_files:
+        county_timer.switch(file_info[0])
         input_fname, output_fname = gen_file_names(file_info, iteration, 'sort_before')
         print('Sorting', base_path + input_fname, 'before pass')
         reader = pd.read_csv(base_path + input_fname, dtype=pandas_dtype)
@@ -522,6 +557,7 @@ def sort_files_before_pass(base_path, active_files, iteration):
                                         'Node Successor', 'Node Type'],
                                     ascending=[True]*5)
         reader.to_csv(base_path + output_fname, index=False, na_rep='NA')
+    county_timer.stop()
 
 def pass_over_files(base_path, active_files, iteration, num_processors):
     """Determines destinations for which the origin is known for every trip in Module 5.
@@ -531,10 +567,6 @@ def pass_over_files(base_path, active_files, iteration, num_processors):
     sorting by Node, then (X,Y) coords, we are able to minimize the number of
     times we need to read in new data and maximize reuse for the patronageWarehouse
     objects.
-    
-    Note also that old files generated by previous iteration are removed 
-    after processing is finished for current iteration as they are no longer
-    needed.
 
     Inputs:
         base_path (str): Partially completed path to Module 5 Output file,
@@ -548,20 +580,26 @@ def pass_over_files(base_path, active_files, iteration, num_processors):
         num_processors (int): Number of processes/CPUs that we will perform
             processing with.
     """
-    
-    state_county_dict = core.state_county_dict()    
-    
+    input_files = [base_path + gen_file_names(file_info, iteration, 'pass')[0]
+                   for file_info in active_files]
+    tracker = progress.Progress('pass_' + iteration,
+                                sum(reading.count_lines(input_file) - 1 for input_file in input_files),
+                                files=len(active_files))
     if num_processors == 1:
-        for file_info in active_files:
-            fips = file_info[0]
-            input_fname, output_fname = gen_file_names(file_info, iteration, 'pass')
-            input_file = base_path + input_fname
-            output_file = base_path + output_fname
-            print("Passing over:", fips, "on iteration:", iteration, "at", datetime.now())
-            find_other_trips.get_other_trip(input_file, output_file, iteration, state_county_dict)
+        with progress.reporting_to(tracker):
+            for file_info in active_files:
+                fips = file_info[0]
+                input_fname, output_fname = gen_file_names(file_info, iteration, 'pass')
+                input_file = base_path + input_fname
+                output_file = base_path + output_fname
+                print("Passing over:", fips, "on iteration:", iteration, "at", datetime.now())
+                find_other_trips.get_other_trip(input_file, output_file, iteration, fips=fips)
+                tracker.file_done()
 
     else:
-        pool = multiprocessing.Pool(num_processors)
+        work_queue = multiprocessing.Queue()
+        pool = multiprocessing.Pool(num_processors, initializer=progress.init_worker,
+                                    initargs=(work_queue,))
         tasks = []
         processing_num = 0
         for file_info in active_files:
@@ -570,70 +608,25 @@ def pass_over_files(base_path, active_files, iteration, num_processors):
             input_file = base_path + input_fname
             output_file = base_path + output_fname
             processing_num += 1
-            tasks.append((input_file, output_file, iteration, state_county_dict, processing_num, fips))
+            tasks.append(('%s-%d-%s' % (fips, processing_num, iteration),
+                          find_other_trips.get_other_trip, input_file, output_file,
+                          iteration, processing_num, fips))
 
-        results = [pool.apply_async(find_other_trips.get_other_trip, t) for t in tasks]
+        results = [pool.apply_async(profiling.profile_call, t) for t in tasks]
 
-        for result in results:
-            num, curr_fips = result.get()
-            print(num, "at", curr_fips, "finished at", datetime.now())
+        while results:
+            tracker.drain(work_queue)
+            for result in [result for result in results if result.ready()]:
+                results.remove(result)
+                num, curr_fips, snapshot = result.get()
+                metrics.merge(snapshot)
+                tracker.file_done()
+                print(num, "at", curr_fips, "finished at", datetime.now())
 
         pool.close()
         pool.join()
-
-    remove_prev_files(base_path, active_files, iteration)
-
-def remove_prev_files(base_path, active_files, iteration):
-    """Removes files from previous iterations that aren't needed anymore.
-
-    Inputs:
-        base_path (str): Partially completed path to Module 5 Output file,
-            including state name.
-        active_files (list): Contains the files we have constructed
-            so far in building initial trip files. Files are denoted by a list
-            containing two elements: the FIPS code for the file and the 
-            split piece (e.g. 1, 2, etc). For non-split files the split
-            piece is always 1.
-        iteration (int): Which iteration of passing we are on (1 or 2).
-    """
-    for file_info in active_files:
-        input_fname, output_fname = gen_file_names(file_info, iteration, 'remove')
-        if iteration == '0' or iteration == '1':
-            try:
-                os.remove(base_path + input_fname)
-            except FileNotFoundError:
-                print(base_path + input_fname, 'does not exist')
-            try:
-                os.remove(base_path + output_fname)
-            except FileNotFoundError:
-                # Only one instance of sort type per FIPS
-                # This is kinda hacky, maybe change later?
-                continue
-        else:
-            try:
-                os.remove(base_path + input_fname)
-            except FileNotFoundError:
-                print(base_path + input_fname, 'does not exist')
-            try:
-                os.remove(base_path + output_fname)
-            except FileNotFoundError:
-                print(base_path + output_fname, 'does not exist')
-
-def remove_merged_files(base_path, merged_files):
-    """Removes merged files after final Module 5 output is generated.
-    
-    Inputs:
-        base_path (str): Partially completed path to Module 5 Output file,
-            including state name.
-        merged_files (list): Contains the files constructed by merging the 
-            node split files together.
-    """
-    for file_info in merged_files:
-        merged_file = file_info[1]
-        try:
-            os.remove(base_path + merged_file)
-        except FileNotFoundError:
-            print(base_path + merged_file, 'does not exist')
+        tracker.drain(work_queue, timeout=0)
+    tracker.finish()
 
 def sort_files_after_pass(base_path, active_files, iteration):
     """Sort files by row and segment after passing through files.
@@ -655,13 +648,16 @@ def sort_files_after_pass(base_path, active_files, iteration):
                     'D Node Name': str, 'D Node County': str, 'D Node Lat': str,
                     'D Node Lon': str, 'D Node Industry': str, 'D XCoord': str,
                     'D YCoord': str}
+    county_timer = metrics.county_timer('sort_after_' + iteration)
     for file_info in active_files:
         fips = file_info[0]
+        county_timer.switch(fips)
         input_fname, output_fname = gen_file_names(file_info, iteration, 'sort_after')
         print("Sorting after pass: ", fips, " on iteration: ", iteration)
         reader = pd.read_csv(base_path + input_fname, dtype=pandas_dtype)
         reader = reader.sort_values(by=['Row', 'Segment'], ascending=[True, True])
         reader.to_csv(base_path + output_fname, index=False, na_rep='NA')
+    county_timer.stop()
 
 def rebuild_trips(base_path, active_files, iteration):
     """Rebuilds trip files for after sorting and passing through files.
@@ -680,7 +676,9 @@ def rebuild_trips(base_path, active_files, iteration):
             the trips.
         iteration (int): Which iteration of passing we are on (1 or 2).
     """
+    county_timer = metrics.county_timer('rebuild_' + iteration)
     for file_info in active_files:
+        county_timer.switch(file_info[0])
         input_fname, output_fname = gen_file_names(file_info, iteration, 'rebuild')
         with open(base_path + input_fname) as read, open(base_path + output_fname, 'w+') as write:
             reader = reading.csv_reader(read)
@@ -702,6 +700,7 @@ def rebuild_trips(base_path, active_files, iteration):
                             row[12] = '1'
                 trailing = row[13:]
                 writer.writerow(row[:13])
+    county_timer.stop()
 
 def construct_personal_info_dict(fips, state):
     """Constructs dictionary of traveller (row) with personal attributes.
@@ -719,17 +718,33 @@ def construct_personal_info_dict(fips, state):
             personal attributes.
     """
     input_file = paths.MODULES[3] + state + 'Module4NN2ndRun.csv'
+    person_dict = dict()
+    if intermediate.get_format() == intermediate.ARROW:
+        # Only the residence county's partition has to be read, row numbers
+        # are offset by every row that comes before it
+        start_row, rows = intermediate.read_partition(input_file, fips)
+        _add_personal_info(person_dict, enumerate(rows, start_row), fips)
+        return person_dict
     with open(input_file) as read:
         reader = reading.csv_reader(read)
         next(reader)
-        person_dict = dict()
-        for count, row in enumerate(reader):
-            row[0], row[1] = row[0].rjust(2, '0'), row[1].rjust(3, '0')
-            fips_code = core.correct_FIPS(row[0] + row[1])
-            if fips == fips_code:
-                person_dict[count] = row[:5] + [row[8]] + [row[11]]
+        _add_personal_info(person_dict, enumerate(reader), fips)
     return person_dict
 
+def _add_personal_info(person_dict, numbered_rows, fips):
+    """Adds personal info of travellers residing in a county to person_dict.
+
+    Inputs:
+        person_dict (dict): See construct_personal_info_dict().
+        numbered_rows (iterator): Pairs of row number and Module 4 row.
+        fips (str): Traveller FIPS code residence.
+    """
+    for count, row in numbered_rows:
+        row[0], row[1] = row[0].rjust(2, '0'), row[1].rjust(3, '0')
+        fips_code = core.correct_FIPS(row[0] + row[1])
+        if fips == fips_code:
+            person_dict[count] = row[:5] + [row[8]] + [row[11]]
+
 def merge_files(base_path, active_files, fips_seen, curr_iter):
     """Merges split node files together to build final Module 5 output files
     
@@ -836,44 +851,105 @@ def find_fips(active_files):
             fips_seen.add(file[0])
     return fips_seen
 
-def main(state, num_processors=1):
+def step_files(base_path, active_files, iteration, process):
+    """Finds the files written by a step of Module 5.
+
+    Inputs:
+        base_path (str): Partially completed path to Module 5 Output file,
+            including state name.
+        active_files (list): Contains the files we have constructed
+            so far in building initial trip files, see gen_file_names().
+        iteration (int): Iteration of processing.
+        process (str): Functionality being performed, see gen_file_names().
+
+    Returns:
+        output_files (list): Paths of the files written by the step.
+    """
+    return [base_path + gen_file_names(file_info, iteration, process)[1]
+            for file_info in active_files]
+
+def step_inputs(base_path, active_files, iteration, process):
+    """Finds the files read by a step of Module 5.
+
+    Each step's input files are consumed by it, i.e. deleted once the
+    step has been recorded as completed.
+
+    Inputs:
+        See step_files().
+
+    Returns:
+        input_files (list): Paths of the files read by the step.
+    """
+    return [base_path + gen_file_names(file_info, iteration, process)[0]
+            for file_info in active_files]
+
+def main(state, num_processors=1, *, resume=False):
     """Builds all trip tours for a U.S. State using Module 4 Output.
 
     Inputs:
         state (str): Module 4 Output state to process.
         num_processors (int): Number of processors to use.
+        resume (bool): Whether to skip steps completed by a previous run,
+            see checkpoint.RunManifest.
     """
     input_path = paths.MODULES[3] + state + 'Module4NN2ndRun.csv'
     output_path = paths.MODULES[4]
     base_path = output_path + state + '_'
     start_time = datetime.now()
+    metrics.reset()
+    manifest = checkpoint.RunManifest(state, 'module5', resume)
     print(state + " started at: " + str(start_time))
     print('Running with', num_processors, 'processors')
+    active_files, median_trip = manifest.run(
+        'build_initial', lambda: build_initial_trip_files(input_path, base_path),
+        outputs=lambda data: step_files(base_path, data[0], '0', 'rebuild'))
     if num_processors > 1:
-        active_files, median_trip = build_initial_trip_files(input_path, base_path, start_time)
-        sort_files_before_pass(base_path, active_files, '0')
-        active_files = load_balance_files(output_path, state, active_files, median_trip)
-    else:
-        active_files = build_initial_trip_files(input_path, base_path, start_time)[0]
+        initial_files = active_files
+        # Load balancing rewrites the initial trip files as split pieces,
+        # so they are not consumed by sorting
+        manifest.run('sort_before_0', lambda: sort_files_before_pass(base_path, initial_files, '0'),
+                     outputs=step_files(base_path, initial_files, '0', 'sort_before'))
+        active_files = manifest.run(
+            'load_balance',
+            lambda: load_balance_files(output_path, state, initial_files, median_trip),
+            outputs=lambda data: step_files(base_path, data, '0', 'rebuild'),
+            consumed=step_files(base_path, initial_files, '0', 'sort_before'))
     for i in range(1, 3):
         current = str(i)
         print('Began sorting before passing on iteration:',
               current, 'at', str(datetime.now()-start_time))
-        sort_files_before_pass(base_path, active_files, current)
+        manifest.run('sort_before_' + current,
+                     lambda: sort_files_before_pass(base_path, active_files, current),
+                     outputs=step_files(base_path, active_files, current, 'sort_before'),
+                     consumed=step_inputs(base_path, active_files, current, 'sort_before'))
         print('Finished sorting before passing on iteration:',
               current, 'at', str(datetime.now()-start_time))
-        pass_over_files(base_path, active_files, current, num_processors)
+        manifest.run('pass_' + current,
+                     lambda: pass_over_files(base_path, active_files, current, num_processors),
+                     outputs=step_files(base_path, active_files, current, 'pass'),
+                     consumed=step_inputs(base_path, active_files, current, 'pass'))
         print('Finished passing over files on iteration:', current,
               'at', str(datetime.now()-start_time))
-        sort_files_after_pass(base_path, active_files, current)
+        manifest.run('sort_after_' + current,
+                     lambda: sort_files_after_pass(base_path, active_files, current),
+                     outputs=step_files(base_path, active_files, current, 'sort_after'),
+                     consumed=step_inputs(base_path, active_files, current, 'sort_after'))
         print('Finished sorting files after passing on iteration:',
               current, 'at', str(datetime.now()-start_time))
-        rebuild_trips(base_path, active_files, current)
+        manifest.run('rebuild_' + current,
+                     lambda: rebuild_trips(base_path, active_files, current),
+                     outputs=step_files(base_path, active_files, current, 'rebuild'),
+                     consumed=step_inputs(base_path, active_files, current, 'rebuild'))
 
     fips_seen = find_fips(active_files)
-    merged_files = merge_files(base_path, active_files, fips_seen, current)
-    build_trip_tours(base_path, state, merged_files, current)
-    remove_prev_files(base_path, active_files, '3')
-    remove_merged_files(base_path, merged_files)
+    merged_files = manifest.run(
+        'merge', lambda: merge_files(base_path, active_files, fips_seen, current),
+        outputs=lambda data: [base_path + file_info[1] for file_info in data],
+        consumed=step_files(base_path, active_files, current, 'rebuild'))
+    manifest.run('trip_tours',
+                 lambda: build_trip_tours(base_path, state, merged_files, current),
+                 outputs=step_files(base_path, merged_files, current, 'trip_tour'),
+                 consumed=step_inputs(base_path, merged_files, current, 'trip_tour'))
 
     print(state + " took: " + str(datetime.now() - start_time))
+    metrics.write_report('module5', state)
@@ -0,0 +1,104 @@
+'''
+Module for regrouping rows by a key with bounded memory.
+
+Rows are held in memory per key and appended to a spill file per key
+whenever the rows held in memory exceed a memory limit. Each partition
+returns its rows in the order they were added, and partitions are read
+back in the order sort_by_input_column() would sort their keys, so
+reading every partition is equivalent to a stable sort by the key.
+'''
+
+import os
+import shutil
+import tempfile
+from ..utils import reading, writing, external_sort, intermediate, metrics
+
+class PartitionSpiller:
+    """Groups rows by key, spilling them to disk when memory runs out.
+
+    Attributes:
+        temp_dir (str): Directory holding the spill files.
+        memory_limit (int): Approximate number of bytes of rows held in
+            memory across all partitions.
+        buffers (dict): Rows of each partition held in memory.
+        spilled (set): Keys of partitions with a spill file.
+        size (int): Approximate number of bytes of rows held in memory.
+        spills (int): Number of times rows were spilled to disk.
+        rows (int): Number of rows added.
+    """
+
+    def __init__(self, temp_dir=None, memory_limit=external_sort.DEFAULT_MEMORY_LIMIT):
+        """See class docstring."""
+        self.temp_dir = tempfile.mkdtemp(prefix='partitions_', dir=temp_dir)
+        self.memory_limit = memory_limit
+        self.buffers = dict()
+        self.spilled = set()
+        self.size = 0
+        self.spills = 0
+        self.rows = 0
+
+    def add(self, key, row):
+        """Adds a row to the partition of a key.
+
+        Values are converted to str, as they would be by a round trip
+        through a .csv file.
+
+        Inputs:
+            key (str): Partition key.
+            row (list): Row to add.
+        """
+        row = [value if isinstance(value, str) else intermediate.to_str(value)
+               for value in row]
+        self.buffers.setdefault(key, []).append(row)
+        self.rows += 1
+        self.size += external_sort.estimate_row_size(row)
+        if self.size >= self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        """Appends the rows held in memory to the spill file of their partition."""
+        for key, rows in self.buffers.items():
+            with open(self.spill_file(key), 'a') as write:
+                writing.csv_writer(write).writerows(rows)
+            self.spilled.add(key)
+        self.buffers = dict()
+        self.size = 0
+        self.spills += 1
+        metrics.counter('partition_spills').inc()
+
+    def spill_file(self, key):
+        """Returns the path of the spill file of a partition."""
+        return os.path.join(self.temp_dir, 'partition_' + str(key) + '.csv')
+
+    def keys(self):
+        """Returns every partition key, in sorted order."""
+        keys = set(self.buffers) | self.spilled
+        return sorted(keys, key=external_sort.sort_key)
+
+    def read(self, key):
+        """Returns every row of a partition and removes the partition.
+
+        Inputs:
+            key (str): Partition key.
+
+        Returns:
+            rows (generator): Rows of the partition, in the order added.
+        """
+        if key in self.spilled:
+            self.spilled.discard(key)
+            file_name = self.spill_file(key)
+            with open(file_name) as read:
+                yield from reading.csv_reader(read)
+            os.remove(file_name)
+        rows = self.buffers.pop(key, [])
+        self.size -= sum(map(external_sort.estimate_row_size, rows))
+        yield from rows
+
+    def __iter__(self):
+        """Returns every row of every partition, in sorted key order."""
+        for key in self.keys():
+            yield from self.read(key)
+
+    def close(self):
+        """Removes every spill file."""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
@@ -0,0 +1,158 @@
+'''
+pipeline.py
+
+Purpose: Runs Modules 2, 3 and 4 for a state as one streaming pipeline,
+without writing the intermediate files the modules hand to each other.
+
+Every person flows through the per-person steps of the modules as a
+chain of generators. Only the two steps that need persons regrouped read
+them back from partitions, which are held in memory and spilled to disk
+only when they outgrow the memory limit:
+
+    1. Module 1 rows, grouped by residence county, are assigned a work
+       county (Module 2) and a school type and county (Module 3). Workers
+       are partitioned by work county, non-workers by school county.
+    2. Workers, by work county, are assigned an employer (Module 2) and
+       partitioned by school county.
+    3. Persons, by school county, are assigned a school (Module 3) and an
+       activity pattern (Module 4), and written to the Module 4 output.
+
+This replaces the separate, sorted and merged files of Module 2, the
+sorted and assigned files of Module 3 and the Module 3 output with two
+regroupings. The output has the same columns as the Module 4 output, but
+rows are ordered by school county and residents are drawn in a different
+order, so results are statistically equivalent rather than identical.
+
+Run with:
+    python module_runner.py -m pipeline -s STATE
+'''
+
+import collections
+from datetime import datetime
+from . import partitions
+from ..module2 import module2, adjacency, industry
+from ..module3 import assign_county, school_assigner
+from ..module4 import module4
+from ..utils import reading, paths, core, intermediate, checkpoint, metrics, memory
+
+# Column holding the work county FIPS code, see module2.assign_work_counties()
+WORK_COUNTY_INDEX = 15
+# Number of Module 2 columns before the employer is assigned
+WORK_COUNTY_COLUMNS = 16
+
+def assign_residence_steps(state, input_file, work_partitions, school_partitions):
+    """Runs every step that only depends on a person's residence county.
+
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        input_file (str): Path to the Module 1 output file.
+        work_partitions (PartitionSpiller): Gets workers, keyed by work county,
+            with their school county, type1 and type2 appended.
+        school_partitions (PartitionSpiller): Gets non-workers, keyed by
+            school county, in the Module 3 school county file format.
+    """
+    j2w = adjacency.read_j2w()
+    memory.checkpoint(memory.REFERENCE, 'j2w')
+    type_assigner = assign_county.AssignType(state)
+    with open(input_file) as read:
+        reader = reading.csv_reader(read)
+        next(reader)
+        total = reading.count_lines(input_file) - 1
+        persons = module2.assign_work_counties(reader, j2w, total)
+        for person, school_fields in assign_county.school_county_draws(persons, type_assigner,
+                                                                       total=total):
+            if person[WORK_COUNTY_INDEX] == '-1':
+                school_partitions.add(school_fields[0], module2.non_worker_row(person) + school_fields)
+            else:
+                work_partitions.add(person[WORK_COUNTY_INDEX], person + school_fields)
+
+def assign_employer_step(work_partitions, school_partitions):
+    """Assigns every worker an employer, by work county.
+
+    Inputs:
+        work_partitions (PartitionSpiller): See assign_residence_steps().
+        school_partitions (PartitionSpiller): Gets workers, keyed by school
+            county, in the Module 3 school county file format.
+    """
+    inc_emp = industry.read_employment_income_by_industry()
+    memory.checkpoint(memory.REFERENCE, 'income_employment')
+    # School fields are set aside while the employer columns are appended
+    school_fields = collections.deque()
+
+    def workers():
+        for row in work_partitions:
+            school_fields.append(row[WORK_COUNTY_COLUMNS:])
+            yield row[:WORK_COUNTY_COLUMNS]
+
+    for worker in module2.assign_employers(workers(), inc_emp, work_partitions.rows):
+        fields = school_fields.popleft()
+        school_partitions.add(fields[0], worker + fields)
+
+def assign_school_steps(state, school_partitions, output_file, start_time):
+    """Assigns every person a school and an activity pattern, by school county.
+
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        school_partitions (PartitionSpiller): See assign_employer_step().
+        output_file (str): Path to the Module 4 output file.
+        start_time (datetime): Time processing started.
+    """
+    states = core.read_states(spaces=False)
+    state_abbrev = core.match_name_abbrev(states, state)
+    samplers = module4.build_activity_pattern_samplers(module4.read_activity_pattern_dists())
+    state_county_dict = core.state_county_dict()
+    counts = {'count': 0, 'school_fixes': 0, 'school_issue': 0}
+    tot_dist = []
+    with intermediate.open_writer(output_file) as writer:
+        module4.write_headers(writer)
+        students = school_assigner.assign_schools(school_partitions, state, state_abbrev, tot_dist,
+                                                  school_partitions.rows)
+        writer.writerows(module4.assign_activity_patterns(students, samplers, state_county_dict,
+                                                          counts, school_partitions.rows))
+    school_assigner.write_distances(state, tot_dist)
+    module4.print_summary(state, start_time, counts)
+
+def main(state, *, resume=False):
+    """Runs Modules 2, 3 and 4 for a state.
+
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        resume (bool): Whether to skip the state if a previous run
+            completed it, see checkpoint.RunManifest.
+    """
+    output_file = paths.MODULES[3] + state + 'Module4NN2ndRun.csv'
+    metrics.reset()
+    manifest = checkpoint.RunManifest(state, 'pipeline', resume)
+    manifest.run('pipeline', lambda: run_steps(state, output_file),
+                 outputs=[intermediate.file_path(output_file)])
+    metrics.write_report('pipeline', state)
+
+def run_steps(state, output_file):
+    """Runs every step of the pipeline for a state.
+
+    Inputs:
+        state (str): Alphabetical state name with no spaces.
+        output_file (str): Path to the Module 4 output file.
+    """
+    start_time = datetime.now()
+    print(state + " started at: " + str(start_time))
+    input_file = paths.MODULES[0] + state + 'Module1NN2ndRun.csv'
+    work_partitions = partitions.PartitionSpiller(paths.MODULES[3])
+    school_partitions = partitions.PartitionSpiller(paths.MODULES[3])
+    try:
+        print('Assigning work counties and school counties')
+        with metrics.step('residence_steps'):
+            assign_residence_steps(state, input_file, work_partitions, school_partitions)
+        memory.checkpoint(memory.PHASE, 'residence_steps')
+        print('Assigning workers to employers')
+        with metrics.step('employer_step'):
+            assign_employer_step(work_partitions, school_partitions)
+        memory.checkpoint(memory.PHASE, 'employer_step')
+        print('Assigning students to schools and activity patterns')
+        with metrics.step('school_steps'):
+            assign_school_steps(state, school_partitions, output_file, start_time)
+    finally:
+        work_partitions.close()
+        school_partitions.close()
+    print('Pipeline for the state of ' + state + ' took this long: '
+          + str(datetime.now() - start_time))
@@ -0,0 +1,222 @@
+'''
+Module for checkpointing the steps of a long state run.
+
+A run manifest is kept per state and stage (module) in a .json file. Every
+completed step is recorded with the size and modification time of the
+files it wrote, any data needed to continue from it, and the files
+it consumed. Consumed files are deleted by the manifest once the step is
+recorded, so intermediate files are only removed after the step using
+them has completed.
+
+When resuming, completed steps are skipped as long as the files they
+wrote are unchanged, or were consumed or rewritten by a later step that
+can be skipped itself, and the run continues from the first incomplete
+step. Every step after it is run again, even if it was completed before.
+'''
+
+import os
+import json
+import shutil
+from datetime import datetime
+from . import paths, metrics, memory
+
+MANIFEST_VERSION = 2
+
+def manifest_path(state, stage):
+    """Returns the path of the run manifest of a state and stage."""
+    return paths.OUTPUT + 'Checkpoints/' + state + '_' + stage + '.json'
+
+def file_stamp(path):
+    """Returns the size and modification time of a file or directory.
+
+    For directories, the size and latest modification time of every file
+    in the directory are used.
+    """
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(root, name)) for root, _, names in os.walk(path)
+                 for name in names]
+        return {'size': sum(stat.st_size for stat in stats),
+                'mtime': max([stat.st_mtime for stat in stats], default=0.0)}
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def remove_path(path):
+    """Removes a file or directory, if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class RunManifest:
+    """Records completed steps of a stage for a state.
+
+    Attributes:
+        state (str): State name, without spaces.
+        stage (str): Stage name, usually the module name.
+        resume (bool): Whether steps completed by a previous run are skipped.
+        path (str): Path of the manifest file.
+        steps (dict): Associates each completed step with its record.
+        resuming (bool): Whether no incomplete step was found yet, i.e.
+            whether completed steps can still be skipped.
+    """
+
+    def __init__(self, state, stage, resume=False):
+        """Loads the manifest of a previous run when resuming, or starts a new one."""
+        self.state = state
+        self.stage = stage
+        self.resume = resume
+        self.path = manifest_path(state, stage)
+        self.steps = dict()
+        self.resuming = resume
+        if resume:
+            try:
+                with open(self.path) as read:
+                    manifest = json.load(read)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    self.steps = manifest['steps']
+            except (OSError, ValueError):
+                print('No run manifest to resume from at', self.path)
+        if not self.steps:
+            self.resuming = False
+        self.save()
+
+    def save(self):
+        """Writes the manifest, replacing the previous one atomically."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as write:
+            json.dump({'version': MANIFEST_VERSION, 'state': self.state,
+                       'stage': self.stage, 'steps': self.steps}, write, indent=2)
+        os.replace(temp_path, self.path)
+
+    def is_complete(self, step):
+        """Whether a step can be skipped.
+
+        A step can be skipped when resuming, if it was completed, no earlier
+        step had to be run again, and the files it wrote are unchanged, see
+        step_valid().
+
+        Inputs:
+            step (str): Name of the step.
+        """
+        if not self.resuming:
+            return False
+        record = self.steps.get(step)
+        if record is None or not self.step_valid(step, dict()):
+            print('Resuming', self.stage, 'for', self.state, 'from step', step)
+            self.resuming = False
+            # Steps from here on are run again, so their records are dropped
+            if step in self.steps:
+                steps = list(self.steps)
+                for later_step in steps[steps.index(step):]:
+                    del self.steps[later_step]
+                self.save()
+            return False
+        return True
+
+    def step_valid(self, step, checked):
+        """Whether a completed step does not have to be run again.
+
+        Every file the step wrote must be unchanged, unless a later step
+        that consumed or rewrote it is valid itself. A file consumed by a
+        step that has to be run again is needed again, but is gone, so the
+        step that wrote it has to be run again as well.
+
+        Inputs:
+            step (str): Name of the step.
+            checked (dict): Associates steps already checked with whether
+                they are valid.
+        """
+        if step not in checked:
+            checked[step] = False
+            record = self.steps.get(step)
+            checked[step] = record is not None and all(
+                self.output_valid(path, stamp, checked)
+                for path, stamp in record['outputs'].items())
+        return checked[step]
+
+    def output_valid(self, path, stamp, checked):
+        """Whether a file written by a step is unchanged, or was replaced by a valid step.
+
+        Inputs:
+            path (str): Path of the file or directory.
+            stamp (dict): Record of the file, see complete().
+            checked (dict): See step_valid().
+        """
+        try:
+            current = file_stamp(path)
+        except OSError:
+            current = None
+        if (current is not None and current['size'] == stamp['size']
+                and current['mtime'] == stamp['mtime']):
+            return True
+        return any(self.step_valid(stamp[later], checked)
+                   for later in ('superseded', 'consumed') if later in stamp)
+
+    def complete(self, step, outputs=(), consumed=(), data=None):
+        """Records a completed step, then deletes the files it consumed.
+
+        Inputs:
+            step (str): Name of the step.
+            outputs (list): Paths of the files or directories the step wrote.
+            consumed (list): Paths of files no longer needed after the step.
+            data: JSON serializable data needed to continue from the step.
+        """
+        outputs, consumed = list(outputs), list(consumed)
+        written, removed = set(outputs), set(consumed)
+        # Earlier records name the step that rewrote or consumed their files
+        for record in self.steps.values():
+            for path, stamp in record['outputs'].items():
+                if path in written:
+                    stamp['superseded'] = step
+                if path in removed:
+                    stamp['consumed'] = step
+        record = {'completed': str(datetime.now()), 'outputs': dict(), 'data': data}
+        for path in outputs:
+            record['outputs'][path] = file_stamp(path)
+        self.steps[step] = record
+        self.save()
+        for path in consumed:
+            remove_path(path)
+
+    def data(self, step):
+        """Returns the data recorded with a completed step."""
+        return self.steps[step]['data']
+
+    def run(self, step, function, outputs=(), consumed=()):
+        """Runs a step, unless it can be skipped, timing it in the run metrics.
+
+        The memory used is recorded after the step, if memory accounting
+        is on, see memory.checkpoint().
+
+        Inputs:
+            step (str): Name of the step.
+            function (function): Runs the step without arguments. Its return
+                value is recorded as the data of the step, so must be JSON
+                serializable.
+            outputs (list or function): See complete(). May also be a
+                function returning the outputs from the data of the step,
+                for steps whose outputs are only known once they have run.
+            consumed (list): See complete().
+
+        Returns:
+            data: Return value of function, or the data recorded when the
+                step was completed by a previous run.
+        """
+        if self.is_complete(step):
+            print('Skipping completed step', step, 'of', self.stage, 'for', self.state)
+            # Consumed files may be left over if the previous run stopped
+            # right after recording the step
+            for path in consumed:
+                remove_path(path)
+            return self.data(step)
+        with metrics.step(step):
+            data = function()
+        if callable(outputs):
+            outputs = outputs(data)
+        self.complete(step, outputs, consumed, data)
+        memory.checkpoint(memory.PHASE, step)
+        return data
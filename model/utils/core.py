@@ -1,9 +1,46 @@
 import os
+import pickle
 import subprocess
-from . import paths, reading
+from . import paths, reading, external_sort, refdata, metrics
 
-def sort_by_input_column(input_path, input_file, sort_column, output_path, output_file):
-   """Sort a file by a specified column.
+# On-disk cache of the county-fips dictionaries, see load_county_dicts()
+COUNTY_DICT_CACHE = 'countyfips_dicts.pickle'
+# Process-level cache of the county-fips dictionaries
+_COUNTY_DICTS = None
+# Process-level CountyNameResolver, with the data root it was built from
+_COUNTY_NAME_RESOLVER = None
+
+def sort_by_input_column(input_path, input_file, sort_column, output_path, output_file,
+                         memory_limit=external_sort.DEFAULT_MEMORY_LIMIT, temp_dir=None):
+    """Sort a file by a specified column.
+
+    Uses a stable out-of-core merge sort, so the whole file is never held
+    in memory. Column numbering follows the R convention used by
+    sort_by_input_column.r, i.e. the first column is '1'.
+
+    Inputs:
+        input_path (str): Path to input file.
+        input_file (str): Input file name.
+        sort_column (str or list): Numeric column to sort, or a list of
+            columns in order of precedence.
+        output_path (str): Path to output file.
+        output_file: Output file name.
+        memory_limit (int): Approximate number of bytes of rows held in
+            memory for a single sorted run.
+        temp_dir (str): Directory for sorted runs. Defaults to output_path.
+    """
+    if isinstance(sort_column, (str, int)):
+        sort_column = [sort_column]
+    key_columns = [int(column) - 1 for column in sort_column]
+    if temp_dir is None:
+        temp_dir = output_path
+    external_sort.sort_csv(input_path + input_file, output_path + output_file, key_columns,
+                           memory_limit=memory_limit, temp_dir=temp_dir)
+
+def r_sort_by_input_column(input_path, input_file, sort_column, output_path, output_file):
+   """Sort a file by a specified column using Rscript.
+
+   Kept as a reference implementation for benchmarking sort_by_input_column.
 
    Inputs:
        input_path (str): Path to input file.
@@ -51,11 +88,13 @@ def lookup_name(county_name, code, name_data):
     """Match County Name from EMP file to County Name in FIPS Related Data.
     
     This string comparison is slow and should only be used when a mapping between
-    zip code to fips code does not exist.
+    zip code to fips code does not exist. CountyNameResolver gives the same
+    answers in constant time and should be preferred for repeated lookups.
     
     Inputs:
         county_name (str): Name of the county.
         code (str): Two digit state code corresponding to state.
+        name_data (list): County data, see read_counties().
     
     Returns:
         fips_code (str): A FIPS code for a county.
@@ -70,13 +109,137 @@ def lookup_name(county_name, code, name_data):
                 return county[0]
         elif len(county[1]) == 3 and len(splitter) > 2:
             if splitter[0] == county[1][0] and splitter[1] == county[1][1] and splitter[2] == county[1][2]:
-                if [0][0:2] == code:
+                if county[0][0:2] == code:
                     return county[0]
         elif len(county[1]) > 3 and len(splitter) > 1:
             if splitter[0] == county[1][0] and splitter[1] == county[1][1]:
                 if county[0][0:2] == code:
                     return county[0]
 
+class CountyNameResolver:
+    """Resolves county names to FIPS codes in constant time.
+
+    Gives the same answers as lookup_name(), but instead of scanning every
+    county it looks up the space-split tokens of a county name in a hash
+    index of token prefixes, built once per state code. For every key of
+    the index only the first county in file order is kept, which is the
+    county lookup_name() would have returned. Results, including misses,
+    are memoized.
+
+    Attributes:
+        state_county_dict (dict): See state_county_dict(). Used for exact
+            name matches before falling back to the token index.
+        state_codes (dict): Associates state abbrevation with state code.
+        index (dict): Each key is a two digit state code, that maps to a
+            dictionary associating token prefix keys with the file position
+            and FIPS code of the first matching county.
+        cache (dict): Memoized lookups, keyed by county name and state code.
+        hits, misses (metrics.Counter): Memoized lookups found and not
+            found in the cache.
+        fallbacks (metrics.Counter): Names resolved through the token
+            index rather than an exact match.
+    """
+
+    def __init__(self, name_data=None, state_county_dict=None, state_codes=None):
+        """Builds the token prefix index.
+
+        Inputs:
+            name_data (list): County data, see read_counties(). Read from
+                allCounties.csv if not provided.
+            state_county_dict (dict): See state_county_dict().
+            state_codes (dict): See state_code_dict().
+        """
+        if name_data is None:
+            name_data = read_counties()
+        self.state_county_dict = state_county_dict
+        self.state_codes = state_codes
+        self.index = dict()
+        self.cache = dict()
+        self.track()
+        for position, county in enumerate(name_data):
+            fips, tokens = county[0], county[1]
+            state_index = self.index.setdefault(fips[0:2], dict())
+            entry = (position, fips)
+            state_index.setdefault((1, tokens[0]), entry)
+            if len(tokens) >= 2:
+                state_index.setdefault((2, tokens[0], tokens[1]), entry)
+            if len(tokens) == 3:
+                state_index.setdefault((3, tokens[0], tokens[1], tokens[2]), entry)
+            elif len(tokens) > 3:
+                state_index.setdefault((4, tokens[0], tokens[1]), entry)
+
+    def track(self):
+        """Counts lookups in the current metrics registry, see metrics.reset()."""
+        self.hits = metrics.counter('cache_hits', cache='county_name')
+        self.misses = metrics.counter('cache_misses', cache='county_name')
+        self.fallbacks = metrics.counter('fallbacks', kind='county_name_lookup')
+
+    def lookup(self, county_name, code):
+        """Match County Name from EMP file to County Name in FIPS Related Data.
+
+        Inputs:
+            county_name (str): Name of the county.
+            code (str): Two digit state code corresponding to state.
+
+        Returns:
+            fips_code (str): A FIPS code for a county, or None if no
+                county matches.
+        """
+        key = (county_name, code)
+        if key not in self.cache:
+            self.misses.inc()
+            self.cache[key] = self._lookup_tokens(county_name.strip('"').split(' '), code)
+        else:
+            self.hits.inc()
+        return self.cache[key]
+
+    def _lookup_tokens(self, splitter, code):
+        """Looks up the tokens of a county name in the index of a state.
+
+        Single token names match the first token of a county, two token
+        names match the first two tokens, and longer names match either a
+        three token county exactly or the first two tokens of a county with
+        more than three tokens, whichever comes first in the county data.
+
+        Inputs:
+            splitter (list): Space-split tokens of the county name.
+            code (str): Two digit state code corresponding to state.
+
+        Returns:
+            fips_code (str): A FIPS code for a county, or None.
+        """
+        state_index = self.index.get(code, {})
+        if len(splitter) == 1:
+            candidates = [state_index.get((1, splitter[0]))]
+        elif len(splitter) == 2:
+            candidates = [state_index.get((2, splitter[0], splitter[1]))]
+        else:
+            candidates = [state_index.get((3, splitter[0], splitter[1], splitter[2])),
+                          state_index.get((4, splitter[0], splitter[1]))]
+        candidates = [entry for entry in candidates if entry is not None]
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def resolve(self, county_name, state_abbrev):
+        """Resolves a county name within a state to a FIPS code.
+
+        Exact matches in state_county_dict are used first, with the token
+        index as a fallback for unusual county spellings.
+
+        Inputs:
+            county_name (str): Name of the county.
+            state_abbrev (str): 2 character state abbrevation.
+
+        Returns:
+            fips_code (str): A FIPS code for a county, or None.
+        """
+        try:
+            return self.state_county_dict[state_abbrev][county_name]
+        except (KeyError, TypeError):
+            self.fallbacks.inc()
+            return self.lookup(county_name, self.state_codes[state_abbrev])
+
 def read_states(spaces=True):
     """Reads in state data.
     
@@ -85,6 +248,13 @@ def read_states(spaces=True):
             element is a list of the form 'STATE_NAME', 
             'STATE_ABBREV', 'STATE_CODE'.
     """
+    bundle = refdata.load()
+    if bundle is not None:
+        lines = bundle.states()
+        if spaces is False:
+            for row in lines:
+                row[0] = ''.join(row[0].split())
+        return lines
     file_path = paths.MAIN_DRIVE + '/'
     file = file_path + 'ListofStates.csv'
     with open(file) as file:
@@ -103,13 +273,9 @@ def state_code_dict():
         states_code_dict (dict): Associates state abbrevation with 
             state code.
     """
-    file_path = paths.MAIN_DRIVE + '/'
-    file = file_path + 'ListofStates.csv'
     state_code_dict = dict()
-    with open(file) as file:
-       reader = reading.csv_reader(file)
-       for row in reader:
-           state_code_dict[row[1]] = row[2]
+    for row in read_states():
+        state_code_dict[row[1]] = row[2]
     return state_code_dict
 
 def read_states_no_alaska():
@@ -138,6 +304,9 @@ def read_counties():
              FIPS code associated with a county, and the second element
              is the county name associated with that FIPS code.
     """
+    bundle = refdata.load()
+    if bundle is not None:
+        return bundle.counties()
     file_path = paths.WORKFLOW + 'allCounties.csv'
     name_data = []
     with open(file_path) as read:
@@ -204,6 +373,157 @@ def cdf(weights):
         cdf.append(cumsum/total)
     return cdf
 
+def county_names(abbrev, name):
+    """Lists the names a county from countyfips.csv is known by.
+
+    Applies the per-state naming quirks of the employment and school data,
+    e.g. Alaska boroughs, Louisiana parishes, Virginia cities and the
+    DeKalb/DeSoto variants. Names are listed in the order they should be
+    inserted into a county-fips dictionary.
+
+    Inputs:
+        abbrev (str): A 2 character state abbrevation.
+        name (str): County name as given in countyfips.csv.
+
+    Returns:
+        names (list): Every name the county is known by.
+    """
+    names = []
+    if abbrev == 'DC':
+        names.append(name)
+    if abbrev == 'AK':
+        if 'Census Area' in name:
+            names.append(name.partition(' Census Area')[0])
+        elif 'Borough' in name:
+            if 'City and Borough' in name:
+                names.append(name.partition(' City and Borough')[0])
+            else:
+                names.append(name.partition(' Borough')[0])
+        elif 'Municipality' in name:
+            names.append(name.partition(' Municipality')[0])
+    if abbrev == 'IL':
+        if 'Dekalb' in name:
+            names.append('Dekalb')
+        else:
+            names.append(name.partition(' County')[0])
+    if abbrev == 'FL':
+        if 'DeSoto' in name:
+            names.append('De Soto')
+        else:
+            names.append(name.partition(' County')[0])
+    if abbrev == 'GA':
+        if 'DeKalb' in name:
+            names.append('De Kalb')
+            names.append('Dekalb')
+        else:
+            names.append(name.partition(' County')[0])
+    if abbrev == 'MD':
+        if 'Baltimore City' in name:
+            names.append('Baltimore City')
+        else:
+            names.append(name.partition(' County')[0])
+    if abbrev == 'LA':
+        if 'Parish' in name:
+            names.append(name.partition(' Parish')[0])
+            if 'Baptist' in name:
+                names.append('St John The Baptist')
+        else:
+            names.append(name.partition(' County')[0])
+    # Every state other than Virginia also gets the plain county name
+    if abbrev == 'VA':
+        if 'City' in name:
+            names.append(name)
+            names.append(name.partition(' County')[0])
+        else:
+            names.append(name.partition(' County')[0])
+    else:
+        names.append(name.partition(' County')[0])
+    return names
+
+def read_county_dicts():
+    """Builds county-fips dictionaries for every state in one file pass.
+
+    Returns:
+        county_dicts (dict): Each key is a state abbrevation, that maps to
+            another dictionary with every county for that state, with key
+            as county name and value county FIPS code.
+    """
+    file = paths.MAIN_DRIVE + '/' + 'countyfips.csv'
+    county_dicts = dict()
+    with open(file) as read:
+        reader = reading.csv_reader(read)
+        for row in reader:
+            counties = county_dicts.setdefault(row[0], dict())
+            for name in county_names(row[0], row[3]):
+                counties[name] = row[1] + row[2]
+    return county_dicts
+
+def county_dict_sources():
+    """Lists the files the county-fips dictionaries are built from."""
+    return [paths.MAIN_DRIVE + '/' + 'countyfips.csv',
+            paths.MAIN_DRIVE + '/' + 'ListofStates.csv']
+
+def load_county_dicts():
+    """Loads the county-fips dictionaries of every state, with caching.
+
+    Dictionaries are built once per process. They are also pickled next
+    to countyfips.csv, so that later processes only rebuild them when one
+    of the source files has been modified.
+
+    Returns:
+        county_dicts (dict): See read_county_dicts(). Shared between
+            callers, so should not be modified.
+    """
+    global _COUNTY_DICTS
+    if _COUNTY_DICTS is not None:
+        return _COUNTY_DICTS
+    mtimes = [os.path.getmtime(source) for source in county_dict_sources()]
+    cache_file = paths.MAIN_DRIVE + '/' + COUNTY_DICT_CACHE
+    try:
+        with open(cache_file, 'rb') as read:
+            cached = pickle.load(read)
+        if cached['mtimes'] == mtimes:
+            _COUNTY_DICTS = cached['county_dicts']
+            return _COUNTY_DICTS
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    county_dicts = read_county_dicts()
+    # Written under a temporary name and renamed, so that states run in
+    # parallel never read a partly written cache
+    temp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temp_file, 'wb') as write:
+            pickle.dump({'mtimes': mtimes, 'county_dicts': county_dicts}, write,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        print('Could not write county dictionary cache to', cache_file)
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+    _COUNTY_DICTS = county_dicts
+    return _COUNTY_DICTS
+
+def county_name_resolver():
+    """Returns the CountyNameResolver of this process, built on first use.
+
+    The resolver and its memoized lookups are kept for the life of the
+    process, and rebuilt only if the data root changes. Lookups are
+    counted in the current metrics registry, which may have been reset
+    since the last call.
+
+    Returns:
+        resolver (CountyNameResolver): Shared between callers.
+    """
+    global _COUNTY_NAME_RESOLVER
+    if _COUNTY_NAME_RESOLVER is None or _COUNTY_NAME_RESOLVER[0] != paths.MAIN_DRIVE:
+        resolver = CountyNameResolver(read_counties(), state_county_dict(), state_code_dict())
+        _COUNTY_NAME_RESOLVER = (paths.MAIN_DRIVE, resolver)
+    else:
+        _COUNTY_NAME_RESOLVER[1].track()
+    return _COUNTY_NAME_RESOLVER[1]
+
 def state_county_dict():
     """Creates state-county-fips dictionary mapping.
      
@@ -212,15 +532,8 @@ def state_county_dict():
             maps to another dictionary with every county for that state,
             with key as county name and value county FIPS code.
     """
-    file = paths.MAIN_DRIVE + '/' + 'ListofStates.csv'
-    with open(file) as read:
-        reader = reading.csv_reader(read)
-        states = []
-        county_dicts = []
-        for row in reader:
-            county_dicts.append(county_dict(row[1]))
-            states.append(row[1])
-    return dict(zip(states, county_dicts))
+    county_dicts = load_county_dicts()
+    return {row[1]: county_dicts.get(row[1], dict()) for row in read_states()}
 
 def county_dict(abbrev):
     """Creates county-fips dictionary mapping.
@@ -232,80 +545,4 @@ def county_dict(abbrev):
         county-fips (dict): Each key is a county name, with value the
             FIPS code for that county.
     """
-    file = paths.MAIN_DRIVE + '/' + 'countyfips.csv'
-    with open(file) as read:
-        reader = reading.csv_reader(read)
-        counties = []
-        county_codes = []
-        for row in reader:
-            if row[0] == abbrev:
-                if abbrev == 'DC':
-                    counties.append(row[3])
-                    county_codes.append(row[1]+row[2])
-                if abbrev == 'AK':
-                    if 'Census Area' in row[3]:
-                        counties.append(row[3].partition(' Census Area')[0])
-                        county_codes.append(row[1]+row[2])
-                    elif 'Borough' in row[3]:
-                        if 'City and Borough' in row[3]:
-                            counties.append(row[3].partition(' City and Borough')[0])
-                            county_codes.append(row[1]+row[2])
-                        else:
-                            counties.append(row[3].partition(' Borough')[0])
-                            county_codes.append(row[1]+row[2])
-                    elif 'Municipality' in row[3]:
-                        counties.append(row[3].partition(' Municipality')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'IL':
-                    if 'Dekalb' in row[3]:
-                        counties.append('Dekalb')
-                        county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'FL':
-                    if 'DeSoto' in row[3]:
-                        counties.append('De Soto')
-                        county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'GA':
-                    if 'DeKalb' in row[3]:
-                        counties.append('De Kalb')
-                        county_codes.append(row[1]+row[2])
-                        counties.append('Dekalb')
-                        county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'MD':
-                    if 'Baltimore City' in row[3]:
-                        counties.append('Baltimore City')
-                        county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'LA':
-                    if 'Parish' in row[3]:
-                        counties.append(row[3].partition(' Parish')[0])
-                        county_codes.append(row[1]+row[2])
-                        if 'Baptist' in row[3]:
-                            counties.append('St John The Baptist')
-                            county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                if abbrev == 'VA':
-                    if 'City' in row[3]:
-                        counties.append(row[3])
-                        county_codes.append(row[1]+row[2])
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                    else:
-                        counties.append(row[3].partition(' County')[0])
-                        county_codes.append(row[1]+row[2])
-                else:
-                    counties.append(row[3].partition(' County')[0])
-                    county_codes.append(row[1]+row[2])
-    return dict(zip(counties, county_codes))
\ No newline at end of file
+    return load_county_dicts().get(abbrev, dict())
\ No newline at end of file
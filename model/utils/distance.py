@@ -2,6 +2,7 @@
 Module for distance related functionality. 
 '''
 import math
+import numpy as np
 
 # equitorial radius of the earth, in miles
 RADIUS = 3963.167
@@ -62,4 +63,71 @@ def between_pixels(x1, y1, x2, y2):
         dist = 0.25
     else:
         dist = math.sqrt((x2-x1)**2 + (y2-y1)**2)
-    return dist
\ No newline at end of file
+    return dist
+
+def to_cart_batch(lat, lon):
+    """Converts arrays of lat, lon coordinates to cartesian coordinates.
+
+    Array version of to_cart().
+
+    Inputs:
+        lat, lon (array_like): Coordinate pairs.
+
+    Returns:
+        x, y, z (ndarray): Cartesian transformation.
+    """
+    degrees_to_radians = math.pi/180.0
+    lat_rad = np.asarray(lat, dtype=float) * degrees_to_radians
+    lon_rad = np.asarray(lon, dtype=float) * degrees_to_radians
+    x = RADIUS * np.cos(lat_rad) * np.cos(lon_rad)
+    y = RADIUS * np.cos(lat_rad) * np.sin(lon_rad)
+    z = RADIUS * np.sin(lat_rad)
+    return x, y, z
+
+def between_points_batch(lat1, lon1, lat2, lon2):
+    """Computes great circle distances between arrays of lat-lon pairs.
+
+    Array version of between_points(). Inputs are broadcast against each
+    other, so a single origin can be compared against many destinations.
+
+    Inputs:
+        lat1, lon1 (array_like): First coordinate pairs.
+        lat2, lon2 (array_like): Second coordinate pairs.
+
+    Returns:
+        dist (ndarray): Great circle distances between the points.
+
+    Raises:
+        ValueError: If rounding puts the cosine of any arc outside of
+            [-1, 1], e.g. for some identical points, as math.acos() does
+            in between_points().
+    """
+    degrees_to_radians = math.pi/180.0
+    phi1 = (90.0 - np.asarray(lat1, dtype=float))*degrees_to_radians
+    phi2 = (90.0 - np.asarray(lat2, dtype=float))*degrees_to_radians
+    theta1 = np.asarray(lon1, dtype=float)*degrees_to_radians
+    theta2 = np.asarray(lon2, dtype=float)*degrees_to_radians
+    cos = (np.sin(phi1)*np.sin(phi2)*np.cos(theta1 - theta2) +
+           np.cos(phi1)*np.cos(phi2))
+    if np.any(np.abs(cos) > 1.0):
+        raise ValueError('math domain error')
+    arc = np.arccos(cos)
+    return arc * RADIUS
+
+def between_pixels_batch(x1, y1, x2, y2):
+    """Computes pixel distances between arrays of pixel coordinates.
+
+    Array version of between_pixels(), including the rule that a pixel
+    is 0.25 away from itself.
+
+    Inputs:
+        x1, y1 (array_like): First pixel coordinates.
+        x2, y2 (array_like): Second pixel coordinates.
+
+    Returns:
+        dist (ndarray): Distances between the pixels.
+    """
+    dx = np.asarray(x2, dtype=float) - np.asarray(x1, dtype=float)
+    dy = np.asarray(y2, dtype=float) - np.asarray(y1, dtype=float)
+    dist = np.sqrt(dx**2 + dy**2)
+    return np.where((dx == 0) & (dy == 0), 0.25, dist)
@@ -0,0 +1,233 @@
+'''
+Module for sorting .csv files that are too large to hold in memory.
+
+Rows are read into sorted runs of bounded memory, each run is spilled to a
+temporary file, and the runs are then combined with a k-way heap merge. The
+sort is stable, so rows with equal keys keep the order they had in the
+input file, which matches the behaviour of R's order() that was previously
+used for this step.
+'''
+
+import os
+import sys
+import math
+import heapq
+import shutil
+import tempfile
+from . import reading, writing
+
+# Default memory budget for a single sorted run, in bytes
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+# Maximum number of runs merged at once - keeps open file handles bounded
+MAX_MERGE_FANIN = 64
+# Rough per-row and per-field overhead of a parsed row held as a list of str
+ROW_OVERHEAD = sys.getsizeof([])
+FIELD_OVERHEAD = sys.getsizeof('')
+# Values treated as missing, which R places after every other value
+MISSING_VALUES = ('', 'NA')
+
+def sort_key(value):
+    """Builds a sort key for a single column value.
+
+    Numeric values are ordered numerically and come first, followed by
+    non-numeric strings in lexical order, followed by missing values.
+    Non-finite numbers such as 'nan' and 'inf' are ordered as strings, as
+    nan compares unequal to everything and would break the order.
+
+    Inputs:
+        value (str): Column value from a .csv row.
+
+    Returns:
+        key (tuple): Key that orders values as described above.
+    """
+    if value in MISSING_VALUES:
+        return (2, 0.0, '')
+    try:
+        number = float(value)
+    except ValueError:
+        return (1, 0.0, value)
+    if not math.isfinite(number):
+        return (1, 0.0, value)
+    return (0, number, '')
+
+def row_key_function(key_columns):
+    """Builds a function returning the sort key of a row.
+
+    Inputs:
+        key_columns (list): Zero based indices of the columns to sort by,
+            in order of precedence.
+
+    Returns:
+        key_function (function): Maps a row (list) to its sort key.
+    """
+    if len(key_columns) == 1:
+        column = key_columns[0]
+        return lambda row: sort_key(row[column])
+    return lambda row: tuple(sort_key(row[column]) for column in key_columns)
+
+def estimate_row_size(row):
+    """Estimates the memory held by a parsed row.
+
+    Inputs:
+        row (list): Parsed .csv row.
+
+    Returns:
+        size (int): Approximate number of bytes held by the row.
+    """
+    return ROW_OVERHEAD + FIELD_OVERHEAD * len(row) + sum(map(len, row))
+
+class ExternalSorter:
+    """Stable out-of-core sort of a .csv file by one or more columns.
+
+    Attributes:
+        key_columns (list): Zero based indices of the columns to sort by,
+            in order of precedence.
+        memory_limit (int): Approximate number of bytes of parsed rows held
+            in memory for a single sorted run.
+        temp_dir (str): Directory in which sorted runs are spilled. Defaults
+            to the system temporary directory.
+        has_header (bool): Whether the first row of the input is a header,
+            in which case it is copied to the output unsorted.
+        runs_generated (int): Number of sorted runs spilled by the last sort.
+    """
+
+    def __init__(self, key_columns, memory_limit=DEFAULT_MEMORY_LIMIT,
+                 temp_dir=None, has_header=True):
+        """See class docstring."""
+        if isinstance(key_columns, int):
+            key_columns = [key_columns]
+        self.key_columns = list(key_columns)
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+        self.has_header = has_header
+        self.key = row_key_function(self.key_columns)
+        self.runs_generated = 0
+
+    def sort(self, input_file, output_file):
+        """Sorts an input .csv file and writes the result to an output file.
+
+        Inputs:
+            input_file (str): Path to the file to be sorted.
+            output_file (str): Path to the sorted output file. May be the
+                same as the input file.
+        """
+        run_dir = tempfile.mkdtemp(prefix='sort_', dir=self.temp_dir)
+        try:
+            with open(input_file) as read:
+                reader = reading.csv_reader(read)
+                header = next(reader, None) if self.has_header else None
+                runs = self.spill_sorted_runs(reader, run_dir)
+            self.runs_generated = len(runs)
+            runs = self.reduce_runs(runs, run_dir)
+            with open(output_file, 'w+') as write:
+                writer = writing.csv_writer(write)
+                if header is not None:
+                    writer.writerow(header)
+                self.merge_runs(runs, writer)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    def spill_sorted_runs(self, reader, run_dir):
+        """Reads rows into bounded memory runs, sorts and spills each run.
+
+        Inputs:
+            reader (csv.reader): Reader positioned at the first data row.
+            run_dir (str): Directory in which runs are written.
+
+        Returns:
+            runs (list): Paths to the sorted runs, in input order.
+        """
+        runs = []
+        rows = []
+        size = 0
+        for row in reader:
+            rows.append(row)
+            size += estimate_row_size(row)
+            if size >= self.memory_limit:
+                runs.append(self.write_run(rows, run_dir, len(runs)))
+                rows = []
+                size = 0
+        if rows or not runs:
+            runs.append(self.write_run(rows, run_dir, len(runs)))
+        return runs
+
+    def write_run(self, rows, run_dir, run_num):
+        """Sorts rows in memory and writes them to a run file.
+
+        Inputs:
+            rows (list): Rows making up the run.
+            run_dir (str): Directory in which runs are written.
+            run_num (int): Number of the run, used for naming.
+
+        Returns:
+            run_file (str): Path to the written run.
+        """
+        rows.sort(key=self.key)
+        run_file = os.path.join(run_dir, 'run_' + str(run_num) + '.csv')
+        with open(run_file, 'w+') as write:
+            writing.csv_writer(write).writerows(rows)
+        return run_file
+
+    def reduce_runs(self, runs, run_dir):
+        """Merges runs in groups until at most MAX_MERGE_FANIN remain.
+
+        Adjacent runs are merged together so that stability is preserved.
+
+        Inputs:
+            runs (list): Paths to the sorted runs, in input order.
+            run_dir (str): Directory in which runs are written.
+
+        Returns:
+            runs (list): Paths to the remaining sorted runs, in input order.
+        """
+        merge_num = 0
+        while len(runs) > MAX_MERGE_FANIN:
+            merged_runs = []
+            for start in range(0, len(runs), MAX_MERGE_FANIN):
+                group = runs[start:start + MAX_MERGE_FANIN]
+                merged_file = os.path.join(run_dir, 'merge_' + str(merge_num) + '.csv')
+                merge_num += 1
+                with open(merged_file, 'w+') as write:
+                    self.merge_runs(group, writing.csv_writer(write))
+                for run_file in group:
+                    os.remove(run_file)
+                merged_runs.append(merged_file)
+            runs = merged_runs
+        return runs
+
+    def merge_runs(self, runs, writer):
+        """Performs a stable k-way heap merge of sorted runs.
+
+        Inputs:
+            runs (list): Paths to the sorted runs, in input order.
+            writer (csv.writer): Writer that receives the merged rows.
+        """
+        files = [open(run_file) for run_file in runs]
+        try:
+            readers = [reading.csv_reader(run) for run in files]
+            writer.writerows(heapq.merge(*readers, key=self.key))
+        finally:
+            for run in files:
+                run.close()
+
+def sort_csv(input_file, output_file, key_columns, memory_limit=DEFAULT_MEMORY_LIMIT,
+             temp_dir=None, has_header=True):
+    """Stable out-of-core sort of a .csv file by one or more columns.
+
+    Inputs:
+        input_file (str): Path to the file to be sorted.
+        output_file (str): Path to the sorted output file.
+        key_columns (int or list): Zero based indices of the columns to
+            sort by, in order of precedence.
+        memory_limit (int): Approximate number of bytes of parsed rows held
+            in memory for a single sorted run.
+        temp_dir (str): Directory in which sorted runs are spilled.
+        has_header (bool): Whether the first row of the input is a header.
+
+    Returns:
+        runs_generated (int): Number of sorted runs spilled to disk.
+    """
+    sorter = ExternalSorter(key_columns, memory_limit=memory_limit,
+                            temp_dir=temp_dir, has_header=has_header)
+    sorter.sort(input_file, output_file)
+    return sorter.runs_generated
@@ -0,0 +1,448 @@
+'''
+Module for reading and writing the files handed off between modules.
+
+Modules 2, 3 and 4 each hand a wide file with one row per person to the
+next module. By default these are .csv files. They can instead be written
+in a columnar format built on Arrow IPC streams, which stores integer and
+float columns as typed values and every other column dictionary encoded,
+so the next module does not have to re-tokenize every column of every row.
+
+Columnar files are partitioned by residence county. A file 'X.csv' is
+stored as a directory 'X.arrow/' holding an index.json and one or more
+Arrow IPC stream files per residence county. Column types are inferred
+per part from its first batch, and only kept if every value of the column
+round-trips exactly to the text it was written from. A later batch with a
+value that does not fit starts a new part with that column stored as text,
+so reading a columnar file always returns exactly what was written.
+Rows may differ in length, as in the Module 3 output, where non-students
+have one column less than students: shorter rows are padded with nulls,
+which are never written otherwise, and the nulls are dropped on read.
+
+Readers and writers mimic the csv module: the first row written is the
+header, and readers return the header first, followed by every row as a
+list of str. Rows are read back grouped by residence county, in the order
+each county was first written, so files sorted by residence county keep
+their row order. Files that are not, such as the Module 3 output, which
+is ordered by school county, are read back in a different row order than
+their .csv version. Every reader handles persons independently of their
+order, and Module 5 numbers rows in the order they are read, so that row
+numbers agree with read_partition().
+
+pyarrow is only required when the columnar format is used.
+'''
+
+import os
+import json
+import shutil
+import itertools
+from contextlib import contextmanager
+from . import reading, writing
+
+CSV = 'csv'
+ARROW = 'arrow'
+FORMATS = (CSV, ARROW)
+# Environment variable holding the intermediate format, see paths.py
+FORMAT_ENV = 'TRIP_GEN_INTERMEDIATE_FORMAT'
+# Column holding the residence county FIPS code from Module 2 onwards
+RESIDENCE_COUNTY_INDEX = 14
+# Number of rows, over all residence counties, held in memory before being
+# written
+DEFAULT_BATCH_SIZE = 65536
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+# Column types of a part
+INT, FLOAT, STRING = 'int', 'float', 'string'
+
+def get_format():
+    """Returns the format used for intermediate files, 'csv' or 'arrow'."""
+    return os.environ.get(FORMAT_ENV, CSV)
+
+def set_format(fmt):
+    """Sets the format used for intermediate files.
+
+    Inputs:
+        fmt (str): Either 'csv' or 'arrow'.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown intermediate format', fmt)
+    os.environ[FORMAT_ENV] = fmt
+
+def arrow_path(csv_path):
+    """Returns the directory of the columnar file standing in for a .csv file."""
+    return os.path.splitext(csv_path)[0] + '.arrow'
+
+def file_path(csv_path, fmt=None):
+    """Returns the path an intermediate file is stored at in a format.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        fmt (str): Format, defaults to get_format().
+    """
+    if fmt is None:
+        fmt = get_format()
+    return csv_path if fmt == CSV else arrow_path(csv_path)
+
+def remove(csv_path, fmt=None):
+    """Removes an intermediate file.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        fmt (str): Format, defaults to get_format().
+    """
+    path = file_path(csv_path, fmt)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+def count_rows(csv_path, fmt=None):
+    """Counts the rows, without header, of an intermediate file.
+
+    Lines of .csv files are counted without being parsed, and columnar
+    files are counted from their index.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        fmt (str): Format, defaults to get_format().
+    """
+    if fmt is None:
+        fmt = get_format()
+    if fmt == CSV:
+        return max(reading.count_lines(csv_path) - 1, 0)
+    with open(os.path.join(arrow_path(csv_path), INDEX_FILE)) as read:
+        return sum(num_rows for _, _, num_rows in json.load(read)['partitions'])
+
+def _import_pyarrow():
+    """Imports pyarrow, which is only needed for the columnar format."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError('pyarrow is required for the arrow intermediate format, '
+                          'install it or use the csv format')
+    return pyarrow
+
+def to_str(value):
+    """Converts a value to the text the csv module would write for it."""
+    return '' if value is None else str(value)
+
+def _fits_int(value):
+    """Whether a value round-trips exactly through an int."""
+    try:
+        return str(int(value)) == value
+    except ValueError:
+        return False
+
+def _fits_float(value):
+    """Whether a value round-trips exactly through a float."""
+    try:
+        return repr(float(value)) == value
+    except ValueError:
+        return False
+
+def infer_types(columns, types=None):
+    """Infers the type of each column of a batch.
+
+    Inputs:
+        columns (list): Values of each column, as lists of str, or None
+            where a row is too short to have the column.
+        types (list): Types of the part the batch is written to. Columns
+            can only keep their type or be demoted to str.
+
+    Returns:
+        types (list): Type of each column, INT, FLOAT or STRING.
+    """
+    inferred = []
+    for idx, values in enumerate(columns):
+        allowed = (INT, FLOAT) if types is None or idx >= len(types) else (types[idx],)
+        values = [value for value in values if value is not None]
+        column_type = STRING
+        if INT in allowed and all(map(_fits_int, values)):
+            column_type = INT
+        elif FLOAT in allowed and all(map(_fits_float, values)):
+            column_type = FLOAT
+        inferred.append(column_type)
+    return inferred
+
+class ArrowWriter:
+    """Writes rows to a columnar file partitioned by residence county.
+
+    Attributes:
+        path (str): Directory of the columnar file.
+        partition_column (int): Index of the column rows are partitioned by.
+        batch_size (int): Number of rows, over all partitions, held in
+            memory before being written.
+        header (list): First row written.
+        partitions (dict): Associates each partition key, in the order
+            first written, with the names of its part files and its
+            number of rows.
+        buffers (dict): Rows of each partition not yet written.
+        buffered (int): Number of rows in buffers.
+        streams (dict): Open part of each partition, as a tuple of the
+            open file, the stream writer, the column types and the schema.
+    """
+
+    def __init__(self, path, partition_column=RESIDENCE_COUNTY_INDEX,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """See class docstring."""
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.partition_column = partition_column
+        self.batch_size = batch_size
+        self.header = None
+        self.partitions = dict()
+        self.buffers = dict()
+        self.buffered = 0
+        self.streams = dict()
+        self.part_count = 0
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def writerow(self, row):
+        """Writes a row, the first row written is the header."""
+        row = [value if isinstance(value, str) else to_str(value) for value in row]
+        if self.header is None:
+            self.header = row
+            return
+        key = row[self.partition_column]
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = []
+            if key not in self.partitions:
+                self.partitions[key] = {'parts': [], 'rows': 0}
+        buffer.append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            # Files not sorted by the partition column spread their rows
+            # over many partitions, none of which may fill a batch
+            for buffered_key in list(self.buffers):
+                self.flush(buffered_key)
+
+    def writerows(self, rows):
+        """Writes every row of an iterable of rows."""
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self, key):
+        """Writes the buffered rows of a partition as a record batch.
+
+        Inputs:
+            key (str): Partition key.
+        """
+        rows = self.buffers.pop(key)
+        self.buffered -= len(rows)
+        columns = [list(column) for column in itertools.zip_longest(*rows)]
+        stream = self.streams.get(key)
+        types = infer_types(columns, None if stream is None else stream[2])
+        if stream is not None and (types[:len(stream[2])] != stream[2][:len(types)]
+                                   or len(types) > len(stream[2])):
+            # A value did not fit its column type, or rows are longer than
+            # the columns of the part, continue in a new part
+            self.close_stream(key)
+            stream = None
+        elif stream is not None and len(types) < len(stream[2]):
+            # Pads every row of the batch to the columns of the part
+            columns.extend([None] * len(rows) for _ in range(len(stream[2]) - len(types)))
+            types = stream[2]
+        if stream is None:
+            stream = self.open_stream(key, types)
+        stream[1].write_batch(self.build_batch(columns, types, stream[3]))
+        self.partitions[key]['rows'] += len(rows)
+
+    def build_batch(self, columns, types, schema):
+        """Converts columns of str to a typed record batch."""
+        pa = self.pa
+        arrays = []
+        for values, column_type in zip(columns, types):
+            if column_type == INT:
+                arrays.append(pa.array([None if value is None else int(value)
+                                        for value in values], pa.int64()))
+            elif column_type == FLOAT:
+                arrays.append(pa.array([None if value is None else float(value)
+                                        for value in values], pa.float64()))
+            else:
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def open_stream(self, key, types):
+        """Opens a new part file for a partition."""
+        pa = self.pa
+        fields = []
+        for idx, column_type in enumerate(types):
+            name = self.header[idx] if idx < len(self.header) else 'Column_' + str(idx)
+            if column_type == INT:
+                fields.append(pa.field(name, pa.int64()))
+            elif column_type == FLOAT:
+                fields.append(pa.field(name, pa.float64()))
+            else:
+                fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        part_name = 'part-' + str(self.part_count).zfill(5) + '.arrows'
+        self.part_count += 1
+        sink = open(os.path.join(self.path, part_name), 'wb')
+        schema = pa.schema(fields)
+        stream_writer = pa.ipc.new_stream(sink, schema)
+        self.streams[key] = (sink, stream_writer, types, schema)
+        self.partitions[key]['parts'].append(part_name)
+        return self.streams[key]
+
+    def close_stream(self, key):
+        """Closes the open part file of a partition."""
+        sink, stream_writer, _, _ = self.streams.pop(key)
+        stream_writer.close()
+        sink.close()
+
+    def close(self):
+        """Writes every buffered row, closes every part and writes the index."""
+        for key in list(self.buffers):
+            self.flush(key)
+        for key in list(self.streams):
+            self.close_stream(key)
+        index = {'version': INDEX_VERSION, 'header': self.header or [],
+                 'partition_column': self.partition_column,
+                 'partitions': [[key, info['parts'], info['rows']]
+                                for key, info in self.partitions.items()]}
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as write:
+            json.dump(index, write)
+
+class ArrowReader:
+    """Reads rows from a columnar file written by ArrowWriter.
+
+    Iterating over a reader returns the header, followed by every row as a
+    list of str, as a csv.reader would. Rows are grouped by partition, see
+    the module docstring.
+
+    Attributes:
+        path (str): Directory of the columnar file.
+        index (dict): Contents of the file's index.json.
+    """
+
+    def __init__(self, path):
+        """See class docstring."""
+        self.pa = _import_pyarrow()
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as read:
+            self.index = json.load(read)
+        if self.index.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported columnar file version', path)
+
+    @property
+    def header(self):
+        """Returns the header of the file."""
+        return list(self.index['header'])
+
+    def __iter__(self):
+        yield self.header
+        for _, parts, _ in self.index['partitions']:
+            for part in parts:
+                yield from self.read_part(part)
+
+    def read_part(self, part):
+        """Returns every row of a part file as a list of str."""
+        pa = self.pa
+        with pa.memory_map(os.path.join(self.path, part)) as source:
+            for batch in pa.ipc.open_stream(source):
+                columns = []
+                for field, column in zip(batch.schema, batch.columns):
+                    values = column.to_pylist()
+                    if pa.types.is_integer(field.type):
+                        values = [None if value is None else str(value) for value in values]
+                    elif pa.types.is_floating(field.type):
+                        values = [None if value is None else repr(value) for value in values]
+                    columns.append(values)
+                if batch.num_columns and any(column.null_count for column in batch.columns):
+                    # Drops the nulls padding rows shorter than the part
+                    for row in zip(*columns):
+                        yield [value for value in row if value is not None]
+                else:
+                    yield from map(list, zip(*columns))
+
+    def read_partition(self, key):
+        """Reads every row of a single residence county.
+
+        Inputs:
+            key (str): Partition key, i.e. the residence county FIPS code.
+
+        Returns:
+            start_row (int): Number of rows, excluding the header, that come
+                before the partition when reading the whole file.
+            rows (list): Every row of the partition, as lists of str.
+        """
+        start_row = 0
+        for curr_key, parts, num_rows in self.index['partitions']:
+            if curr_key == key:
+                rows = []
+                for part in parts:
+                    rows.extend(self.read_part(part))
+                return start_row, rows
+            start_row += num_rows
+        return start_row, []
+
+    def close(self):
+        """Part files are only held open while being read."""
+        pass
+
+@contextmanager
+def open_writer(csv_path, fmt=None, partition_column=RESIDENCE_COUNTY_INDEX):
+    """Opens a writer for an intermediate file.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        fmt (str): Format, defaults to get_format().
+        partition_column (int): Column the columnar format is partitioned by.
+
+    Returns:
+        writer (csv.writer or ArrowWriter): Writer for the file.
+    """
+    if fmt is None:
+        fmt = get_format()
+    if fmt == CSV:
+        with open(csv_path, 'w+') as write:
+            yield writing.csv_writer(write)
+    else:
+        writer = ArrowWriter(arrow_path(csv_path), partition_column)
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+@contextmanager
+def open_reader(csv_path, fmt=None):
+    """Opens a reader for an intermediate file.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        fmt (str): Format, defaults to get_format().
+
+    Returns:
+        reader (iterator): Returns the header, then every row as a list of str.
+    """
+    if fmt is None:
+        fmt = get_format()
+    if fmt == CSV:
+        with open(csv_path) as read:
+            yield reading.csv_reader(read)
+    else:
+        reader = ArrowReader(arrow_path(csv_path))
+        try:
+            yield iter(reader)
+        finally:
+            reader.close()
+
+def read_partition(csv_path, key, fmt=None):
+    """Reads every row of a single residence county of a columnar file.
+
+    Inputs:
+        csv_path (str): Path of the file in .csv format.
+        key (str): Residence county FIPS code.
+        fmt (str): Format, defaults to get_format(). Must be 'arrow'.
+
+    Returns:
+        start_row (int): See ArrowReader.read_partition().
+        rows (list): Every row of the residence county, as lists of str.
+    """
+    if fmt is None:
+        fmt = get_format()
+    if fmt != ARROW:
+        raise ValueError('Only columnar files can be read by partition')
+    return ArrowReader(arrow_path(csv_path)).read_partition(key)
@@ -0,0 +1,152 @@
+'''
+Module for accounting the memory used by module runs.
+
+Memory accounting is opt-in, and set for a run with set_checkpoints(),
+workers included. When on, every checkpoint
+records the resident memory of the process, its peak so far, and the
+memory traced by tracemalloc and its peak since the last checkpoint.
+Checkpoints of the kinds chosen also record the top allocation sites:
+
+    reference   After reference data is loaded (e.g. J2W, income and
+                employment by industry, county names)
+    county      After each county of a per-county loop
+    phase       After each step of a module run, e.g. each Module 5 pass
+
+Taking the top allocation sites takes a tracemalloc snapshot, which is
+slow when many objects are alive, so county checkpoints are best left out
+on large states. Checkpoints are recorded as 'memory' gauges of the run
+metrics (see metrics.py), and so end up in the run report, including
+those of pool workers, by process id.
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+from . import metrics
+
+MEMORY_ENV = 'TRIP_GEN_MEMORY'
+TOP_ENV = 'TRIP_GEN_MEMORY_TOP'
+REFERENCE, COUNTY, PHASE = 'reference', 'county', 'phase'
+KINDS = (REFERENCE, COUNTY, PHASE)
+# Number of top allocation sites recorded, by default
+DEFAULT_TOP = 10
+# Frames of traceback stored by tracemalloc for every allocation
+TRACEBACK_FRAMES = 1
+
+def get_checkpoints():
+    """Returns the kinds of checkpoint that record allocation sites.
+
+    Returns:
+        kinds (tuple): Kinds of checkpoint, see KINDS, or None if memory
+            accounting is off.
+    """
+    value = os.environ.get(MEMORY_ENV)
+    if not value:
+        return None
+    return tuple(kind for kind in value.split(',') if kind in KINDS)
+
+def set_checkpoints(kinds, top=DEFAULT_TOP):
+    """Turns memory accounting on or off.
+
+    Inputs:
+        kinds (list): Kinds of checkpoint that record allocation sites,
+            see KINDS, or None to turn memory accounting off. An empty
+            list only records memory use, without allocation sites.
+        top (int): Number of top allocation sites recorded.
+    """
+    if kinds is None:
+        os.environ.pop(MEMORY_ENV, None)
+        return
+    for kind in kinds:
+        if kind not in KINDS:
+            raise ValueError('Unknown memory checkpoint', kind)
+    # A separator alone stands for no kinds, as an empty value means off
+    os.environ[MEMORY_ENV] = ','.join(kinds) or ','
+    os.environ[TOP_ENV] = str(top)
+
+def enabled():
+    """Whether memory accounting is on."""
+    return get_checkpoints() is not None
+
+def start():
+    """Starts tracing allocations, if memory accounting is on.
+
+    Called at the start of every process doing work, as tracemalloc only
+    sees allocations made after it is started.
+    """
+    if enabled() and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+
+def peak_rss(children=False):
+    """Returns the peak resident memory of the current process in bytes.
+
+    Uses the resource module where available, and psutil otherwise.
+    Returns None if neither is available.
+
+    Inputs:
+        children (bool): Whether to return the peak of the largest child
+            process that has finished and been waited for instead, e.g. a
+            pool worker. Only known through the resource module.
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+        peak = resource.getrusage(who).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+def current_rss():
+    """Returns the resident memory of the current process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as read:
+            return int(read.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+def top_allocation_sites(top):
+    """Returns the source lines that allocated the most traced memory.
+
+    Returns:
+        sites (list): Dictionaries with the site (file:line), size in
+            bytes and number of blocks allocated there and still alive.
+    """
+    snapshot = tracemalloc.take_snapshot()
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    return [{'site': str(stat.traceback[0]), 'size': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:top]]
+
+def checkpoint(kind, label):
+    """Records the memory used at a checkpoint, if memory accounting is on.
+
+    Inputs:
+        kind (str): Kind of checkpoint, see KINDS.
+        label (str): Describes the checkpoint, e.g. the county or step done.
+    """
+    kinds = get_checkpoints()
+    if kinds is None:
+        return
+    record = {'kind': kind, 'label': label, 'pid': os.getpid(), 'time': time.time(),
+              'rss': current_rss(), 'peak_rss': peak_rss()}
+    if tracemalloc.is_tracing():
+        record['traced'], record['traced_peak'] = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        if kind in kinds:
+            record['top'] = top_allocation_sites(int(os.environ.get(TOP_ENV, DEFAULT_TOP)))
+    metrics.gauge('memory', kind=kind, label=label, pid=record['pid']).set(record)
@@ -0,0 +1,365 @@
+'''
+Module for collecting metrics of a module run.
+
+Counters, gauges and timers are kept in a registry for the current
+process, keyed by name and labels (e.g. step or county). Hot loops should
+get a handle once, with counter() or timer(), and update it per row or
+per county; handles are plain attributes, so updating them costs about as
+much as a local variable. Nothing is written until write_report() is
+called at the end of a module's main function, which dumps a JSON run
+report with rows per second per step, time per county, cache hit rates
+and fallback counts.
+
+Conventions used in reports:
+    rows (counter, step label): Rows processed by a step.
+    step (timer, step label): Time spent in a step, and the epoch times it
+        was first started and last stopped.
+    county (timer, step and county labels): Time spent on a county.
+    cache_hits, cache_misses (counters, cache label): Cache lookups.
+    fallbacks (counter, kind label): Times a fail-safe was used.
+    memory (gauge, kind, label and pid labels): Memory used at a
+        checkpoint, see memory.py. Reported in order, with the peak
+        resident memory of every process.
+
+Worker processes send their metrics back with collect(), to be added to
+the parent's with merge().
+
+If tracing is on (see tracing.py), every timer also records a span each
+time it is stopped, and the spans are written as a Chrome trace along with
+the run report.
+'''
+
+import os
+import json
+import time
+from datetime import datetime
+from . import paths, tracing
+
+class Counter:
+    """Counts events.
+
+    Attributes:
+        value (int): Number of events counted.
+    """
+
+    def __init__(self):
+        """See class docstring."""
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Adds to the count."""
+        self.value += amount
+
+class Gauge:
+    """Holds the last value set.
+
+    Attributes:
+        value (float): Last value set.
+    """
+
+    def __init__(self):
+        """See class docstring."""
+        self.value = None
+
+    def set(self, value):
+        """Sets the value."""
+        self.value = value
+
+class Timer:
+    """Accumulates elapsed time, used as a context manager or with start/stop.
+
+    Attributes:
+        seconds (float): Total elapsed time, in seconds.
+        calls (int): Number of times the timer was stopped.
+        started (float): Time the timer was started, or None if stopped.
+        first_start (float): Epoch time the timer was first started, or None.
+        last_stop (float): Epoch time the timer was last stopped, or None.
+        spans (list): Spans the timer records every time it is stopped, as
+            (name, labels, pid, start, stop) tuples, or None if not traced.
+        key (tuple): Name and labels of the timer, recorded with its spans.
+    """
+
+    def __init__(self, spans=None, key=None):
+        """See class docstring."""
+        self.seconds = 0.0
+        self.calls = 0
+        self.started = None
+        self.started_at = None
+        self.first_start = None
+        self.last_stop = None
+        self.spans = spans
+        self.key = key
+
+    def start(self):
+        """Starts timing."""
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        if self.first_start is None:
+            self.first_start = self.started_at
+
+    def stop(self):
+        """Stops timing, adding the elapsed time if started."""
+        if self.started is not None:
+            self.seconds += time.perf_counter() - self.started
+            self.calls += 1
+            self.started = None
+            self.last_stop = time.time()
+            if self.spans is not None:
+                self.spans.append(self.key + (os.getpid(), self.started_at, self.last_stop))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class CountyTimer:
+    """Times each county of a step, for loops over rows grouped by county.
+
+    The memory used is also recorded after each county, if memory
+    accounting is on, see memory.checkpoint().
+
+    Attributes:
+        registry (Registry): Registry the timers belong to.
+        step (str): Step being timed.
+        current (Timer): Timer of the county being processed.
+        county (str): County being processed.
+    """
+
+    def __init__(self, registry, step):
+        """See class docstring."""
+        self.registry = registry
+        self.step = step
+        self.current = None
+        self.county = None
+
+    def switch(self, county):
+        """Stops timing the previous county and starts timing a county."""
+        self.stop()
+        self.county = county
+        self.current = self.registry.timer('county', step=self.step, county=county)
+        self.current.start()
+
+    def stop(self):
+        """Stops timing the current county."""
+        if self.current is not None:
+            self.current.stop()
+            self.current = None
+            # Imported here, as memory records its checkpoints with metrics
+            from . import memory
+            memory.checkpoint(memory.COUNTY, self.step + ':' + self.county)
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+class Registry:
+    """Holds every metric of the current process.
+
+    Attributes:
+        counters (dict): Counter per name and labels.
+        gauges (dict): Gauge per name and labels.
+        timers (dict): Timer per name and labels.
+        spans (list): Spans recorded by timers, or None if tracing is off.
+        started (datetime): Time the registry was created or reset.
+    """
+
+    def __init__(self):
+        """See class docstring."""
+        self.counters = dict()
+        self.gauges = dict()
+        self.timers = dict()
+        self.spans = [] if tracing.enabled() else None
+        self.started = datetime.now()
+
+    def counter(self, name, **labels):
+        """Returns the counter of a name and labels, creating it if needed."""
+        key = _key(name, labels)
+        if key not in self.counters:
+            self.counters[key] = Counter()
+        return self.counters[key]
+
+    def gauge(self, name, **labels):
+        """Returns the gauge of a name and labels, creating it if needed."""
+        key = _key(name, labels)
+        if key not in self.gauges:
+            self.gauges[key] = Gauge()
+        return self.gauges[key]
+
+    def timer(self, name, **labels):
+        """Returns the timer of a name and labels, creating it if needed."""
+        key = _key(name, labels)
+        if key not in self.timers:
+            self.timers[key] = Timer(self.spans, key)
+        return self.timers[key]
+
+    def snapshot(self):
+        """Returns every metric as a picklable dictionary, see merge()."""
+        return {'counters': [(key, counter.value) for key, counter in self.counters.items()],
+                'gauges': [(key, gauge.value) for key, gauge in self.gauges.items()],
+                'timers': [(key, timer.seconds, timer.calls, timer.first_start, timer.last_stop)
+                           for key, timer in self.timers.items()],
+                'spans': self.spans}
+
+    def merge(self, snapshot):
+        """Adds the metrics of a snapshot, e.g. from a worker process.
+
+        Counters and timers are added together, and timers span the
+        earliest start and latest stop of both; gauges take the value of
+        the snapshot. Spans are added if tracing is on.
+        """
+        for (name, labels), value in snapshot['counters']:
+            self.counter(name, **dict(labels)).inc(value)
+        for (name, labels), value in snapshot['gauges']:
+            self.gauge(name, **dict(labels)).set(value)
+        for (name, labels), seconds, calls, first_start, last_stop in snapshot['timers']:
+            timer = self.timer(name, **dict(labels))
+            timer.seconds += seconds
+            timer.calls += calls
+            if first_start is not None:
+                timer.first_start = min(first_start, timer.first_start or first_start)
+            if last_stop is not None:
+                timer.last_stop = max(last_stop, timer.last_stop or last_stop)
+        if self.spans is not None and snapshot.get('spans'):
+            self.spans.extend(snapshot['spans'])
+
+    def report(self, stage, state):
+        """Builds the run report of a stage.
+
+        Inputs:
+            stage (str): Stage name, usually the module name.
+            state (str): State name, without spaces.
+
+        Returns:
+            report (dict): Run report, ready to be dumped as JSON.
+        """
+        wall_time = (datetime.now() - self.started).total_seconds()
+        steps = dict()
+        for (name, labels), timer in self.timers.items():
+            if name == 'step':
+                step = steps.setdefault(dict(labels).get('step'), dict())
+                step['seconds'] = timer.seconds
+                step['start'], step['stop'] = timer.first_start, timer.last_stop
+        for (name, labels), counter in self.counters.items():
+            if name == 'rows':
+                steps.setdefault(dict(labels).get('step'), dict())['rows'] = counter.value
+        for step in steps.values():
+            if step.get('seconds') and 'rows' in step:
+                step['rows_per_sec'] = step['rows'] / step['seconds']
+        county_time = dict()
+        for (name, labels), timer in self.timers.items():
+            if name == 'county':
+                labels = dict(labels)
+                county_time.setdefault(labels.get('step'), dict())[labels['county']] = timer.seconds
+        caches = dict()
+        fallbacks = dict()
+        for (name, labels), counter in self.counters.items():
+            labels = dict(labels)
+            if name in ('cache_hits', 'cache_misses'):
+                cache = caches.setdefault(labels.get('cache'), {'hits': 0, 'misses': 0})
+                cache[name[len('cache_'):]] += counter.value
+            elif name == 'fallbacks':
+                fallbacks[labels.get('kind')] = fallbacks.get(labels.get('kind'), 0) + counter.value
+        for cache in caches.values():
+            lookups = cache['hits'] + cache['misses']
+            cache['hit_rate'] = cache['hits'] / lookups if lookups else None
+        report = {'stage': stage, 'state': state, 'started': str(self.started),
+                  'wall_time': wall_time, 'steps': steps, 'county_time': county_time,
+                  'caches': caches, 'fallbacks': fallbacks}
+        checkpoints = sorted((gauge.value for (name, _), gauge in self.gauges.items()
+                              if name == 'memory'), key=lambda record: record['time'])
+        if checkpoints:
+            peak_rss = dict()
+            for record in checkpoints:
+                if record['peak_rss'] is not None:
+                    peak_rss[record['pid']] = max(record['peak_rss'],
+                                                  peak_rss.get(record['pid'], 0))
+            report['memory'] = {'peak_rss': max(peak_rss.values(), default=None),
+                                'peak_rss_by_pid': peak_rss, 'checkpoints': checkpoints}
+        report['counters'] = [{'name': name, 'labels': dict(labels), 'value': counter.value}
+                              for (name, labels), counter in self.counters.items()]
+        report['gauges'] = [{'name': name, 'labels': dict(labels), 'value': gauge.value}
+                            for (name, labels), gauge in self.gauges.items() if name != 'memory']
+        report['timers'] = [{'name': name, 'labels': dict(labels), 'seconds': timer.seconds,
+                             'calls': timer.calls, 'start': timer.first_start,
+                             'stop': timer.last_stop}
+                            for (name, labels), timer in self.timers.items()]
+        return report
+
+_REGISTRY = Registry()
+
+def registry():
+    """Returns the registry of the current process."""
+    return _REGISTRY
+
+def reset():
+    """Discards every metric, starting a new run.
+
+    Called first by tasks run in pool workers, whose registry is a copy of
+    the parent's: the parent already reports those metrics, and merges
+    back only what the task collects.
+    """
+    global _REGISTRY
+    _REGISTRY = Registry()
+
+def counter(name, **labels):
+    """Returns a counter of the current registry, see Registry.counter()."""
+    return _REGISTRY.counter(name, **labels)
+
+def gauge(name, **labels):
+    """Returns a gauge of the current registry, see Registry.gauge()."""
+    return _REGISTRY.gauge(name, **labels)
+
+def timer(name, **labels):
+    """Returns a timer of the current registry, see Registry.timer()."""
+    return _REGISTRY.timer(name, **labels)
+
+def step(name):
+    """Returns the timer of a step, to be used as a context manager."""
+    return _REGISTRY.timer('step', step=name)
+
+def county_timer(step_name):
+    """Returns a CountyTimer for a step of the current registry."""
+    return CountyTimer(_REGISTRY, step_name)
+
+def collect():
+    """Returns a snapshot of the current registry and resets it.
+
+    Used by worker processes to send their metrics to the parent process.
+    """
+    snapshot = _REGISTRY.snapshot()
+    reset()
+    return snapshot
+
+def merge(snapshot):
+    """Adds a snapshot to the current registry, see Registry.merge()."""
+    _REGISTRY.merge(snapshot)
+
+def report_path(stage, state):
+    """Returns the path of the run report of a stage for a state."""
+    return paths.OUTPUT + 'Reports/' + state + '_' + stage + '.json'
+
+def write_report(stage, state):
+    """Writes the run report of a stage for a state.
+
+    Also writes the trace of the stage if tracing is on, see tracing.py.
+
+    Inputs:
+        stage (str): Stage name, usually the module name.
+        state (str): State name, without spaces.
+
+    Returns:
+        report (dict): Run report written, see Registry.report().
+    """
+    report = _REGISTRY.report(stage, state)
+    path = report_path(stage, state)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as write:
+        json.dump(report, write, indent=2)
+    print('Run report written to', path)
+    if _REGISTRY.spans is not None:
+        # The whole stage, as the outermost span of the main process
+        spans = _REGISTRY.spans + [('stage', (('stage', stage),), os.getpid(),
+                                    _REGISTRY.started.timestamp(), time.time())]
+        tracing.write_trace(stage, state, spans)
+    return report
@@ -1,16 +1,53 @@
 '''
 Paths for all data input/output.
+
+Every path is below a data root, D:/Data/ by default. The root can be
+moved by setting the TRIP_GEN_DATA_ROOT environment variable, or by
+calling set_root() before any data is read (e.g. to run on synthetic data,
+see benchmarks/synthetic_data.py). Modules should read these attributes
+when they are used rather than copying them at import time, so that a
+moved root is picked up.
+
+Settings of a run (the data root here, and e.g. the intermediate format,
+profiling, tracing, memory accounting and progress interval) are held in
+environment variables rather than module globals. Worker processes, forked
+or spawned, and processes started for parallel states all inherit the
+environment, so a setting made once in the parent applies to all of them
+without being passed along.
 '''
 
-MAIN_DRIVE = 'D:/Data/'
-WORKFLOW = MAIN_DRIVE + 'WorkFlow/'
-OUTPUT = MAIN_DRIVE + 'Output/'
-MODULES = [OUTPUT + 'Module' + str(i) + '/' for i in range(1,8)]
-EMPLOYMENT = MAIN_DRIVE + 'Employment/'
-COUNTY = EMPLOYMENT + 'CountyEmployeeFiles/'
-PAT = EMPLOYMENT + 'Employee Patronage Data/'
-ZIP = MAIN_DRIVE + 'ZipCodes/'
-SCHOOL = MAIN_DRIVE + 'Schools/'
-SCHOOL_DBASE = SCHOOL + 'School Database/'
+import os
+
+# Environment variable holding the data root
+ROOT_ENV = 'TRIP_GEN_DATA_ROOT'
+DEFAULT_ROOT = 'D:/Data/'
 R_SCRIPT_EXE = 'C:/R/R-3.3.1/bin/Rscript.exe'
-TRIP_DISTS = MAIN_DRIVE + 'Trip Distributions and Times/'
\ No newline at end of file
+
+def set_root(root):
+    """Points every data path below a new data root.
+
+    The root is also stored in the environment, so that processes started
+    afterwards (e.g. for parallel states) use the same root.
+
+    Inputs:
+        root (str): Path to the data root folder.
+    """
+    global MAIN_DRIVE, WORKFLOW, OUTPUT, MODULES, EMPLOYMENT, COUNTY, PAT
+    global ZIP, SCHOOL, SCHOOL_DBASE, TRIP_DISTS
+    root = root.replace('\\', '/')
+    if not root.endswith('/'):
+        root += '/'
+    os.environ[ROOT_ENV] = root
+    MAIN_DRIVE = root
+    WORKFLOW = MAIN_DRIVE + 'WorkFlow/'
+    OUTPUT = MAIN_DRIVE + 'Output/'
+    MODULES = [OUTPUT + 'Module' + str(i) + '/' for i in range(1,8)]
+    EMPLOYMENT = MAIN_DRIVE + 'Employment/'
+    COUNTY = EMPLOYMENT + 'CountyEmployeeFiles/'
+    PAT = EMPLOYMENT + 'Employee Patronage Data/'
+    ZIP = MAIN_DRIVE + 'ZipCodes/'
+    SCHOOL = MAIN_DRIVE + 'Schools/'
+    SCHOOL_DBASE = SCHOOL + 'School Database/'
+    TRIP_DISTS = MAIN_DRIVE + 'Trip Distributions and Times/'
+
+set_root(os.environ.get(ROOT_ENV, DEFAULT_ROOT))
@@ -6,6 +6,7 @@ Created on Fri Apr 14 13:45:02 2017
 """
 
 import math
+import numpy as np
 
 def find_pixel_centroid(x, y):
     """Returns the lat-lon corner of a given x-y pixel coordinates
@@ -35,4 +36,20 @@ def find_pixel_coords(lat, lon):
     lat, lon = float(lat), float(lon)
     xCoord = math.floor(138.348*(lon+97.5)*math.cos(lat*math.pi/180))
     yCoord = math.floor(138.348*(lat-37.0))
-    return xCoord, yCoord
\ No newline at end of file
+    return xCoord, yCoord
+
+def find_pixel_coords_batch(lat, lon):
+    """Returns pixel coordinates for arrays of lat-long pairs.
+
+    Array version of find_pixel_coords().
+
+    Inputs:
+        lat, lon (array_like): Lat-long pairs to convert to pixels
+
+    Returns:
+        xCoord, yCoord (ndarray): x, y pixel coordinates, as integers
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    xCoord = np.floor(138.348*(lon+97.5)*np.cos(lat*math.pi/180)).astype(np.int64)
+    yCoord = np.floor(138.348*(lat-37.0)).astype(np.int64)
+    return xCoord, yCoord
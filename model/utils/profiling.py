@@ -0,0 +1,240 @@
+'''
+Module for profiling module runs, including their worker processes.
+
+Profiling is set for a run with set_mode(), a run setting (see paths.py)
+that worker processes pick up too. Two profilers are available:
+
+    cprofile    Deterministic profiling with cProfile. Accurate call counts,
+                but slows down function heavy code considerably.
+    sampling    Samples the stack of the profiled thread at a fixed
+                interval. Call counts are sample counts, but overhead is
+                low and does not depend on the code profiled.
+
+Both write pstats compatible .prof files. A stage (usually a module run
+for a state) is profiled with profiled(), and every call run in a worker
+process with profile_call() writes its own profile below the stage's
+folder. When the stage ends, the profile of the stage and of its workers
+are merged into one .prof file and a text report of the top functions by
+cumulative time. Time the parent process spends waiting on workers shows
+up in the parent's functions, e.g. module5.pass_over_files.
+'''
+
+import os
+import sys
+import glob
+import time
+import shutil
+import marshal
+import pstats
+import cProfile
+import threading
+import contextlib
+from . import paths
+
+PROFILE_ENV = 'TRIP_GEN_PROFILE'
+# Prefix of worker profile files of the stage being profiled
+STAGE_ENV = 'TRIP_GEN_PROFILE_STAGE'
+OFF, CPROFILE, SAMPLING = 'off', 'cprofile', 'sampling'
+MODES = (OFF, CPROFILE, SAMPLING)
+# Seconds between stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# Number of functions listed in a stage report
+REPORT_LIMIT = 50
+
+def get_mode():
+    """Returns the profiling mode, one of MODES."""
+    return os.environ.get(PROFILE_ENV, OFF)
+
+def set_mode(mode):
+    """Sets the profiling mode.
+
+    Inputs:
+        mode (str): One of 'off', 'cprofile' or 'sampling'.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown profiling mode', mode)
+    os.environ[PROFILE_ENV] = mode
+
+def stage_path(stage, state):
+    """Returns the path of the profile of a stage, without extension."""
+    return paths.OUTPUT + 'Profiles/' + state + '_' + stage
+
+class SamplingProfiler:
+    """Profiles a thread by sampling its stack at a fixed interval.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        thread_id (int): Identifier of the thread profiled.
+        samples (dict): Associates every stack sampled, as a tuple of
+            (file name, line number, function name) from outermost to
+            innermost frame, with the number of times it was sampled.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        """See class docstring."""
+        self.interval = interval
+        self.thread_id = None
+        self.samples = dict()
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def enable(self):
+        """Starts sampling the calling thread."""
+        self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def disable(self):
+        """Stops sampling."""
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def stats(self):
+        """Returns the samples as pstats statistics.
+
+        Every sample counts as interval seconds. A function's total time is
+        the time it was the innermost frame, and its cumulative time the
+        time it was on the stack at all. Call counts are sample counts.
+        """
+        stats = dict()
+        for stack, count in self.samples.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, function in enumerate(stack):
+                primitive, calls, total, cumulative, callers = stats.get(function,
+                                                                         (0, 0, 0.0, 0.0, dict()))
+                if function not in seen:
+                    # Recursive functions are only counted once per sample
+                    seen.add(function)
+                    cumulative += seconds
+                    primitive += count
+                calls += count
+                if depth == len(stack) - 1:
+                    total += seconds
+                if depth > 0:
+                    caller = stack[depth - 1]
+                    caller_stats = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (caller_stats[0] + count, caller_stats[1] + count,
+                                       caller_stats[2] + (seconds if depth == len(stack) - 1 else 0.0),
+                                       caller_stats[3] + seconds)
+                stats[function] = (primitive, calls, total, cumulative, callers)
+        return stats
+
+    def dump_stats(self, file_name):
+        """Writes the samples to a file readable by pstats."""
+        with open(file_name, 'wb') as write:
+            marshal.dump(self.stats(), write)
+
+def new_profiler(mode):
+    """Returns a profiler for a mode, or None if profiling is off."""
+    if mode == CPROFILE:
+        return cProfile.Profile()
+    if mode == SAMPLING:
+        return SamplingProfiler()
+    return None
+
+@contextlib.contextmanager
+def profiled(stage, state):
+    """Profiles a stage and its worker processes, if profiling is on.
+
+    When the stage ends, the profiles of the stage and of every worker are
+    merged and reported, see write_report().
+
+    Inputs:
+        stage (str): Stage name, usually the module name.
+        state (str): State name, without spaces.
+    """
+    mode = get_mode()
+    profiler = new_profiler(mode)
+    if profiler is None:
+        yield
+        return
+    path = stage_path(stage, state)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    previous_stage = os.environ.get(STAGE_ENV)
+    os.environ[STAGE_ENV] = path
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(path, 'main.prof'))
+        if previous_stage is None:
+            del os.environ[STAGE_ENV]
+        else:
+            os.environ[STAGE_ENV] = previous_stage
+        write_report(path, stage, state, mode)
+
+def profile_call(label, function, *args):
+    """Calls a function, profiling it if profiling is on.
+
+    Meant for functions run in worker processes, which write their own
+    profile, named after the label and process, below the folder of the
+    stage being profiled.
+
+    Inputs:
+        label (str): Describes the call, e.g. the county it processes.
+        function (function): Function to call with args.
+
+    Returns:
+        result: Return value of function.
+    """
+    profiler = new_profiler(get_mode())
+    path = os.environ.get(STAGE_ENV)
+    if profiler is None or path is None:
+        return function(*args)
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(path, 'worker-%s-%d-%d.prof'
+                                         % (label, os.getpid(), int(time.time() * 1000))))
+
+def write_report(path, stage, state, mode):
+    """Merges the profiles of a stage and writes a report of them.
+
+    Inputs:
+        path (str): Folder holding the profiles of the stage, see stage_path().
+        stage (str): Stage name, usually the module name.
+        state (str): State name, without spaces.
+        mode (str): Profiling mode the profiles were made with.
+    """
+    profile_files = sorted(glob.glob(os.path.join(path, '*.prof')))
+    stats = None
+    for profile_file in profile_files:
+        with open(profile_file, 'rb') as read:
+            # Calls shorter than the sampling interval have no samples
+            if not marshal.load(read):
+                continue
+        if stats is None:
+            stats = pstats.Stats(profile_file)
+        else:
+            stats.add(profile_file)
+    if stats is None:
+        print('Nothing was profiled for', stage, 'for', state)
+        return
+    stats.dump_stats(path + '.prof')
+    with open(path + '.txt', 'w') as write:
+        write.write('Profile of ' + stage + ' for ' + state + ' (' + mode + '), merged from '
+                    + str(len(profile_files)) + ' profiles in ' + path + '\n\n')
+        # Lists the merged profile rather than every profile merged
+        stats.files = [path + '.prof']
+        stats.stream = write
+        stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+    print('Profile of', stage, 'for', state, 'written to', path + '.txt')
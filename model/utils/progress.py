@@ -0,0 +1,191 @@
+'''
+Module for reporting the progress of module stages.
+
+A stage that knows its total work (rows of its input file, see
+intermediate.count_rows(), or files handed to a pool) reports progress
+with a Progress, which prints the work done, percent done, throughput and
+estimated time left at a fixed time interval rather than every so many
+rows, so long stages never go silent and short ones are not flooded:
+
+    assign_work_counties: 2,000,000 of 9,000,000 rows (22.2%), 51,230 rows/sec, ETA 0:02:16
+
+Work done in pool worker processes is reported by a TaskProgress, which
+sends the rows done to the process reporting the stage over a queue set
+with init_worker(), used as the initializer of the pool. Work done in the
+reporting process itself, e.g. when a pool is not used, is reported with
+reporting_to() instead.
+
+The interval is set with set_interval(); an interval of 0 turns progress
+reporting off.
+'''
+
+import os
+import time
+import queue
+import contextlib
+from datetime import timedelta
+
+INTERVAL_ENV = 'TRIP_GEN_PROGRESS_INTERVAL'
+# Seconds between progress reports, by default
+DEFAULT_INTERVAL = 30.0
+# Rows between checks of the time, so updating costs little per row
+CHECK_ROWS = 1000
+# Seconds between rows sent by a worker process
+SEND_INTERVAL = 1.0
+# Where tasks report the rows they have done, see init_worker()
+_SINK = None
+
+def get_interval():
+    """Returns the seconds between progress reports, 0 if off."""
+    return float(os.environ.get(INTERVAL_ENV, DEFAULT_INTERVAL))
+
+def set_interval(seconds):
+    """Sets the seconds between progress reports, 0 to turn them off."""
+    if seconds < 0:
+        raise ValueError('Progress interval must not be negative', seconds)
+    os.environ[INTERVAL_ENV] = str(seconds)
+
+def format_eta(seconds):
+    """Formats a number of seconds as H:MM:SS."""
+    return str(timedelta(seconds=int(round(seconds))))
+
+class Progress:
+    """Reports the progress of a stage at a fixed time interval.
+
+    Attributes:
+        stage (str): Stage name, printed with every report.
+        total (int): Units of work of the stage, or None if unknown.
+        unit (str): Unit of work, e.g. 'rows'.
+        files (int): Files of the stage handed to a pool, or None.
+        done (int): Units of work done.
+        files_done (int): Files done.
+        interval (float): Seconds between reports, 0 if off.
+    """
+
+    def __init__(self, stage, total=None, unit='rows', files=None):
+        """See class docstring."""
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.files = files
+        self.done = 0
+        self.files_done = 0
+        self.interval = get_interval()
+        self.started = time.monotonic()
+        self.next_report = self.started + self.interval
+        self.next_check = CHECK_ROWS
+        if not self.interval:
+            # Never checks the time
+            self.next_check = float('inf')
+
+    def update(self, count=1):
+        """Adds work done, reporting if the interval has passed."""
+        self.done += count
+        if self.done >= self.next_check:
+            self.next_check = self.done + CHECK_ROWS
+            if time.monotonic() >= self.next_report:
+                self.report()
+
+    def file_done(self):
+        """Counts a file of the stage as done."""
+        self.files_done += 1
+
+    def report(self):
+        """Prints the work done, throughput and estimated time left."""
+        now = time.monotonic()
+        self.next_report = now + self.interval
+        rate = self.done / (now - self.started) if now > self.started else 0.0
+        message = self.stage + ': {:,}'.format(self.done)
+        if self.total:
+            message += ' of {:,} {} ({:.1%})'.format(self.total, self.unit,
+                                                    min(self.done / self.total, 1.0))
+        else:
+            message += ' ' + self.unit
+        if self.files is not None:
+            message += ', {} of {} files'.format(self.files_done, self.files)
+        message += ', {:,.0f} {}/sec'.format(rate, self.unit)
+        if self.total and rate:
+            message += ', ETA ' + format_eta(max(self.total - self.done, 0) / rate)
+        print(message)
+
+    def drain(self, work_queue, timeout=1.0):
+        """Adds the work done sent by worker processes over a queue.
+
+        Waits up to timeout seconds for work to be sent, so it can be
+        called in a loop while waiting on workers.
+        """
+        try:
+            count = work_queue.get(timeout=timeout)
+            while True:
+                self.update(count)
+                count = work_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self.interval and time.monotonic() >= self.next_report:
+            self.report()
+
+    def finish(self):
+        """Prints the work done and throughput of the whole stage."""
+        if not self.interval:
+            return
+        seconds = time.monotonic() - self.started
+        rate = self.done / seconds if seconds else 0.0
+        print(self.stage + ': {:,} {} done in {}, {:,.0f} {}/sec'.format(
+            self.done, self.unit, format_eta(seconds), rate, self.unit))
+
+def init_worker(work_queue):
+    """Sends the work done by tasks of a worker process over a queue.
+
+    Meant as the initializer of a multiprocessing.Pool.
+    """
+    global _SINK
+    _SINK = work_queue.put
+
+@contextlib.contextmanager
+def reporting_to(progress):
+    """Adds the work done by tasks run in this process to a Progress."""
+    global _SINK
+    previous = _SINK
+    _SINK = progress.update
+    try:
+        yield progress
+    finally:
+        _SINK = previous
+
+class TaskProgress:
+    """Sends the work done by a task to the Progress of its stage.
+
+    Work done is batched and sent about once every SEND_INTERVAL seconds,
+    and does nothing when no Progress is being reported to. Like a
+    Progress, it is updated with update() and finished with finish().
+
+    Attributes:
+        pending (int): Work done not yet sent.
+    """
+
+    def __init__(self):
+        """See class docstring."""
+        self.sink = _SINK
+        self.pending = 0
+        self.next_send = time.monotonic() + SEND_INTERVAL
+        self.next_check = CHECK_ROWS if self.sink is not None else float('inf')
+
+    def update(self, count=1):
+        """Adds work done, sending it if due."""
+        self.pending += count
+        if self.pending >= self.next_check:
+            self.next_check = self.pending + CHECK_ROWS
+            if time.monotonic() >= self.next_send:
+                self.send()
+
+    def send(self):
+        """Sends the work done so far."""
+        if self.sink is not None and self.pending:
+            self.sink(self.pending)
+        self.pending = 0
+        self.next_check = CHECK_ROWS if self.sink is not None else float('inf')
+        self.next_send = time.monotonic() + SEND_INTERVAL
+
+    def finish(self):
+        """Sends the work left at the end of the task."""
+        self.send()
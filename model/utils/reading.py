@@ -12,4 +12,30 @@ def file_reader(file_obj):
     return file_obj.read().splitlines()
     
 def json_reader(file_obj):
-    return json.load(file_obj)
\ No newline at end of file
+    return json.load(file_obj)
+
+def count_lines(file_name):
+    """Counts the lines of a file, without parsing them."""
+    with open(file_name, 'rb') as read:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: read.read(1 << 20), b''))
+
+
+def read_range(file_name, start, end):
+    """Reads the lines of a file between two byte offsets.
+
+    Inputs:
+        file_name (str): Path to the file.
+        start (int): Byte offset of the first line.
+        end (int): Byte offset just past the last line.
+
+    Returns:
+        lines (generator): Every line in the range, decoded.
+    """
+    with open(file_name, 'rb') as read:
+        read.seek(start)
+        position = start
+        for line in read:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
@@ -0,0 +1,610 @@
+'''
+Module for compiling and loading the reference data bundle.
+
+Every module re-parses the same reference .csv files (county centroids,
+county adjacency, the Journey to Work census, income and employment by
+industry, the state list and the school databases), several of them once
+per county. The bundle holds all of them pre-parsed in a single directory:
+tabular data as NumPy .npy files that are memory mapped on load, and small
+lookups and the school databases as pickles. A manifest records the
+bundle version and the modification time, size and hash of every source,
+so a bundle built from outdated sources is never used.
+
+The bundle is built with:
+    python module_runner.py compile-refdata
+
+Readers in the other modules call load(), which returns None whenever
+no current bundle exists, in which case they fall back to the .csv files.
+'''
+
+import os
+import json
+import struct
+import shutil
+import pickle
+import hashlib
+import zipfile
+from datetime import datetime
+import numpy as np
+from . import paths, reading
+
+# Bumped whenever the layout of the bundle changes
+BUNDLE_VERSION = 2
+BUNDLE_DIR_NAME = 'refdata'
+MANIFEST_FILE = 'manifest.json'
+# Arrays of the Journey to Work matrix, see compile_j2w()
+J2W_ARRAYS = ['j2w_fips', 'j2w_offsets', 'j2w_dest', 'j2w_workers']
+# Size of the fixed part of a .zip local file header
+ZIP_LOCAL_HEADER = 30
+# School database tables, keyed by the path prefix (relative to
+# paths.SCHOOL_DBASE) of the files they contain
+SCHOOL_TABLES = [('CountyPrivateSchools/', 'private_schools'),
+                 ('CountyPublicSchools/', 'public_schools'),
+                 ('PostSecSchoolsByCounty/', 'post_sec_schools'),
+                 ('stateenrollmentindegrees.csv', 'enrollment'),
+                 ('statehighelemmidenrollment.csv', 'enrollment')]
+# Columns of SexByIndustryByCounty_MOD.csv holding the first industry
+# employment percentage for men, see industry.IncomeEmployment
+EMP_INC_INDS = [29, 41, 53, 65, 77, 89, 113, 125, 137, 161,
+                173, 197, 209, 221, 245, 257, 281, 293, 305, 317]
+
+# Process-level cache of the loaded bundle, see load()
+_BUNDLE = None
+_BUNDLE_CHECKED = False
+
+def bundle_path():
+    """Returns the directory holding the reference data bundle."""
+    return paths.WORKFLOW + BUNDLE_DIR_NAME + '/'
+
+def source_files():
+    """Lists the single file sources of the bundle.
+
+    Returns:
+        sources (dict): Associates the name of each source with its path.
+    """
+    return {'all_counties': paths.WORKFLOW + 'allCounties.csv',
+            'county_adjacency': paths.WORKFLOW + 'county_adjacency2010.csv',
+            'j2w': paths.WORKFLOW + 'J2W.txt',
+            'sex_by_industry': paths.EMPLOYMENT + 'SexByIndustryByCounty_MOD.csv',
+            'states': paths.MAIN_DRIVE + 'ListofStates.csv'}
+
+def school_table_sources():
+    """Lists the school database sources of each bundled table.
+
+    Returns:
+        sources (dict): Associates each table name with a list of file or
+            directory paths relative to paths.SCHOOL_DBASE.
+    """
+    sources = dict()
+    for prefix, table in SCHOOL_TABLES:
+        sources.setdefault(table, []).append(prefix)
+    return sources
+
+def hash_file(file_path):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as read:
+        for block in iter(lambda: read.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_stamp(file_path):
+    """Returns the modification time and size of a file."""
+    stat = os.stat(file_path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def walk_files(root):
+    """Lists every file below a directory, in os.listdir() order.
+
+    Inputs:
+        root (str): Directory to walk, ending in '/'.
+
+    Returns:
+        dirs (dict): Associates every directory, relative to root, with
+            the names of the files it directly contains.
+    """
+    dirs = dict()
+    pending = ['']
+    while pending:
+        rel_dir = pending.pop()
+        names = []
+        for name in os.listdir(root + rel_dir):
+            if os.path.isdir(root + rel_dir + name):
+                pending.append(rel_dir + name + '/')
+            else:
+                names.append(name)
+        dirs[rel_dir] = names
+    return dirs
+
+def school_table_files(table):
+    """Lists every file of a school table, relative to paths.SCHOOL_DBASE.
+
+    Inputs:
+        table (str): Name of the school table.
+
+    Returns:
+        dirs (dict): Associates every directory of the table with the names
+            of the files it directly contains.
+    """
+    dirs = dict()
+    for prefix in school_table_sources()[table]:
+        if prefix.endswith('/'):
+            if os.path.isdir(paths.SCHOOL_DBASE + prefix):
+                for rel_dir, names in walk_files(paths.SCHOOL_DBASE + prefix).items():
+                    dirs[prefix + rel_dir] = names
+        elif os.path.isfile(paths.SCHOOL_DBASE + prefix):
+            dirs.setdefault('', []).append(prefix)
+    return dirs
+
+def listing_stamp(dirs):
+    """Builds a digest of the modification times and sizes of school files.
+
+    Inputs:
+        dirs (dict): See school_table_files().
+
+    Returns:
+        digest (str): SHA-1 hex digest, which changes whenever a file is
+            added, removed or modified.
+    """
+    digest = hashlib.sha1()
+    for rel_dir in sorted(dirs):
+        for name in sorted(dirs[rel_dir]):
+            stamp = file_stamp(paths.SCHOOL_DBASE + rel_dir + name)
+            digest.update((rel_dir + name + '|' + repr(stamp['mtime']) + '|'
+                           + str(stamp['size']) + '\n').encode())
+    return digest.hexdigest()
+
+def read_csv_rows(file_path, skip_header=False):
+    """Reads every row of a .csv file.
+
+    Inputs:
+        file_path (str): Path to the .csv file.
+        skip_header (bool): Whether to drop the first row.
+
+    Returns:
+        rows (list): Every row of the file, as lists of str.
+    """
+    with open(file_path) as read:
+        reader = reading.csv_reader(read)
+        if skip_header:
+            next(reader, None)
+        return list(reader)
+
+def compile_counties(file_path):
+    """Compiles allCounties.csv into arrays of FIPS, centroid and name."""
+    rows = read_csv_rows(file_path, skip_header=True)
+    return {'county_fips': np.array([row[3] for row in rows], dtype=str),
+            'county_lat': np.array([row[4] for row in rows], dtype=str),
+            'county_lon': np.array([row[5] for row in rows], dtype=str),
+            'county_name': np.array([row[6] for row in rows], dtype=str)}
+
+def compile_adjacency(file_path):
+    """Compiles county_adjacency2010.csv into CSR style arrays.
+
+    The neighbors of the county with FIPS code adjacency_home[i] are held
+    in adjacency_name and adjacency_fips, between adjacency_offsets[i]
+    and adjacency_offsets[i + 1], in file order.
+    """
+    neighbors = dict()
+    for row in read_csv_rows(file_path):
+        neighbors.setdefault(row[1], []).append((row[2], row[3]))
+    homes = list(neighbors)
+    offsets = np.cumsum([0] + [len(neighbors[home]) for home in homes])
+    flat = [neighbor for home in homes for neighbor in neighbors[home]]
+    return {'adjacency_home': np.array(homes, dtype=str),
+            'adjacency_offsets': offsets.astype(np.int64),
+            'adjacency_name': np.array([name for name, _ in flat], dtype=str),
+            'adjacency_fips': np.array([fips for _, fips in flat], dtype=str)}
+
+def compile_j2w(file_path):
+    """Compiles J2W.txt into a compressed sparse row (CSR) matrix.
+
+    Every county in the census, as origin or destination, has an index
+    into j2w_fips, origins first, in file order. Worker flows out of the
+    county of index i are held in j2w_dest, as destination county indexes,
+    and j2w_workers, between j2w_offsets[i] and j2w_offsets[i + 1].
+    Duplicate flows keep the last value, as the census was always read.
+    """
+    flows = dict()
+    for row in read_csv_rows(file_path, skip_header=True):
+        flows.setdefault(row[0] + row[1], dict())[row[2] + row[3]] = int(row[4])
+    fips = list(flows)
+    index = {county: idx for idx, county in enumerate(fips)}
+    for dests in flows.values():
+        for dest in dests:
+            if dest not in index:
+                index[dest] = len(fips)
+                fips.append(dest)
+    offsets = np.cumsum([0] + [len(flows.get(county, ())) for county in fips])
+    return {'j2w_fips': np.array(fips, dtype=str),
+            'j2w_offsets': offsets.astype(np.int64),
+            'j2w_dest': np.array([index[dest] for dests in flows.values() for dest in dests],
+                                 dtype=np.int32),
+            'j2w_workers': np.array([workers for dests in flows.values()
+                                     for workers in dests.values()], dtype=np.int32)}
+
+def sex_by_industry_columns():
+    """Lists every numeric column of SexByIndustryByCounty_MOD.csv in use.
+
+    For each industry, these are the total employment, the male and female
+    employment percentages and the male and female median incomes.
+    """
+    columns = set()
+    for ind in EMP_INC_INDS:
+        columns.update((ind - 2, ind, ind + 2, ind + 6, ind + 8))
+    return sorted(columns)
+
+def compile_sex_by_industry(file_path):
+    """Compiles SexByIndustryByCounty_MOD.csv into identifier and value arrays."""
+    rows = read_csv_rows(file_path, skip_header=True)
+    columns = sex_by_industry_columns()
+    values = np.empty((len(rows), len(columns)), dtype=np.float64)
+    for idx, row in enumerate(rows):
+        values[idx] = [float(row[column]) for column in columns]
+    return {'industry_ids': np.array([row[0:3] for row in rows], dtype=str).reshape(-1, 3),
+            'industry_columns': np.array(columns, dtype=np.int64),
+            'industry_values': values}
+
+def compile_school_table(table):
+    """Reads every file of a school table.
+
+    Returns:
+        table_data (dict): With key 'dirs', see school_table_files(), and
+            key 'files', associating the path of every file relative to
+            paths.SCHOOL_DBASE with its rows, as tuples of str.
+    """
+    dirs = school_table_files(table)
+    files = dict()
+    for rel_dir, names in dirs.items():
+        for name in names:
+            rows = read_csv_rows(paths.SCHOOL_DBASE + rel_dir + name)
+            files[rel_dir + name] = [tuple(row) for row in rows]
+    return {'dirs': dirs, 'files': files}
+
+def compile_bundle(output_dir=None):
+    """Compiles every reference source into a bundle.
+
+    The bundle is written to a temporary directory first and only moved
+    into place once complete, so readers never see a partial bundle.
+
+    Inputs:
+        output_dir (str): Directory to write the bundle to. Defaults to
+            bundle_path().
+
+    Returns:
+        manifest (dict): Manifest of the written bundle.
+    """
+    global _BUNDLE, _BUNDLE_CHECKED
+    if output_dir is None:
+        output_dir = bundle_path()
+    output_dir = output_dir.rstrip('/')
+    temp_dir = output_dir + '.tmp'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    start_time = datetime.now()
+    sources = source_files()
+    manifest = {'version': BUNDLE_VERSION, 'created': str(start_time),
+                'sources': dict(), 'school_tables': dict(), 'arrays': []}
+    compilers = [('all_counties', compile_counties),
+                 ('county_adjacency', compile_adjacency),
+                 ('j2w', compile_j2w),
+                 ('sex_by_industry', compile_sex_by_industry)]
+    for name, compiler in compilers:
+        print('Compiling', sources[name])
+        for array_name, array in compiler(sources[name]).items():
+            np.save(temp_dir + '/' + array_name + '.npy', array)
+            manifest['arrays'].append(array_name)
+    print('Compiling', sources['states'])
+    with open(temp_dir + '/states.pickle', 'wb') as write:
+        pickle.dump(read_csv_rows(sources['states']), write,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    for name, file_path in sources.items():
+        manifest['sources'][name] = dict(file_stamp(file_path), path=file_path,
+                                         sha1=hash_file(file_path))
+    for table in school_table_sources():
+        print('Compiling school table', table)
+        table_data = compile_school_table(table)
+        with open(temp_dir + '/' + table + '.pickle', 'wb') as write:
+            pickle.dump(table_data, write, protocol=pickle.HIGHEST_PROTOCOL)
+        content = hashlib.sha1()
+        for rel_path in sorted(table_data['files']):
+            content.update((rel_path + '|' + hash_file(paths.SCHOOL_DBASE + rel_path)
+                            + '\n').encode())
+        manifest['school_tables'][table] = {'files': len(table_data['files']),
+                                            'stamp': listing_stamp(table_data['dirs']),
+                                            'sha1': content.hexdigest()}
+    with open(temp_dir + '/' + MANIFEST_FILE, 'w') as write:
+        json.dump(manifest, write, indent=2, sort_keys=True)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(temp_dir, output_dir)
+    _BUNDLE, _BUNDLE_CHECKED = None, False
+    print('Reference data bundle written to', output_dir, 'in',
+          str(datetime.now() - start_time))
+    return manifest
+
+def save_npz(file_path, arrays):
+    """Writes arrays to an uncompressed .npz file, so it can be memory mapped.
+
+    The file is written under a temporary name first and then renamed, so
+    processes loading it concurrently never see a partial file.
+
+    Inputs:
+        file_path (str): Path of the .npz file.
+        arrays (dict): Associates each array name with its array.
+    """
+    temp_path = file_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'wb') as write:
+        np.savez(write, **arrays)
+    os.replace(temp_path, file_path)
+
+def load_npz(file_path):
+    """Memory maps the arrays of an uncompressed .npz file.
+
+    np.load() reads every array of a .npz file into memory, since the
+    arrays are members of a .zip archive. Members written by save_npz()
+    are stored uncompressed, so each array is memory mapped at the offset
+    of its data in the file instead.
+
+    Inputs:
+        file_path (str): Path of the .npz file.
+
+    Returns:
+        arrays (dict): Associates each array name with its memory map, or
+            None if the file is missing or not a readable .npz file.
+    """
+    arrays = dict()
+    try:
+        with zipfile.ZipFile(file_path) as archive, open(file_path, 'rb') as read:
+            for info in archive.infolist():
+                name = info.filename[:-len('.npy')]
+                if info.compress_type != zipfile.ZIP_STORED:
+                    with archive.open(info) as member:
+                        arrays[name] = np.lib.format.read_array(member)
+                    continue
+                read.seek(info.header_offset)
+                header = read.read(ZIP_LOCAL_HEADER)
+                name_size, extra_size = struct.unpack('<HH', header[26:30])
+                read.seek(info.header_offset + ZIP_LOCAL_HEADER + name_size + extra_size)
+                version = np.lib.format.read_magic(read)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(read)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(read)
+                if not np.prod(shape, dtype=np.int64):
+                    # Empty arrays cannot be memory mapped
+                    arrays[name] = np.empty(shape, dtype=dtype)
+                    continue
+                arrays[name] = np.memmap(file_path, dtype=dtype, mode='r', offset=read.tell(),
+                                         shape=shape, order='F' if fortran_order else 'C')
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+    return arrays
+
+def read_manifest(bundle_dir=None):
+    """Reads the manifest of a bundle, or returns None if it has none."""
+    if bundle_dir is None:
+        bundle_dir = bundle_path()
+    try:
+        with open(bundle_dir + MANIFEST_FILE) as read:
+            return json.load(read)
+    except (OSError, ValueError):
+        return None
+
+def stale_sources(manifest):
+    """Lists the sources that changed since a bundle was compiled.
+
+    Only modification times and sizes are compared, hashing every source
+    on each load would defeat the purpose of the bundle.
+
+    Inputs:
+        manifest (dict): Manifest of the bundle.
+
+    Returns:
+        stale (list): Names of every changed source.
+    """
+    stale = []
+    for name, file_path in source_files().items():
+        recorded = manifest['sources'].get(name)
+        try:
+            stamp = file_stamp(file_path)
+        except OSError:
+            stale.append(name)
+            continue
+        if (recorded is None or recorded['path'] != file_path
+                or recorded['mtime'] != stamp['mtime'] or recorded['size'] != stamp['size']):
+            stale.append(name)
+    for table in school_table_sources():
+        recorded = manifest['school_tables'].get(table)
+        if recorded is None or recorded['stamp'] != listing_stamp(school_table_files(table)):
+            stale.append(table)
+    return stale
+
+class Bundle:
+    """Read access to a compiled reference data bundle.
+
+    Arrays are memory mapped, and the lookups built from them as well as
+    the pickled school tables are only loaded on first use.
+
+    Attributes:
+        bundle_dir (str): Directory holding the bundle.
+        manifest (dict): Manifest of the bundle.
+        arrays (dict): Associates each array name with its memory map.
+    """
+
+    def __init__(self, bundle_dir, manifest):
+        """See class docstring."""
+        self.bundle_dir = bundle_dir
+        self.manifest = manifest
+        self.arrays = {name: np.load(bundle_dir + name + '.npy', mmap_mode='r')
+                       for name in manifest['arrays']}
+        self._indexes = dict()
+        self._pickles = dict()
+
+    def _index(self, array_name):
+        """Associates each value of an array with its first position."""
+        if array_name not in self._indexes:
+            index = dict()
+            for position, value in enumerate(self.arrays[array_name].tolist()):
+                index.setdefault(value, position)
+            self._indexes[array_name] = index
+        return self._indexes[array_name]
+
+    def _pickle(self, name):
+        """Loads a pickled part of the bundle."""
+        if name not in self._pickles:
+            with open(self.bundle_dir + name + '.pickle', 'rb') as read:
+                self._pickles[name] = pickle.load(read)
+        return self._pickles[name]
+
+    def county_coords(self, fips):
+        """Returns the centroid of a county as (lat, lon) str, or None."""
+        idx = self._index('county_fips').get(fips)
+        if idx is None:
+            return None
+        return str(self.arrays['county_lat'][idx]), str(self.arrays['county_lon'][idx])
+
+    def counties(self):
+        """Returns county name data, see core.read_counties()."""
+        return [[fips, name.split(' ')] for fips, name in
+                zip(self.arrays['county_fips'].tolist(), self.arrays['county_name'].tolist())]
+
+    def neighbors(self, fips):
+        """Returns the (name, FIPS code) of every county adjacent to a county.
+
+        As in county_adjacency2010.csv, the county itself is included.
+        """
+        idx = self._index('adjacency_home').get(fips)
+        if idx is None:
+            return []
+        start, end = self.arrays['adjacency_offsets'][idx:idx + 2].tolist()
+        return list(zip(self.arrays['adjacency_name'][start:end].tolist(),
+                        self.arrays['adjacency_fips'][start:end].tolist()))
+
+    def j2w(self):
+        """Returns the Journey to Work matrix arrays, see compile_j2w()."""
+        return {name: self.arrays[name] for name in J2W_ARRAYS}
+
+    def sex_by_industry(self):
+        """Returns income and employment data by industry.
+
+        Returns:
+            ids (ndarray): Row identifiers, the first three columns of
+                SexByIndustryByCounty_MOD.csv.
+            columns (list): Column numbers of the values.
+            values (ndarray): Numeric values, one row per county.
+        """
+        return (self.arrays['industry_ids'], self.arrays['industry_columns'].tolist(),
+                self.arrays['industry_values'])
+
+    def states(self):
+        """Returns the rows of ListofStates.csv."""
+        return [list(row) for row in self._pickle('states')]
+
+    def _school_table(self, file_path):
+        """Finds the school table and relative path of a school file.
+
+        Returns:
+            table (str): Name of the table, or None if not bundled.
+            rel_path (str): Path relative to paths.SCHOOL_DBASE.
+        """
+        if not file_path.startswith(paths.SCHOOL_DBASE):
+            return None, None
+        rel_path = file_path[len(paths.SCHOOL_DBASE):]
+        for prefix, table in SCHOOL_TABLES:
+            if rel_path.startswith(prefix):
+                return table, rel_path
+        return None, None
+
+    def rows(self, file_path):
+        """Returns the rows of a bundled school database file.
+
+        Inputs:
+            file_path (str): Full path of the file.
+
+        Returns:
+            rows (list): Rows of the file as lists of str, or None if the
+                file does not belong to the bundle.
+
+        Raises:
+            FileNotFoundError: If the file belongs to a bundled directory
+                but does not exist.
+        """
+        table, rel_path = self._school_table(file_path)
+        if table is None:
+            return None
+        rows = self._pickle(table)['files'].get(rel_path)
+        if rows is None:
+            raise FileNotFoundError(file_path)
+        return [list(row) for row in rows]
+
+    def listdir(self, dir_path):
+        """Returns the files in a bundled school database directory.
+
+        Returns:
+            names (list): File names, or None if the directory does not
+                belong to the bundle.
+        """
+        table, rel_dir = self._school_table(dir_path)
+        if table is None:
+            return None
+        names = self._pickle(table)['dirs'].get(rel_dir)
+        if names is None:
+            raise FileNotFoundError(dir_path)
+        return list(names)
+
+def load():
+    """Loads the reference data bundle, once per process.
+
+    Returns:
+        bundle (Bundle): The bundle, or None if there is no bundle, it was
+            built by a different version, or any of its sources changed.
+    """
+    global _BUNDLE, _BUNDLE_CHECKED
+    if _BUNDLE_CHECKED:
+        return _BUNDLE
+    _BUNDLE_CHECKED = True
+    bundle_dir = bundle_path()
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        return None
+    if manifest.get('version') != BUNDLE_VERSION:
+        print('Ignoring reference data bundle built by version', manifest.get('version'))
+        return None
+    stale = stale_sources(manifest)
+    if stale:
+        print('Ignoring outdated reference data bundle, changed sources:', ', '.join(stale))
+        return None
+    _BUNDLE = Bundle(bundle_dir, manifest)
+    return _BUNDLE
+
+def read_rows(file_path):
+    """Reads the rows of a school database .csv file, from the bundle if possible.
+
+    Inputs:
+        file_path (str): Full path of the file.
+
+    Returns:
+        rows (list): Rows of the file as lists of str.
+    """
+    bundle = load()
+    if bundle is not None:
+        rows = bundle.rows(file_path)
+        if rows is not None:
+            return rows
+    return read_csv_rows(file_path)
+
+def listdir(dir_path):
+    """Lists the files of a school database directory, from the bundle if possible.
+
+    Inputs:
+        dir_path (str): Full path of the directory, ending in '/'.
+
+    Returns:
+        names (list): Names of the files in the directory.
+    """
+    bundle = load()
+    if bundle is not None:
+        names = bundle.listdir(dir_path)
+        if names is not None:
+            return names
+    return [name for name in os.listdir(dir_path) if os.path.isfile(dir_path + name)]
@@ -0,0 +1,114 @@
+'''
+Module for drawing weighted random samples.
+
+The AliasSampler replaces the pattern of building a CDF with core.cdf()
+and searching it with bisect for every draw. Its tables are built once
+from a list of weights with Vose's alias method, after which every draw
+takes constant time.
+'''
+
+import os
+import math
+import random
+import numpy as np
+
+# Unlike the random module, NumPy does not reseed its global random state
+# in forked processes (pool workers, states run in parallel), so every
+# child would draw the same numbers as its siblings
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=np.random.seed)
+
+class AliasSampler:
+    """Draws indices with probability proportional to a list of weights.
+
+    A weight vector that sums to zero is treated as uniform over all of
+    its indices. An empty weight vector can be constructed, but drawing
+    from it raises a ValueError.
+
+    Attributes:
+        size (int): Number of weights, i.e. the number of drawable indices.
+        total (float): Sum of the weights.
+        prob (list): Probability of keeping each column of the alias table.
+        alias (list): Index drawn when a column is not kept.
+    """
+
+    def __init__(self, weights):
+        """Builds the alias table for a list of weights.
+
+        Inputs:
+            weights (list or ndarray): Non-negative, finite numeric weights.
+
+        Raises:
+            ValueError: If any weight is negative, infinite or nan.
+        """
+        weights = np.asarray(weights, dtype=float).tolist()
+        if not all(0 <= weight < math.inf for weight in weights):
+            raise ValueError('Weights must be non-negative and finite')
+        self.size = len(weights)
+        self.total = sum(weights)
+        self.prob, self.alias = self.build_tables(weights)
+        self._prob_array = None
+        self._alias_array = None
+
+    def build_tables(self, weights):
+        """Builds probability and alias tables with Vose's alias method.
+
+        Inputs:
+            weights (list): Non-negative numeric weights.
+
+        Returns:
+            prob (list): Probability of keeping each column.
+            alias (list): Index drawn when a column is not kept.
+        """
+        prob = [1.0] * self.size
+        alias = list(range(self.size))
+        if self.size == 0 or self.total == 0:
+            return prob, alias
+        scaled = [weight * self.size / self.total for weight in weights]
+        small = [idx for idx, value in enumerate(scaled) if value < 1.0]
+        large = [idx for idx, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Anything left over is only off from 1.0 by rounding error
+        for idx in small + large:
+            prob[idx] = 1.0
+        return prob, alias
+
+    def __len__(self):
+        return self.size
+
+    def draw(self, n=None):
+        """Draws one index, or an array of n indices.
+
+        Single draws use the random module, vectorized draws use NumPy's
+        global random state.
+
+        Inputs:
+            n (int): Number of indices to draw. If None, a single index
+                is drawn and returned as an int.
+
+        Returns:
+            idx (int or ndarray): Drawn index or indices.
+        """
+        if self.size == 0:
+            raise ValueError('Cannot draw from an empty weight vector')
+        if n is None:
+            split = random.random() * self.size
+            idx = int(split)
+            if split - idx < self.prob[idx]:
+                return idx
+            return self.alias[idx]
+        if self._prob_array is None:
+            self._prob_array = np.array(self.prob)
+            self._alias_array = np.array(self.alias, dtype=np.int64)
+        splits = np.random.random_sample(n) * self.size
+        idx = splits.astype(np.int64)
+        keep = (splits - idx) < self._prob_array[idx]
+        return np.where(keep, idx, self._alias_array[idx])
@@ -0,0 +1,294 @@
+'''
+Module for running a module over several states at once.
+
+Each state runs in its own process. Peak memory of a state is estimated
+from the size of its input file, and states are only started while the
+estimates of all running states fit in a memory budget. States are
+started largest first, so that the largest states, which take the
+longest, do not end up running alone at the end of a run. Smaller states
+are started whenever the next largest state does not fit.
+
+Wall time and peak resident memory are reported for every state.
+'''
+
+import os
+import time
+import queue
+import importlib
+import traceback
+import multiprocessing
+from datetime import datetime
+from . import paths, intermediate, profiling, memory
+
+# Input file of each module, relative to the output folder it is read from
+MODULE_INPUTS = {'module2': (0, 'Module1NN2ndRun.csv'),
+                 'module3': (1, 'Module2NN_AllWorkersEmployed_SortedResidenceCounty.csv'),
+                 'module4': (2, 'Module3NN_AssignedSchool.csv'),
+                 'module5': (3, 'Module4NN2ndRun.csv'),
+                 'pipeline': (0, 'Module1NN2ndRun.csv')}
+# Modules whose input is handed off in the intermediate format
+INTERMEDIATE_INPUTS = ('module3', 'module4', 'module5')
+# Memory held by a state regardless of its size, mostly reference data
+BASE_MEMORY = 1024 ** 3
+# Peak memory per byte of input file, per module
+MEMORY_PER_INPUT_BYTE = {'module2': 0.5, 'module3': 0.5, 'module4': 0.25,
+                         'module5': 1.0, 'pipeline': 0.75}
+DEFAULT_MEMORY_PER_INPUT_BYTE = 1.0
+# Modules that fork a pool of workers when given more than one processor,
+# each worker loading its own copy of the reference data
+POOLED_MODULES = ('module2', 'module5')
+# Seconds between checks on running states
+POLL_INTERVAL = 1.0
+
+def input_file(module, state):
+    """Returns the path to the input file of a module for a state.
+
+    Inputs:
+        module (str): Module name (e.g. module2).
+        state (str): State name, without spaces.
+
+    Returns:
+        input_file (str): Path to the input file, or None if unknown.
+    """
+    if module not in MODULE_INPUTS:
+        return None
+    folder, suffix = MODULE_INPUTS[module]
+    file_name = paths.MODULES[folder] + state + suffix
+    if module in INTERMEDIATE_INPUTS:
+        file_name = intermediate.file_path(file_name)
+    return file_name
+
+def path_size(path):
+    """Returns the size of a file, or every file below a directory, in bytes."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+def worker_count(module, processors):
+    """Returns the number of pool workers a module forks for a state.
+
+    Inputs:
+        module (str): Module name (e.g. module2).
+        processors (int): Number of processors passed to the module, or None.
+
+    Returns:
+        workers (int): Number of pool workers, 0 if the module runs serially.
+    """
+    if module not in POOLED_MODULES or processors is None or processors <= 1:
+        return 0
+    return processors
+
+def estimate_memory(module, state, processors=None):
+    """Estimates the peak memory of running a module for a state.
+
+    Every pool worker is counted at BASE_MEMORY on top of the state itself.
+
+    Inputs:
+        module (str): Module name (e.g. module2).
+        state (str): State name, without spaces.
+        processors (int): Number of processors passed to the module, or None.
+
+    Returns:
+        memory (int): Estimated peak memory, in bytes.
+    """
+    file_name = input_file(module, state)
+    try:
+        size = path_size(file_name) if file_name is not None else 0
+    except OSError:
+        size = 0
+    factor = MEMORY_PER_INPUT_BYTE.get(module, DEFAULT_MEMORY_PER_INPUT_BYTE)
+    return BASE_MEMORY * (1 + worker_count(module, processors)) + int(size * factor)
+
+def total_memory():
+    """Returns the physical memory of the machine in bytes, if known."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().total
+
+def run_state(module, state, processors, results, resume=False):
+    """Runs a module for a single state, reporting on a queue when done.
+
+    Inputs:
+        module (str): Module name (e.g. module2).
+        state (str): State name, without spaces.
+        processors (int): Number of processors passed to the module, or None.
+        results (multiprocessing.Queue): Gets a dictionary with the state,
+            wall time, peak memory and error, if any. Peak memory adds the
+            peak of the largest pool worker once for every worker, as the
+            workers run side by side.
+        resume (bool): Whether to skip steps completed by a previous run.
+    """
+    start = time.time()
+    error = None
+    memory.start()
+    try:
+        imported_module = importlib.import_module('.' + module + '.' + module, 'model')
+        options = {'resume': True} if resume else {}
+        with profiling.profiled(module, state):
+            if processors is not None:
+                imported_module.main(state, processors, **options)
+            else:
+                imported_module.main(state, **options)
+    except Exception:
+        error = traceback.format_exc()
+    peak = memory.peak_rss()
+    worker_peak = memory.peak_rss(children=True)
+    if peak is not None and worker_peak:
+        peak += worker_peak * max(worker_count(module, processors), 1)
+    results.put({'state': state, 'wall_time': time.time() - start,
+                 'peak_rss': peak, 'error': error})
+
+class StateJob:
+    """A state waiting for, or running in, its own process.
+
+    Attributes:
+        state (str): State name, without spaces.
+        memory (int): Estimated peak memory, in bytes.
+        process (multiprocessing.Process): Process running the state.
+        start (float): Time the process was started.
+        result (dict): Result reported by run_state().
+    """
+
+    def __init__(self, state, memory):
+        """See class docstring."""
+        self.state = state
+        self.memory = memory
+        self.process = None
+        self.start = None
+        self.result = None
+
+class StateScheduler:
+    """Runs a module over several states in parallel under a memory budget.
+
+    Attributes:
+        module (str): Module name (e.g. module2).
+        processors (int): Number of processors passed to the module, or None.
+        max_jobs (int): Maximum number of states run at once.
+        memory_budget (int): Bytes of estimated peak memory that running
+            states may use together. A state whose estimate exceeds the
+            budget on its own is run once no other state is running.
+        resume (bool): Whether states skip steps completed by a previous run.
+    """
+
+    def __init__(self, module, processors=None, max_jobs=None, memory_budget=None,
+                 resume=False):
+        """See class docstring."""
+        self.module = module
+        self.resume = resume
+        self.processors = processors
+        self.max_jobs = max_jobs or multiprocessing.cpu_count()
+        if memory_budget is None:
+            memory_budget = total_memory() or self.max_jobs * BASE_MEMORY
+        self.memory_budget = memory_budget
+
+    def run(self, states):
+        """Runs the module for every state.
+
+        Inputs:
+            states (list): State names, without spaces.
+
+        Returns:
+            results (list): Result of every state, see run_state(), with
+                the estimated memory added, in order of completion.
+        """
+        pending = [StateJob(state, estimate_memory(self.module, state, self.processors)) for state in states]
+        pending.sort(key=lambda job: job.memory, reverse=True)
+        results = multiprocessing.Queue()
+        running = dict()
+        finished = []
+        start_time = datetime.now()
+        while pending or running:
+            self.admit(pending, running, results)
+            try:
+                result = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                job = running.pop(result['state'])
+                job.process.join()
+                self.finish(job, result, finished)
+            for state, job in list(running.items()):
+                # Processes that died without reporting, e.g. killed for memory
+                if not job.process.is_alive() and job.process.exitcode != 0:
+                    running.pop(state)
+                    self.finish(job, {'state': state, 'wall_time': time.time() - job.start,
+                                      'peak_rss': None,
+                                      'error': 'Exited with code ' + str(job.process.exitcode)},
+                                finished)
+        print('All states took this much time: ' + str(datetime.now() - start_time))
+        print_report(finished)
+        return finished
+
+    def admit(self, pending, running, results):
+        """Starts the largest pending states that fit in the memory budget."""
+        used = sum(job.memory for job in running.values())
+        for job in list(pending):
+            if len(running) >= self.max_jobs:
+                break
+            if running and used + job.memory > self.memory_budget:
+                continue
+            pending.remove(job)
+            job.process = multiprocessing.Process(target=run_state,
+                                                  args=(self.module, job.state,
+                                                        self.processors, results,
+                                                        self.resume),
+                                                  name=job.state)
+            job.start = time.time()
+            job.process.start()
+            running[job.state] = job
+            used += job.memory
+            print('Started', job.state, 'with estimated memory',
+                  format_bytes(job.memory), 'at', datetime.now())
+
+    def finish(self, job, result, finished):
+        """Records the result of a finished state."""
+        result['estimated_memory'] = job.memory
+        finished.append(result)
+        status = 'failed' if result['error'] else 'finished'
+        print(job.state, status, 'in', format_seconds(result['wall_time']),
+              'with peak memory', format_bytes(result['peak_rss']))
+        if result['error']:
+            print(result['error'])
+
+def format_bytes(num_bytes):
+    """Formats a number of bytes in megabytes."""
+    if num_bytes is None:
+        return 'unknown'
+    return '%.1f MB' % (num_bytes / 1024.0 ** 2)
+
+def format_seconds(seconds):
+    """Formats a number of seconds as h:mm:ss."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+def print_report(results):
+    """Prints wall time and memory of every state, largest first.
+
+    Inputs:
+        results (list): See StateScheduler.run().
+    """
+    print('%-20s %-8s %10s %14s %14s' % ('State', 'Status', 'Wall time',
+                                         'Peak memory', 'Estimate'))
+    for result in sorted(results, key=lambda result: result['estimated_memory'], reverse=True):
+        print('%-20s %-8s %10s %14s %14s' % (result['state'],
+                                             'failed' if result['error'] else 'ok',
+                                             format_seconds(result['wall_time']),
+                                             format_bytes(result['peak_rss']),
+                                             format_bytes(result['estimated_memory'])))
+
+def run_states(module, states, processors=None, max_jobs=None, memory_budget=None,
+               resume=False):
+    """Runs a module over several states in parallel, see StateScheduler.
+
+    Returns:
+        results (list): See StateScheduler.run().
+    """
+    return StateScheduler(module, processors, max_jobs, memory_budget, resume).run(states)
@@ -0,0 +1,97 @@
+'''
+Module for exporting timelines of module runs as Chrome traces.
+
+Tracing is opt-in, and set for a run with set_enabled() (see paths.py
+for how workers pick it up). When on, every timer of the run metrics (see
+metrics.py) records a span, with the process id, each time it is stopped:
+a span per step of a module run, per county of a per-county loop, and per
+pool task (e.g. every file passed over by a Module 5 worker). Workers send
+their spans back with their metrics.
+
+When the run report is written, the spans are also written as a Chrome
+trace (trace_event JSON), which can be opened in Perfetto
+(https://ui.perfetto.dev) or chrome://tracing. Every process has its own
+track, so stragglers and idle workers show up as gaps, e.g. a large county
+holding up a Module 5 pass, or serial sorts between passes.
+'''
+
+import os
+import json
+from . import paths
+
+TRACE_ENV = 'TRIP_GEN_TRACE'
+
+def enabled():
+    """Whether tracing is on."""
+    return os.environ.get(TRACE_ENV) == '1'
+
+def set_enabled(on):
+    """Turns tracing on or off."""
+    if on:
+        os.environ[TRACE_ENV] = '1'
+    else:
+        os.environ.pop(TRACE_ENV, None)
+
+def trace_path(stage, state):
+    """Returns the path of the trace of a stage for a state."""
+    return paths.OUTPUT + 'Traces/' + state + '_' + stage + '.json'
+
+def span_name(name, labels):
+    """Returns the name shown for a span, e.g. 'pass_1 01001' for a county."""
+    if name in ('stage', 'step'):
+        return labels.get(name, name)
+    if name == 'county':
+        return labels.get('step', '') + ' ' + labels.get('county', '')
+    return ' '.join([name] + [str(value) for _, value in sorted(labels.items())])
+
+def trace_events(spans, stage, state, main_pid):
+    """Converts spans to Chrome trace events.
+
+    Inputs:
+        spans (list): Spans as (name, labels, pid, start, stop) tuples,
+            with labels as (key, value) pairs and epoch times in seconds.
+        stage (str): Stage name, usually the module name.
+        state (str): State name, without spaces.
+        main_pid (int): Process id of the process running the stage.
+
+    Returns:
+        events (list): Complete ('X') events, in microseconds since the
+            first span started, and the name of every process.
+    """
+    if not spans:
+        return []
+    origin = min(span[3] for span in spans)
+    events = []
+    pids = set()
+    for name, labels, pid, start, stop in spans:
+        labels = dict(labels)
+        pids.add(pid)
+        events.append({'name': span_name(name, labels), 'cat': name, 'ph': 'X',
+                       'ts': (start - origin) * 1e6, 'dur': (stop - start) * 1e6,
+                       'pid': pid, 'tid': pid, 'args': labels})
+    for pid in sorted(pids):
+        if pid == main_pid:
+            process_name = stage + ' ' + state
+        else:
+            process_name = 'worker ' + str(pid)
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid,
+                       'args': {'name': process_name}})
+        # Lists the main process first, then workers in order of process id
+        events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'tid': pid,
+                       'args': {'sort_index': -1 if pid == main_pid else pid}})
+    return events
+
+def write_trace(stage, state, spans):
+    """Writes the spans of a stage for a state as a Chrome trace.
+
+    Inputs:
+        stage (str): Stage name, usually the module name.
+        state (str): State name, without spaces.
+        spans (list): Spans, see trace_events().
+    """
+    path = trace_path(stage, state)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as write:
+        json.dump({'traceEvents': trace_events(spans, stage, state, os.getpid()),
+                   'displayTimeUnit': 'ms'}, write)
+    print('Trace written to', path)
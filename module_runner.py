@@ -7,28 +7,37 @@ out code that isn't related to the core functionality behind each module.
 import importlib
 import argparse
 import model.utils.core as core
+import model.utils.paths as paths
+import model.utils.refdata as refdata
+import model.utils.intermediate as intermediate
+import model.utils.scheduler as scheduler
+import model.utils.profiling as profiling
+import model.utils.memory as memory
+import model.utils.tracing as tracing
+import model.utils.progress as progress
 
 def dynamic_module_import(module):
     package = 'model'
     return importlib.import_module('.' + module + '.' + module, package)      
 
-def module_runner(states, module, processors):
-    imported_module = dynamic_module_import(module)
+def module_runner(states, module, processors, jobs=1, memory_budget=None, resume=False):
     if states is None:
-        count = 1
-        states = core.read_states()
-        for state in states:
-            if processors is not None:
-                imported_module.main(state[0].replace(' ',''), int(processors))
-            else:
-                imported_module.main(state[0].replace(' ',''))
-            count += 1
-    else:
-        for state in states:
+        states = [state[0].replace(' ', '') for state in core.read_states()]
+    if processors is not None:
+        processors = int(processors)
+    if jobs > 1:
+        scheduler.run_states(module, states, processors, jobs, memory_budget, resume)
+        return
+    imported_module = dynamic_module_import(module)
+    memory.start()
+    # Only passed when set, as not every module can resume
+    options = {'resume': True} if resume else {}
+    for state in states:
+        with profiling.profiled(module, state):
             if processors is not None:
-                imported_module.main(state, int(processors))
+                imported_module.main(state, processors, **options)
             else:
-                imported_module.main(state)
+                imported_module.main(state, **options)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run modules within trip generator')
@@ -38,5 +47,48 @@ if __name__ == '__main__':
                         help='States to run')
     parser.add_argument('-n', '--processors',
                         help='Number of processors',)
+    parser.add_argument('-f', '--format', choices=intermediate.FORMATS,
+                        default=intermediate.get_format(),
+                        help='Format of files handed off between modules (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of states to run at once (default: %(default)s)')
+    parser.add_argument('--memory-budget', type=float,
+                        help='GB of memory that states run at once may use (default: all)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip steps completed by a previous run of the module for a state')
+    parser.add_argument('--profile', choices=profiling.MODES, default=profiling.get_mode(),
+                        help='Profile every state run and its workers (default: %(default)s)')
+    parser.add_argument('--memory', nargs='*', choices=memory.KINDS, metavar='CHECKPOINT',
+                        help='Record memory use in run reports, with top allocation sites at '
+                             'checkpoints of these kinds: ' + ', '.join(memory.KINDS)
+                             + ' (default: all)')
+    parser.add_argument('--memory-top', type=int, default=memory.DEFAULT_TOP,
+                        help='Number of top allocation sites recorded (default: %(default)s)')
+    parser.add_argument('--trace', action='store_true', default=tracing.enabled(),
+                        help='Write a Chrome trace of every state run, with a span per step, '
+                             'county and pool task')
+    parser.add_argument('--progress-interval', type=float, default=progress.get_interval(),
+                        help='Seconds between progress reports, 0 for none (default: %(default)s)')
+    parser.add_argument('--data-root',
+                        help='Data root to read from and write to (default: $'
+                             + paths.ROOT_ENV + ' or ' + paths.DEFAULT_ROOT + ')')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('compile-refdata',
+                          help='Compile reference data into a bundle for fast loading')
     args = parser.parse_args()
-    module_runner(args.states, args.module, args.processors)
\ No newline at end of file
+    if args.data_root is not None:
+        paths.set_root(args.data_root)
+    if args.command == 'compile-refdata':
+        refdata.compile_bundle()
+    else:
+        intermediate.set_format(args.format)
+        profiling.set_mode(args.profile)
+        tracing.set_enabled(args.trace)
+        progress.set_interval(args.progress_interval)
+        if args.memory is not None:
+            memory.set_checkpoints(args.memory or memory.KINDS, args.memory_top)
+        memory_budget = None
+        if args.memory_budget is not None:
+            memory_budget = int(args.memory_budget * 1024 ** 3)
+        module_runner(args.states, args.module, args.processors, args.jobs, memory_budget,
+                      args.resume)
\ No newline at end of file